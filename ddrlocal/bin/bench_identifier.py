@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""Microbenchmark: formatting a 10k-item search results page
+
+Compares webui.models.format_object over 10,000 entity results with
+Identifier interning/memoization disabled (IDENTIFIER_CACHE_SIZE=0)
+and enabled (first page load, then repeat load).
+
+    $ cd /opt/ddr-local/ddrlocal
+    $ python bin/bench_identifier.py [NUM_ITEMS] [REPEAT]
+"""
+import os
+import sys
+import timeit
+
+# app root (ddrlocal/), not bin/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ddrlocal.settings")
+
+import django
+django.setup()
+
+from django.conf import settings
+from django.test.utils import override_settings
+
+from webui.identifier import Identifier, identifier_cache_clear
+from webui.models import format_object
+
+
+def results(num):
+    """Fake Elasticsearch hits for entities in a few collections
+    """
+    return [
+        {
+            'id': 'ddr-test-%s-%s' % (n % 10 + 1, n),
+            'title': 'Entity %s' % n,
+            'signature_id': 'ddr-test-%s-%s-mezzanine-%010x' % (n % 10 + 1, n, n),
+        }
+        for n in range(1, num + 1)
+    ]
+
+def format_page(hits):
+    # as in elastictools.search.SearchResults.ordered_dict
+    return [
+        format_object(Identifier(hit['id']), dict(hit), request=None)
+        for hit in hits
+    ]
+
+def main():
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    hits = results(num)
+    timer = lambda: min(timeit.repeat(lambda: format_page(hits), number=1, repeat=repeat))
+
+    with override_settings(IDENTIFIER_CACHE_SIZE=0):
+        uncached = timer()
+    with override_settings(IDENTIFIER_CACHE_SIZE=max(settings.IDENTIFIER_CACHE_SIZE, num * 3)):
+        identifier_cache_clear()
+        first = timeit.timeit(lambda: format_page(hits), number=1)
+        cached = timer()
+
+    print('%s items' % num)
+    for label,seconds in [
+            ('uncached', uncached),
+            ('cached (first load)', first),
+            ('cached (repeat load)', cached),
+    ]:
+        print('%-22s %8.3fs %10.0f items/s  %5.1fx' % (
+            label, seconds, num / seconds, uncached / seconds
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -113,6 +113,30 @@ else:
     DOCSTORE_HOST = DOCSTORE_SSL_CERTFILE = None
     DOCSTORE_USERNAME = DOCSTORE_PASSWORD = DOCSTORE_TIMEOUT = None
     DOCSTORE_CLUSTER = {}
+# HTTP connections per Elasticsearch node kept open by each process
+# (see webui.docstores).  Should be at least the number of gunicorn threads.
+DOCSTORE_POOL_SIZE = 10
+if CONFIG.has_option('local', 'docstore_pool_size'):
+    DOCSTORE_POOL_SIZE = CONFIG.getint('local', 'docstore_pool_size')
+# Saved documents are indexed in bulk by webui.tasks.index_outbox_drain,
+# which runs this many seconds after the first save (see webui.indexqueue)
+# and every INDEX_OUTBOX_PERIOD seconds to retry updates that failed.
+INDEX_OUTBOX_DELAY = 2
+INDEX_OUTBOX_PERIOD = 60
+INDEX_OUTBOX_BATCH_SIZE = 500
+if CONFIG.has_option('local', 'index_outbox_batch_size'):
+    INDEX_OUTBOX_BATCH_SIZE = CONFIG.getint('local', 'index_outbox_batch_size')
+INDEX_OUTBOX_MAX_ATTEMPTS = 5
+# search-reindex publishes this many collections at once (see webui.indexbuild)
+REINDEX_WORKERS = 4
+if CONFIG.has_option('local', 'reindex_workers'):
+    REINDEX_WORKERS = CONFIG.getint('local', 'reindex_workers')
+REINDEX_BATCH_SIZE = 500
+# Search responses are cached this many seconds (see webui.querycache);
+# 0 disables the cache.
+QUERY_CACHE_TIMEOUT = 60 * 10
+if CONFIG.has_option('local', 'query_cache_timeout'):
+    QUERY_CACHE_TIMEOUT = CONFIG.getint('local', 'query_cache_timeout')
 RESULTS_PER_PAGE = 25
 ELASTICSEARCH_MAX_SIZE = 10000
 ELASTICSEARCH_DEFAULT_LIMIT = RESULTS_PER_PAGE
@@ -158,7 +182,21 @@ GITSTATUS_QUEUE_PATH = os.path.join(MEDIA_BASE, '.gitstatus-queue')
 # write something to this file (doesn't matter what) and remove the file
 # when they are finished.
 GITSTATUS_LOCK_PATH = os.path.join(MEDIA_BASE, '.gitstatus-stop')
-# Normally a global lockfile allows only a single gitstatus process at a time.
+# Number of Identifiers kept per process (see webui.identifier). 0 disables.
+IDENTIFIER_CACHE_SIZE = 20000
+if CONFIG.has_option('local', 'identifier_cache_size'):
+    IDENTIFIER_CACHE_SIZE = CONFIG.getint('local', 'identifier_cache_size')
+# Total size (bytes) of JSON documents kept parsed in each process
+# (see webui.documents). 0 disables the cache.
+DOCUMENT_CACHE_BYTES = 1024*1024*32
+if CONFIG.has_option('local', 'document_cache_bytes'):
+    DOCUMENT_CACHE_BYTES = CONFIG.getint('local', 'document_cache_bytes')
+# Global and collection locks (see webui.locks) expire after this many
+# seconds in case the task holding them dies.
+LOCK_TIMEOUT = 60*60*6
+if CONFIG.has_option('local', 'lock_timeout'):
+    LOCK_TIMEOUT = CONFIG.getint('local', 'lock_timeout')
+# Normally a global lock allows only a single gitstatus process at a time.
 # To allow multiple processes (e.g. multiple VMs using a shared storage device),
 # add the following setting to /etc/ddr/local.cfg:
 #     gitstatus_use_global_lock=0
@@ -168,6 +206,41 @@ if CONFIG.has_option('local', 'gitstatus_use_global_lock'):
 # Minimum interval between git-status updates per collection repository.
 GITSTATUS_INTERVAL = 60*60*1
 GITSTATUS_BACKOFF = 30
+# Maximum number of due collections refreshed per gitstatus_update_store run,
+# and number of git-status/git-annex-status processes run at the same time.
+# Lower these on slow USB drives.
+GITSTATUS_BATCH_SIZE = 10
+if CONFIG.has_option('local', 'gitstatus_batch_size'):
+    GITSTATUS_BATCH_SIZE = CONFIG.getint('local', 'gitstatus_batch_size')
+GITSTATUS_WORKERS = 4
+if CONFIG.has_option('local', 'gitstatus_workers'):
+    GITSTATUS_WORKERS = CONFIG.getint('local', 'gitstatus_workers')
+# Each collection's refresh interval is learned from how often it changes,
+# starting at GITSTATUS_INTERVAL and kept between these bounds (seconds).
+GITSTATUS_INTERVAL_MIN = 60*5
+if CONFIG.has_option('local', 'gitstatus_interval_min'):
+    GITSTATUS_INTERVAL_MIN = CONFIG.getint('local', 'gitstatus_interval_min')
+GITSTATUS_INTERVAL_MAX = 60*60*24
+if CONFIG.has_option('local', 'gitstatus_interval_max'):
+    GITSTATUS_INTERVAL_MAX = CONFIG.getint('local', 'gitstatus_interval_max')
+# Tasks that modify a collection request a gitstatus refresh instead of
+# running one; requests within this window (seconds) share one refresh.
+GITSTATUS_REFRESH_WINDOW = 10
+if CONFIG.has_option('local', 'gitstatus_refresh_window'):
+    GITSTATUS_REFRESH_WINDOW = CONFIG.getint('local', 'gitstatus_refresh_window')
+# How often (seconds) local branches are compared with the Gitolite server
+# (see webui.remotes), and how many ls-remote commands run at the same time.
+REMOTES_CHECK_PERIOD = 60*15
+if CONFIG.has_option('local', 'remotes_check_period'):
+    REMOTES_CHECK_PERIOD = CONFIG.getint('local', 'remotes_check_period')
+REMOTES_CHECK_WORKERS = 4
+if CONFIG.has_option('local', 'remotes_check_workers'):
+    REMOTES_CHECK_WORKERS = CONFIG.getint('local', 'remotes_check_workers')
+# How often (seconds) the Store is checked for documents that are out of
+# date with the model definitions (see webui.modeldefs).
+MODELDEFS_REPORT_PERIOD = 60*60*24
+if CONFIG.has_option('local', 'modeldefs_report_period'):
+    MODELDEFS_REPORT_PERIOD = CONFIG.getint('local', 'modeldefs_report_period')
 # Indicates whether or not gitstatus_update_store periodic task is active.
 # This should be True for most single-user workstations.
 # See CELERYBEAT_SCHEDULE below.
@@ -265,7 +338,15 @@ CELERYBEAT_SCHEDULE = {
     'webui-gitolite-info-refresh': {
         'task': 'webui.tasks.gitolite_info_refresh',
         'schedule': timedelta(seconds=GITOLITE_INFO_CHECK_PERIOD),
-    }
+    },
+    'webui-index-outbox-drain': {
+        'task': 'webui.tasks.index_outbox_drain',
+        'schedule': timedelta(seconds=INDEX_OUTBOX_PERIOD),
+    },
+    'storage-devices-refresh': {
+        'task': 'storage.tasks.devices_refresh',
+        'schedule': timedelta(seconds=10),
+    },
 }
 if GITSTATUS_BACKGROUND_ACTIVE:
     CELERY_BEAT_SCHEDULER = 'celery.beat.PersistentScheduler'
@@ -274,6 +355,14 @@ if GITSTATUS_BACKGROUND_ACTIVE:
         'task': 'webui.tasks.gitstatus_update_store',
         'schedule': timedelta(seconds=60),
     }
+    CELERYBEAT_SCHEDULE['webui-remotes-check'] = {
+        'task': 'webui.tasks.remotes_check',
+        'schedule': timedelta(seconds=REMOTES_CHECK_PERIOD),
+    }
+    CELERYBEAT_SCHEDULE['webui-modeldefs-report'] = {
+        'task': 'webui.tasks.modeldefs_report',
+        'schedule': timedelta(seconds=MODELDEFS_REPORT_PERIOD),
+    }
 
 # sorl-thumbnail
 THUMBNAIL_KVSTORE = 'sorl.thumbnail.kvstores.dbm_kvstore.KVStore'
@@ -428,6 +517,7 @@ MIDDLEWARE = (
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'webui.middleware.IdentityMapMiddleware',
 )
 
 TEST_RUNNER = 'django.test.runner.DiscoverRunner'
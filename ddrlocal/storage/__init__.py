@@ -8,6 +8,7 @@ from django.core.cache import cache
 
 from webui import models
 from DDR import storage as ddrstorage
+from storage import monitor
 
 
 STORAGE_MESSAGES = {
@@ -35,6 +36,10 @@ BASE_PATH_TIMEOUT = 60 * 30  # 30 min
 BASE_PATH_DEFAULT = '/tmp/ddr'
 DISK_SPACE_TIMEOUT = 60 * 5
 DISK_SPACE_CACHE_KEY = 'ddrlocal:disk_space'
+# storage.decorators.storage_required trusts a successful check of the
+# Store for this long; mount/unmount/link/unlink clear it immediately.
+HEALTH_TIMEOUT = 30
+HEALTH_CACHE_KEY = 'ddrlocal:storage_health'
 
 
 def base_path(request=None):
@@ -85,6 +90,19 @@ def disk_space(mount_path):
         cache.set(DISK_SPACE_CACHE_KEY, space, DISK_SPACE_TIMEOUT)
     return space
 
+def health_ok():
+    """Indicates whether Store was found readable in the last HEALTH_TIMEOUT
+    
+    @returns: boolean
+    """
+    return bool(cache.get(HEALTH_CACHE_KEY))
+
+def health_set():
+    cache.set(HEALTH_CACHE_KEY, True, HEALTH_TIMEOUT)
+
+def health_invalidate():
+    cache.delete(HEALTH_CACHE_KEY)
+
 def _mount_common(request, device):
     # save label,mount_path in session
     logger.debug('saving session...')
@@ -101,6 +119,8 @@ def _mount_common(request, device):
     models.DOCSTORE.set_alias(device['label'])
     # remove disk space data from cache
     cache.delete(DISK_SPACE_CACHE_KEY)
+    health_invalidate()
+    monitor.invalidate()
 
 def mount_usb( request, device ):
     """Mounts requested device, adds /var/www/ddr/media symlink, gives feedback.
@@ -154,6 +174,8 @@ def _unmount_common(request):
     _session_rm(request, 'storage_mount_path')
     # remove space data from cache
     cache.delete(DISK_SPACE_CACHE_KEY)
+    health_invalidate()
+    monitor.invalidate()
     
 def unmount_usb(request, device):
     """Removes /var/www/ddr/media symlink, unmounts requested device, gives feedback.
@@ -39,10 +39,12 @@ def sitewide(request):
         'linked': 0,
         'status': '',
     }
-    for d in storage.devices():
+    # devices and disk space are kept current by storage.monitor
+    snapshot = storage.monitor.snapshot()
+    for d in snapshot['devices']:
         if mount_path and d.get('mountpath',None) \
         and (d['mountpath'] == mount_path) and d['linked']:
-            device = d
+            device = dict(d)
     device['type_label'] = BOOTSTRAP_COLORS['red']
     device['space_label'] = BOOTSTRAP_COLORS['red']
     device['status_label'] = BOOTSTRAP_COLORS['red']
@@ -50,7 +52,7 @@ def sitewide(request):
         device['type_label'] = BOOTSTRAP_COLORS['green']
         device['status_label'] = BOOTSTRAP_COLORS['green']
     # space
-    space = storage.disk_space(mount_path)
+    space = snapshot['disk_space'].get(mount_path)
     if space:
         for key,val in space.items():
             device[key] = val
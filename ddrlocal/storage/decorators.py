@@ -12,6 +12,7 @@ from webui import models
 
 from storage import STORAGE_MESSAGES
 from storage import base_path, ddrstorage
+from storage import health_ok, health_set
 from webui import gitolite
 
 
@@ -30,10 +31,15 @@ def storage_required(func):
     Saves requested URI in session; remount view will try to retrieve and redirect.
     NOTE: We don't remember GET/POST args!!!
     
+    A successful check is cached for storage.HEALTH_TIMEOUT seconds
+    (cleared on mount/unmount) so most requests don't touch the drive.
+    
     TODO This function will report unreadable if no collections for repo/org!
     """
     @wraps(func)
     def inner(request, *args, **kwargs):
+        if health_ok():
+            return func(request, *args, **kwargs)
         readable = False
         # if we can get list of collections, storage must be readable
         basepath = settings.MEDIA_BASE
@@ -80,5 +86,6 @@ def storage_required(func):
             else:
                 messages.error(request, STORAGE_MESSAGES['ERROR'])
             return HttpResponseRedirect(reverse('storage-required'))
+        health_set()
         return func(request, *args, **kwargs)
     return inner
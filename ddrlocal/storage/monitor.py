@@ -0,0 +1,104 @@
+"""
+monitor - Snapshot of storage devices and disk space, kept in the cache
+
+storage.context_processors.sitewide used to call storage.devices() on
+every page, which runs the DDR.storage device enumeration (udisks, mount,
+df).  Now the storage.tasks.devices_refresh task runs every
+10 seconds (see CELERYBEAT_SCHEDULE) and calls refresh(), which compares a cheap
+fingerprint of the kernel's partition and mount tables (and the
+MEDIA_BASE symlink) with the last one and only enumerates devices when
+something changed.  Disk space is refreshed every DISK_SPACE_TIMEOUT.
+
+Pages read the snapshot with snapshot().  If there is none (no worker
+running, cache flushed) it is built on the spot, as before.
+
+Mount, unmount, link, and unlink drop the snapshot (see
+storage._mount_common/_unmount_common) so the next page shows the change.
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+import os
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from DDR import storage as ddrstorage
+
+DEVICES_CACHE_KEY = 'ddrlocal:storage_devices'
+# snapshot expires if not refreshed, e.g. if celerybeat is not running
+DEVICES_TIMEOUT = 60 * 5
+DISK_SPACE_TIMEOUT = 60 * 5
+PROC_FILES = ['/proc/partitions', '/proc/self/mounts']
+
+
+def fingerprint():
+    """Partition and mount tables and MEDIA_BASE symlink target
+
+    Reading these is cheap compared to enumerating devices.
+    @returns: str
+    """
+    parts = []
+    for path in PROC_FILES:
+        try:
+            with open(path, 'r') as f:
+                parts.append(f.read())
+        except OSError:
+            parts.append('')
+    try:
+        parts.append(os.readlink(settings.MEDIA_BASE))
+    except OSError:
+        parts.append('')
+    return '\n'.join(parts)
+
+def _disk_space(devices):
+    space = {}
+    for d in devices:
+        mountpath = d.get('mountpath')
+        if d.get('mounted') and mountpath and os.path.exists(mountpath):
+            try:
+                space[mountpath] = ddrstorage.disk_space(mountpath)
+            except Exception as err:
+                logger.error('disk_space %s: %s' % (mountpath, err))
+    return space
+
+def refresh(force=False):
+    """Rebuilds snapshot if devices/mounts changed or disk space is stale
+
+    @param force: boolean Rebuild even if nothing changed
+    @returns: dict snapshot
+    """
+    fp = fingerprint()
+    now = time.time()
+    data = cache.get(DEVICES_CACHE_KEY)
+    if data and not force and (data['fingerprint'] == fp):
+        if now - data['disk_space_checked'] > DISK_SPACE_TIMEOUT:
+            data['disk_space'] = _disk_space(data['devices'])
+            data['disk_space_checked'] = now
+        cache.set(DEVICES_CACHE_KEY, data, DEVICES_TIMEOUT)
+        return data
+    devices = ddrstorage.devices(symlink=settings.MEDIA_BASE)
+    data = {
+        'fingerprint': fp,
+        'timestamp': timezone.now().isoformat(),
+        'devices': devices,
+        'disk_space': _disk_space(devices),
+        'disk_space_checked': now,
+    }
+    cache.set(DEVICES_CACHE_KEY, data, DEVICES_TIMEOUT)
+    return data
+
+def snapshot():
+    """Latest snapshot, built now if there is none
+
+    @returns: dict {'devices': [...], 'disk_space': {mountpath: {...}}, ...}
+    """
+    data = cache.get(DEVICES_CACHE_KEY)
+    if data is None:
+        data = refresh(force=True)
+    return data
+
+def invalidate():
+    cache.delete(DEVICES_CACHE_KEY)
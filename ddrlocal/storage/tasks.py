@@ -11,6 +11,7 @@ from django.contrib import messages
 
 from DDR import commands
 import storage
+from storage import monitor
 
 
 class DebugTask(Task):
@@ -28,6 +29,14 @@ class StorageTask(Task):
     def after_return(self, status, retval, task_id, args, kwargs, einfo):
         logger.debug('after_return(%s, %s, %s, %s, %s)' % (status, retval, task_id, args, kwargs))
 
+@shared_task(base=DebugTask, name='storage.tasks.devices_refresh')
+def devices_refresh():
+    """Updates cached device list/disk space if mounts have changed
+    
+    See storage.monitor.
+    """
+    return monitor.refresh()['timestamp']
+
 @shared_task(base=StorageTask, name='storage.tasks.mount')
 def mount_in_bkgnd(devicetype, devicefile):
     device = None
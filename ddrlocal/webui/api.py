@@ -11,13 +11,17 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from django.conf import settings
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 
 from elastictools.docstore import elasticsearch_dsl
 from elastictools import search
+from webui import cursors
 from webui import decorators
+from webui import docstores
 from webui import identifier
+from webui import indexbuild
 from webui import models
+from webui import querycache
 from webui.models import docstore
 
 
@@ -112,8 +116,65 @@ def es_detail(request, oid, format=None):
     data = models.format_object(oi, d.to_dict(), request, is_detail=True)
     return Response(data)
 
+def cursor_response(request, ds, s, format_hit, cursor, stream, limit):
+    """Cursor page or NDJSON stream of search results; see webui.cursors
+    
+    @param request: 
+    @param ds: DocstoreManager
+    @param s: elasticsearch_dsl.Search
+    @param format_hit: function Formats one hit for the API
+    @param cursor: str cursors.START or next token from previous page
+    @param stream: str 'ndjson' to stream all results
+    @param limit: str Results per page
+    @returns: Response or StreamingHttpResponse
+    """
+    if stream:
+        if stream != 'ndjson':
+            return Response(
+                {'detail': 'Unsupported stream format'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        def lines():
+            for hit in cursors.stream(ds, cursors.prepare(s)):
+                yield json.dumps(format_hit(hit)) + '\n'
+        return StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+    try:
+        limit = int(limit or settings.RESULTS_PER_PAGE)
+    except ValueError:
+        return Response(
+            {'detail': 'limit must be an integer'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if limit < 1:
+        return Response(
+            {'detail': 'limit must be positive'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    limit = min(limit, settings.ELASTICSEARCH_MAX_SIZE)
+    s = cursors.prepare(s)
+    try:
+        hits,token,total = cursors.page(ds, s, cursor, limit)
+    except cursors.CursorError as err:
+        return Response({'detail': str(err)}, status=status.HTTP_400_BAD_REQUEST)
+    data = OrderedDict()
+    data['total'] = total
+    data['limit'] = limit
+    data['next'] = token
+    data['next_api'] = None
+    if token:
+        params = request.GET.copy()
+        params['cursor'] = token
+        data['next_api'] = request.build_absolute_uri('?%s' % params.urlencode())
+    data['objects'] = [format_hit(hit) for hit in hits]
+    return Response(data)
+
 @api_view(['GET'])
 def es_children(request, oid, limit=None, offset=None):
+    """Children of object (Elasticsearch)
+    
+    ?cursor=* for cursor pagination, ?stream=ndjson for all children as
+    newline-delimited JSON (see webui.cursors).  Otherwise limit/offset.
+    """
     oi = identifier.Identifier(oid)
     try:
         collection_id = oi.collection_id()
@@ -121,7 +182,7 @@ def es_children(request, oid, limit=None, offset=None):
     except:
         collection_id = None
         child_models = oi.child_models(stubs=True)
-    ds = docstore.DocstoreManager(models.INDEX_PREFIX, settings.DOCSTORE_HOST, settings)
+    ds = docstores.manager(models.INDEX_PREFIX, settings.DOCSTORE_HOST)
     s = elasticsearch_dsl.Search(
         using=ds.es, index=ds.indexname
     )
@@ -130,6 +191,18 @@ def es_children(request, oid, limit=None, offset=None):
     s = s.source(include=identifier.ELASTICSEARCH_LIST_FIELDS)
     for model in child_models:
         s = s.doc_type(model)
+    if request.GET.get('cursor') or request.GET.get('stream'):
+        def format_hit(hit):
+            d = hit.to_dict()
+            d.setdefault('id', hit.meta.id)
+            return models.format_object(
+                identifier.Identifier(hit.meta.id), d, request
+            )
+        return cursor_response(
+            request, ds, s, format_hit,
+            request.GET.get('cursor'), request.GET.get('stream'),
+            request.GET.get('limit'),
+        )
     if not limit:
         limit = int(request.GET.get('limit', settings.ELASTICSEARCH_MAX_SIZE))
     if not offset:
@@ -247,6 +320,8 @@ class Search(APIView):
             return None
         
         fulltext = reget(request, 'fulltext')
+        cursor = reget(request, 'cursor')
+        stream = reget(request, 'stream')
         offset = reget(request, 'offset')
         limit = reget(request, 'limit')
         page = reget(request, 'page')
@@ -263,7 +338,7 @@ class Search(APIView):
         else:
             limit = settings.RESULTS_PER_PAGE
             offset = 0
-        ds = docstore.DocstoreManager(models.INDEX_PREFIX, settings.DOCSTORE_HOST, settings)
+        ds = docstores.manager(models.INDEX_PREFIX, settings.DOCSTORE_HOST)
         searcher = search.Searcher(ds)
         searcher.prepare(
             params=request.query_params.dict(),
@@ -274,6 +349,17 @@ class Search(APIView):
             fields_nested=models.SEARCH_NESTED_FIELDS,
             fields_agg=models.SEARCH_AGG_FIELDS,
         )
+        if cursor or stream:
+            def format_hit(hit):
+                return models.format_object_detail(
+                    {'_id': hit.meta.id, '_index': hit.meta.index, '_source': hit.to_dict()},
+                    request, listitem=True
+                )
+            return cursor_response(
+                request, ds, searcher.s, format_hit,
+                cursor, stream, reget(request, 'limit')
+            )
+        querycache.enable(searcher)
         results = searcher.execute(limit, offset)
         results_dict = results.ordered_dict(
             request=request,
@@ -296,12 +382,12 @@ def object_children(request, object_id):
     p - page (offset)
     """
     # TODO just get doc_type
-    ds = docstore.DocstoreManager(models.INDEX_PREFIX, settings.DOCSTORE_HOST, settings)
+    ds = docstores.manager(models.INDEX_PREFIX, settings.DOCSTORE_HOST)
     document = ds.es.get(
         index=ds.index_name(identifier.Identifier(object_id).model),
         id=object_id
     )
-    model = document['_index'].replace(docstore.models.INDEX_PREFIX, '')
+    model = indexbuild.index_model(document['_index'], models.INDEX_PREFIX)
     if   model == 'repository': return organizations(request._request, object_id)
     elif model == 'organization': return collections(request._request, object_id)
     elif model == 'collection': return entities(request._request, object_id)
@@ -315,12 +401,12 @@ def object_detail(request, object_id):
     """OBJECT DETAIL DOCS
     """
     # TODO just get doc_type
-    ds = docstore.DocstoreManager(models.INDEX_PREFIX, settings.DOCSTORE_HOST, settings)
+    ds = docstores.manager(models.INDEX_PREFIX, settings.DOCSTORE_HOST)
     document = ds.es.get(
         index=ds.index_name(identifier.Identifier(object_id).model),
         id=object_id
     )
-    model = document['_index'].replace(docstore.models.INDEX_PREFIX, '')
+    model = indexbuild.index_model(document['_index'], models.INDEX_PREFIX)
     if   model == 'repository': return repository(request._request, object_id)
     elif model == 'organization': return organization(request._request, object_id)
     elif model == 'collection': return collection(request._request, object_id)
@@ -4,6 +4,26 @@ logger = logging.getLogger(__name__)
 import redis
 from django.conf import settings
 
+_redis = None
+
+
+def redis_connection():
+    """Returns process-wide Redis client for the cache database
+    
+    For things the Django cache API can't do (sorted sets, pipelines, scripts).
+    redis-py keeps a connection pool and resets it after fork.
+    
+    @returns: redis.Redis
+    """
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis(
+            host=settings.REDIS_HOST,
+            port=settings.REDIS_PORT,
+            db=settings.REDIS_DB_CACHE,
+            decode_responses=True,
+        )
+    return _redis
 
 def redis_flush_all():
     logger.debug('redis_flush_all()')
@@ -0,0 +1,292 @@
+"""
+catalog - Per-collection index of entities for listing pages
+
+Collection.children() walks the whole repo and parses every entity.json
+each time the children page is loaded.  The catalog keeps the fields the
+listing needs (id, title, sort, status, public, signature, file count)
+in a small SQLite database per collection, STORE/tmp/catalog-{cid}.db.
+
+The catalog records the HEAD commit it was built from.  update() only
+reparses entities touched by commits since then (git diff), and does a
+full rebuild only if there is no catalog yet or history was rewritten.
+Uncommitted changes are not seen until they are committed.  If HEAD
+cannot be read the catalog is rebuilt from the files, at most once every
+NO_HEAD_RETRY seconds.
+
+The catalog is updated after saves and syncs (webui.tasks.dvcs.gitstatus_request)
+and by gitstatus (webui.gitstatus.update).  Listing pages only read it,
+except to build a catalog that does not exist yet.
+
+>>> from webui import catalog
+>>> catalog.update(settings.MEDIA_BASE, collection.path_abs)
+>>> catalog.built(settings.MEDIA_BASE, collection.id)
+True
+>>> entities = catalog.CatalogList(settings.MEDIA_BASE, collection.id, collection.id)
+>>> paginator = Paginator(entities, settings.RESULTS_PER_PAGE)
+"""
+
+import json
+import logging
+logger = logging.getLogger(__name__)
+import os
+import sqlite3
+import subprocess
+import time
+
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entities (
+    id TEXT PRIMARY KEY,
+    parent_id TEXT,
+    path_rel TEXT,
+    idnum INTEGER,
+    title TEXT,
+    sort INTEGER,
+    status TEXT,
+    public INTEGER,
+    signature_id TEXT,
+    file_count INTEGER
+);
+CREATE INDEX IF NOT EXISTS entities_parent_sort ON entities (parent_id, sort, idnum, id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+CATALOG_TIMEOUT = 30
+# seconds before a catalog built without a readable HEAD is rebuilt
+NO_HEAD_RETRY = 60 * 5
+FIELDS = [
+    'id', 'parent_id', 'path_rel', 'idnum', 'title', 'sort', 'status',
+    'public', 'signature_id', 'file_count',
+]
+
+
+def path(base_dir, collection_id):
+    """
+    - STORE/tmp/catalog-ddr-test-123.db
+    """
+    tmp_dir = os.path.join(base_dir, 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    return os.path.join(tmp_dir, 'catalog-%s.db' % collection_id)
+
+def built(base_dir, collection_id):
+    """Whether collection has a catalog
+
+    @param base_dir: Absolute path to Store dir
+    @param collection_id: str
+    @returns: boolean
+    """
+    if not os.path.exists(path(base_dir, collection_id)):
+        return False
+    connection = _connect(base_dir, collection_id)
+    try:
+        row = connection.execute("SELECT value FROM meta WHERE key='head'").fetchone()
+    finally:
+        connection.close()
+    return row is not None
+
+def _connect(base_dir, collection_id):
+    connection = sqlite3.connect(
+        path(base_dir, collection_id), timeout=CATALOG_TIMEOUT, isolation_level=None
+    )
+    connection.executescript(CATALOG_SCHEMA)
+    return connection
+
+def _git(collection_path, args):
+    return subprocess.run(
+        ['git', '-C', collection_path] + args, capture_output=True, text=True
+    )
+
+def _head(collection_path):
+    result = _git(collection_path, ['rev-parse', '--verify', '-q', 'HEAD'])
+    return result.stdout.strip() or None
+
+def _changed_paths(collection_path, since, head):
+    """Paths under files/ changed between two commits, or None if unknown
+    """
+    result = _git(collection_path, [
+        'diff', '--name-only', '--no-renames', since, head, '--', 'files'
+    ])
+    if result.returncode:
+        return None
+    return [line for line in result.stdout.splitlines() if line]
+
+def _entity_dirs(paths):
+    """Entity directories (relative to repo) affected by changed paths
+
+    files/E/entity.json        -> files/E
+    files/E/files/F.json       -> files/E
+    files/E/files/S/entity.json -> files/E/files/S
+    """
+    dirs = set()
+    for p in paths:
+        parent = os.path.dirname(p)
+        if os.path.basename(p) == 'entity.json':
+            dirs.add(parent)
+        elif os.path.basename(parent) == 'files' and parent != 'files':
+            dirs.add(os.path.dirname(parent))
+    return dirs
+
+def _load_json(json_path):
+    """Flattens DDR JSON (list of single-key dicts) into one dict
+    """
+    with open(json_path, 'r') as f:
+        items = json.loads(f.read())
+    data = {}
+    for item in items:
+        if isinstance(item, dict):
+            data.update(item)
+    return data
+
+def _int(value, default=None):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+def _count_files(entity_dir):
+    files_dir = os.path.join(entity_dir, 'files')
+    if not os.path.isdir(files_dir):
+        return 0
+    return len([
+        f for f in os.listdir(files_dir)
+        if f.endswith('.json') and os.path.isfile(os.path.join(files_dir, f))
+    ])
+
+def _entity_row(collection_path, dir_rel):
+    """Catalog row for entity in dir_rel, or None if it no longer exists
+    """
+    entity_dir = os.path.join(collection_path, dir_rel)
+    json_path = os.path.join(entity_dir, 'entity.json')
+    if not os.path.exists(json_path):
+        return None
+    data = _load_json(json_path)
+    oid = data.get('id') or os.path.basename(dir_rel)
+    # files/E -> collection; files/E/files/S -> E
+    grandparent = os.path.dirname(os.path.dirname(dir_rel))
+    if grandparent:
+        parent_id = os.path.basename(grandparent)
+    else:
+        parent_id = os.path.basename(collection_path.rstrip('/'))
+    return (
+        oid,
+        parent_id,
+        dir_rel,
+        _int(oid.split('-')[-1], 0),
+        data.get('title', ''),
+        _int(data.get('sort'), 1),
+        data.get('status'),
+        _int(data.get('public')),
+        data.get('signature_id'),
+        _count_files(entity_dir),
+    )
+
+def _all_entity_dirs(collection_path):
+    dirs = []
+    files_dir = os.path.join(collection_path, 'files')
+    for root,subdirs,filenames in os.walk(files_dir):
+        if 'entity.json' in filenames:
+            dirs.append(os.path.relpath(root, collection_path))
+    return dirs
+
+def _upsert(connection, collection_path, dirs):
+    for dir_rel in dirs:
+        row = _entity_row(collection_path, dir_rel)
+        if row:
+            connection.execute(
+                'INSERT OR REPLACE INTO entities (%s) VALUES (%s)' % (
+                    ', '.join(FIELDS), ', '.join(['?'] * len(FIELDS))
+                ),
+                row
+            )
+        else:
+            connection.execute('DELETE FROM entities WHERE path_rel=?', (dir_rel,))
+
+def update(base_dir, collection_path, force=False):
+    """Brings collection's catalog up to date with its HEAD commit
+
+    @param base_dir: Absolute path to Store dir
+    @param collection_path: Absolute path to collection repo
+    @param force: boolean Rebuild from scratch
+    @returns: str 'unchanged', 'updated N', or 'rebuilt N'
+    """
+    collection_id = os.path.basename(collection_path.rstrip('/'))
+    # '' means built from the files without a readable HEAD
+    head = _head(collection_path) or ''
+    connection = _connect(base_dir, collection_id)
+    try:
+        meta = dict(connection.execute('SELECT key, value FROM meta').fetchall())
+        indexed = meta.get('head')
+        if (indexed is not None) and (indexed == head) and not force:
+            if head or (time.time() - float(meta.get('built', 0)) < NO_HEAD_RETRY):
+                return 'unchanged'
+        changed = None
+        if indexed and head and not force:
+            changed = _changed_paths(collection_path, indexed, head)
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            if changed is None:
+                connection.execute('DELETE FROM entities')
+                dirs = _all_entity_dirs(collection_path)
+                message = 'rebuilt %s' % len(dirs)
+            else:
+                dirs = _entity_dirs(changed)
+                message = 'updated %s' % len(dirs)
+            _upsert(connection, collection_path, dirs)
+            connection.executemany(
+                'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                [('head', head), ('built', str(time.time()))]
+            )
+            connection.execute('COMMIT')
+        except:
+            connection.execute('ROLLBACK')
+            raise
+    finally:
+        connection.close()
+    logger.debug('catalog %s %s' % (collection_id, message))
+    return message
+
+
+class CatalogList():
+    """Children of an object, read from catalog one page at a time
+
+    Has count() and slicing, so it can be passed to django.core.paginator.Paginator
+    in place of a list.
+    """
+
+    def __init__(self, base_dir, collection_id, parent_id):
+        self.base_dir = base_dir
+        self.collection_id = collection_id
+        self.parent_id = parent_id
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            connection = _connect(self.base_dir, self.collection_id)
+            try:
+                self._count = connection.execute(
+                    'SELECT COUNT(*) FROM entities WHERE parent_id=?',
+                    (self.parent_id,)
+                ).fetchone()[0]
+            finally:
+                connection.close()
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key+1][0]
+        offset = key.start or 0
+        limit = (key.stop if key.stop is not None else self.count()) - offset
+        connection = _connect(self.base_dir, self.collection_id)
+        try:
+            rows = connection.execute(
+                'SELECT %s FROM entities WHERE parent_id=?'
+                ' ORDER BY sort, idnum, id LIMIT ? OFFSET ?' % ', '.join(FIELDS),
+                (self.parent_id, max(limit, 0), offset)
+            ).fetchall()
+        finally:
+            connection.close()
+        return [dict(zip(FIELDS, row)) for row in rows]
@@ -5,6 +5,7 @@ import os
 
 from django.conf import settings
 from django.urls import reverse
+from django.utils.functional import SimpleLazyObject
 
 from webui.models import repo_models_valid
 from webui.tasks import common as tasks_common
@@ -12,6 +13,11 @@ from webui.tasks import common as tasks_common
 
 def sitewide(request):
     """Variables that need to be inserted into all templates.
+    
+    models_valid is only checked if the template uses it.  Messages are
+    displayed above the content block, so views whose templates use it
+    pass repo_models_valid(request) in their own context; that way its
+    error message is shown on this page rather than the next one.
     """
     # logout redirect - chop off edit/new/batch URLs if present
     logout_next = '?'.join([request.META['PATH_INFO'], request.META['QUERY_STRING']])
@@ -27,7 +33,7 @@ def sitewide(request):
         'pid': os.getpid(),
         'host': os.uname()[1],
         'commits': settings.APP_COMMITS_HTML,
-        'models_valid': repo_models_valid(request),
+        'models_valid': SimpleLazyObject(lambda: repo_models_valid(request)),
         # user info
         'username': request.session.get('idservice_username', None),
         'git_name': request.session.get('git_name', None),
@@ -0,0 +1,168 @@
+"""
+cursors - Point-in-time cursor pagination for the API
+
+es_children returned up to ELASTICSEARCH_MAX_SIZE objects in one
+response, and deep search pages used from/size offsets, which get slower
+the deeper they go and stop at the index's max_result_window.
+
+With ?cursor=* the first page opens an Elasticsearch point in time (PIT)
+and the response includes an opaque "next" token; passing it back as
+?cursor=<token> fetches the following page with search_after, so every
+page costs the same and sees the same snapshot of the index.  The token
+is signed (django.core.signing) and holds the PIT ID, the sort values
+of the last hit, and the total counted on the first page.  The PIT is closed after the last page, or expires
+KEEP_ALIVE after the last request if a client stops early.
+
+With ?stream=ndjson the whole result set is sent as newline-delimited
+JSON, one object per line, fetched PAGE_SIZE hits at a time, so neither
+side holds more than one page in memory.
+
+Searches are passed through prepare() first: aggregations are dropped,
+since they would be recomputed for every page, and _shard_doc is added
+to the sort so search_after has a total order to resume from.  The total
+hit count is only tracked on the first page.
+
+>>> from webui import cursors
+>>> s = cursors.prepare(s)
+>>> hits,token,total = cursors.page(ds, s, cursors.START, 100)
+>>> hits,token,total = cursors.page(ds, s, token, 100)
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+from django.core import signing
+
+from elasticsearch import NotFoundError
+
+START = '*'
+KEEP_ALIVE = '2m'
+# hits fetched per request when streaming
+PAGE_SIZE = 500
+SALT = 'webui.cursors'
+
+
+class CursorError(Exception):
+    pass
+
+
+def encode(pit_id, after, total=None):
+    """Opaque token for the page following a hit
+
+    @param pit_id: str
+    @param after: list Sort values of last hit
+    @param total: int Total hits, from the first page
+    @returns: str
+    """
+    return signing.dumps(
+        {'pit': pit_id, 'after': after, 'total': total}, salt=SALT, compress=True
+    )
+
+def decode(token):
+    """
+    @param token: str From encode()
+    @returns: dict {'pit', 'after', 'total'}
+    @raises: CursorError if token was altered or is not a token
+    """
+    try:
+        return signing.loads(token, salt=SALT)
+    except signing.BadSignature:
+        raise CursorError('Invalid cursor')
+
+def open_pit(ds, index):
+    return ds.es.open_point_in_time(index=index, keep_alive=KEEP_ALIVE)['id']
+
+def close_pit(ds, pit_id):
+    try:
+        ds.es.close_point_in_time(id=pit_id)
+    except NotFoundError:
+        # already expired
+        pass
+
+def prepare(s):
+    """Search without aggregations, sorted for search_after
+
+    Keeps the search's sort if it has one, else sorts by relevance.
+    _shard_doc (only available with a PIT) breaks ties.
+
+    @param s: elasticsearch_dsl.Search
+    @returns: elasticsearch_dsl.Search
+    """
+    s = s._clone()
+    s.aggs._params = {'aggs': {}}
+    sort = s.to_dict().get('sort') or ['_score']
+    return s.sort(*[field for field in sort if field != '_shard_doc'], '_shard_doc')
+
+def _index(s):
+    return ','.join(s._index or ['_all'])
+
+def _execute(s, pit_id, after, size):
+    # the PIT determines the index; requests must not name one
+    s = s.index().extra(
+        pit={'id': pit_id, 'keep_alive': KEEP_ALIVE},
+        size=size,
+    )
+    if after:
+        s = s.extra(search_after=after, track_total_hits=False)
+    else:
+        # exact count on the first page only
+        s = s.extra(track_total_hits=True)
+    try:
+        response = s.execute()
+    except NotFoundError:
+        raise CursorError('Cursor expired')
+    # Elasticsearch may return a new PIT ID with each response
+    pit_id = response.to_dict().get('pit_id', pit_id)
+    return response, pit_id
+
+def page(ds, s, token, size):
+    """One page of results
+
+    @param ds: DocstoreManager
+    @param s: elasticsearch_dsl.Search from prepare()
+    @param token: str START or token from a previous page
+    @param size: int Hits per page
+    @returns: (hits, next token or None, total)
+    @raises: CursorError
+    """
+    if token == START:
+        pit_id = open_pit(ds, _index(s))
+        after = None
+        total = None
+    else:
+        data = decode(token)
+        pit_id = data['pit']
+        after = data['after']
+        total = data.get('total')
+    response,pit_id = _execute(s, pit_id, after, size)
+    if after is None:
+        total = response.hits.total.value
+    hits = list(response.hits)
+    if len(hits) < size:
+        close_pit(ds, pit_id)
+        token = None
+    else:
+        token = encode(pit_id, list(hits[-1].meta.sort), total)
+    return hits, token, total
+
+def stream(ds, s, size=PAGE_SIZE):
+    """All hits, fetched one page at a time
+
+    @param ds: DocstoreManager
+    @param s: elasticsearch_dsl.Search from prepare()
+    @param size: int Hits per request
+    @returns: generator of hits
+    """
+    pit_id = open_pit(ds, _index(s))
+    after = None
+    try:
+        while True:
+            response,pit_id = _execute(s, pit_id, after, size)
+            hits = list(response.hits)
+            for hit in hits:
+                yield hit
+            if len(hits) < size:
+                break
+            after = list(hits[-1].meta.sort)
+    finally:
+        close_pit(ds, pit_id)
@@ -0,0 +1,121 @@
+"""
+docstores - Process-wide Elasticsearch clients
+
+Views, API endpoints, and tasks used to construct a new DocstoreManager
+(and with it a new Elasticsearch client and HTTP connection pool) for
+every call, paying for a new TCP/TLS connection each time.  manager()
+returns one DocstoreManager per (index prefix, host) per process, whose
+client keeps its connections alive between requests.
+
+Clients are never shared across fork(): if the process ID has changed
+since a client was made (gunicorn/celery workers forked from a parent
+that already had one) new ones are made.
+
+The client is built here rather than by elastictools so the pool size
+(settings.DOCSTORE_POOL_SIZE connections per node) can be set; it should
+be at least the number of gunicorn threads.  One client is shared by all
+the managers in a process (see make_manager).
+
+>>> from webui import docstores
+>>> ds = docstores.manager(INDEX_PREFIX, settings.DOCSTORE_HOST)
+>>> docstores.stats()
+{'managers_created': 1, 'managers_reused': 41, 'connections': 2, 'requests': 57}
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+import os
+import threading
+
+from django.conf import settings
+
+from elasticsearch import Elasticsearch
+
+from DDR import docstore
+
+_lock = threading.Lock()
+_pid = None
+# (index_prefix, host) -> DocstoreManager
+_managers = {}
+# host -> Elasticsearch
+_clients = {}
+_stats = {'managers_created': 0, 'managers_reused': 0}
+
+
+def _elasticsearch(host):
+    """Elasticsearch client with keep-alive connection pool
+    """
+    kwargs = {
+        'connections_per_node': settings.DOCSTORE_POOL_SIZE,
+        'request_timeout': settings.DOCSTORE_TIMEOUT,
+    }
+    if settings.DOCSTORE_SSL_CERTFILE and settings.DOCSTORE_PASSWORD:
+        return Elasticsearch(
+            'https://%s' % host,
+            ca_certs=settings.DOCSTORE_SSL_CERTFILE,
+            basic_auth=(settings.DOCSTORE_USERNAME, settings.DOCSTORE_PASSWORD),
+            **kwargs
+        )
+    return Elasticsearch('http://%s' % host, **kwargs)
+
+def make_manager(index_prefix, host, es):
+    """DocstoreManager that uses an existing client
+
+    DocstoreManager.__init__ only records index_prefix and host and
+    builds a client of its own; it is skipped so that client is not
+    built just to be replaced.
+
+    @param index_prefix: str
+    @param host: str Elasticsearch host:port
+    @param es: Elasticsearch
+    @returns: DocstoreManager
+    """
+    ds = docstore.DocstoreManager.__new__(docstore.DocstoreManager)
+    ds.index_prefix = index_prefix
+    ds.host = host
+    ds.es = es
+    return ds
+
+def manager(index_prefix, host):
+    """Shared DocstoreManager for this process
+
+    @param index_prefix: str
+    @param host: str Elasticsearch host:port
+    @returns: DocstoreManager
+    """
+    global _pid
+    key = (index_prefix, host)
+    with _lock:
+        if _pid != os.getpid():
+            _managers.clear()
+            _clients.clear()
+            _pid = os.getpid()
+        ds = _managers.get(key)
+        if ds is not None:
+            _stats['managers_reused'] += 1
+            return ds
+        if host not in _clients:
+            _clients[host] = _elasticsearch(host)
+        ds = make_manager(index_prefix, host, _clients[host])
+        _managers[key] = ds
+        _stats['managers_created'] += 1
+    logger.debug('new DocstoreManager %s %s (pid %s)' % (index_prefix, host, _pid))
+    return ds
+
+def stats():
+    """Client reuse counts, and HTTP connections opened/requests made
+
+    A high requests/connections ratio means connections are being reused.
+    @returns: dict
+    """
+    with _lock:
+        data = dict(_stats)
+        clients = list(_clients.values()) if _pid == os.getpid() else []
+    data['connections'] = 0
+    data['requests'] = 0
+    for es in clients:
+        for node in es.transport.node_pool.all():
+            pool = getattr(node, 'pool', None)
+            data['connections'] += getattr(pool, 'num_connections', 0)
+            data['requests'] += getattr(pool, 'num_requests', 0)
+    return data
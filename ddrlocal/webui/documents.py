@@ -0,0 +1,186 @@
+"""
+documents - Process-level cache of parsed Collection/Entity/File objects
+
+Views and tasks load the same JSON documents from the Store over and over
+(a file detail page loads the file, its entity, and its collection, some
+of them twice).  This keeps recently loaded objects in an LRU cache keyed
+on the file's path, mtime_ns, and size, so a changed file is never served
+from the cache.
+
+Callers get a deep copy of the cached object; it can be changed freely
+without affecting the cache.
+
+mtime alone is not reliable on some filesystems (e.g. 2-second
+resolution on FAT), and each web and Celery process has its own cache.
+So each collection also has a generation counter in Redis that is part
+of the key.  write_json/save in webui.models (and collection sync) call
+invalidate(), which bumps the counter, so every process stops using
+what it cached for that collection.  During a request each collection's
+generation is read from Redis once (see webui.identitymap.memo).  If
+Redis is unreachable documents are loaded from the Store without caching.
+
+The cache is bounded by the total size of the JSON files it holds
+(settings.DOCUMENT_CACHE_BYTES), as a rough stand-in for memory use.
+
+>>> from webui import documents
+>>> documents.load(Entity, path_abs, identifier, from_json)
+>>> documents.stats()
+{'hits': 12, 'misses': 3, 'evictions': 0, 'entries': 3, 'bytes': 10240}
+"""
+
+from collections import OrderedDict
+import copy
+import logging
+logger = logging.getLogger(__name__)
+import os
+import threading
+
+from django.conf import settings
+
+from DDR.identifier import Identifier as DDRIdentifier
+
+from webui import identitymap
+from webui.cache import redis_connection
+
+GENERATION_KEY = 'webui:documents:gen:%s'
+
+_lock = threading.Lock()
+# path -> (key, size, object)
+_documents = OrderedDict()
+_bytes = 0
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+
+def _copy(document):
+    """Copy of document that shares nothing mutable with it
+
+    Identifiers are immutable and interned (see webui.identifier), so
+    the copy keeps the same ones.
+    """
+    memo = {
+        id(value): value
+        for value in vars(document).values()
+        if isinstance(value, DDRIdentifier)
+    }
+    return copy.deepcopy(document, memo)
+
+def _collection(path_abs):
+    """Name of the collection directory a path is in
+    """
+    path_rel = os.path.relpath(path_abs, settings.MEDIA_BASE)
+    if path_rel.startswith(os.pardir):
+        # not in the Store
+        return os.path.dirname(path_abs)
+    return path_rel.split(os.sep)[0]
+
+def _generation(path_abs):
+    """Generation of path's collection, read once per request
+
+    @returns: str, or None if Redis is unreachable
+    """
+    collection = _collection(path_abs)
+    def get():
+        try:
+            return redis_connection().get(GENERATION_KEY % collection) or '0'
+        except Exception as err:
+            logger.error('documents %s: %s' % (collection, err))
+            return None
+    return identitymap.memo(('generation', collection), get)
+
+def _evict(path):
+    global _bytes
+    key,size,document = _documents.pop(path)
+    _bytes -= size
+
+def load(object_class, path_abs, identifier, loader, **kwargs):
+    """Returns copy of cached object, or loads it with loader and caches it
+
+    @param object_class: class
+    @param path_abs: str Absolute path to .json file
+    @param identifier: Identifier or None
+    @param loader: function Called as loader(object_class, path_abs, identifier, **kwargs)
+    @param kwargs: Passed to loader; also part of cache key
+    @returns: object
+    """
+    global _bytes
+    # same instance if already loaded during this request
+    mapkey = (object_class, path_abs, tuple(sorted(kwargs.items())))
+    document = identitymap.get(mapkey)
+    if document is not None:
+        return document
+    maxbytes = settings.DOCUMENT_CACHE_BYTES
+    try:
+        st = os.stat(path_abs)
+    except OSError:
+        return loader(object_class, path_abs, identifier, **kwargs)
+    generation = _generation(path_abs)
+    if generation is None:
+        return loader(object_class, path_abs, identifier, **kwargs)
+    key = (
+        object_class, generation, st.st_mtime_ns, st.st_size,
+        tuple(sorted(kwargs.items()))
+    )
+    with _lock:
+        cached = _documents.get(path_abs)
+        if cached and cached[0] == key:
+            _documents.move_to_end(path_abs)
+            _stats['hits'] += 1
+            document = _copy(cached[2])
+        else:
+            _stats['misses'] += 1
+    if document is not None:
+        identitymap.put(mapkey, document)
+        return document
+    document = loader(object_class, path_abs, identifier, **kwargs)
+    identitymap.put(mapkey, document, read=True)
+    if (not maxbytes) or (st.st_size > maxbytes):
+        return document
+    with _lock:
+        if path_abs in _documents:
+            _evict(path_abs)
+        _documents[path_abs] = (key, st.st_size, _copy(document))
+        _bytes += st.st_size
+        while _bytes > maxbytes:
+            _evict(next(iter(_documents)))
+            _stats['evictions'] += 1
+    return document
+
+def invalidate(path_abs):
+    """Drops document, or all documents under a directory
+
+    Other processes drop everything they cached for the collection.
+
+    @param path_abs: str Absolute path to .json file or to a directory
+    """
+    prefix = None
+    if os.path.isdir(path_abs):
+        prefix = path_abs.rstrip(os.sep) + os.sep
+    identitymap.invalidate(path_abs, prefix)
+    collection = _collection(path_abs)
+    try:
+        generation = redis_connection().incr(GENERATION_KEY % collection)
+        identitymap.set_memo(('generation', collection), str(generation))
+    except Exception as err:
+        logger.error('documents.invalidate %s: %s' % (path_abs, err))
+    with _lock:
+        for path in [
+                p for p in _documents.keys()
+                if (p == path_abs) or (prefix and p.startswith(prefix))
+        ]:
+            _evict(path)
+
+def clear():
+    with _lock:
+        for path in list(_documents.keys()):
+            _evict(path)
+
+def stats():
+    """Hit/miss counters and size of cache in this process
+
+    @returns: dict
+    """
+    with _lock:
+        data = dict(_stats)
+        data['entries'] = len(_documents)
+        data['bytes'] = _bytes
+    return data
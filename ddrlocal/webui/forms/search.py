@@ -7,7 +7,7 @@ from django.conf import settings
 from django.core.cache import cache
 
 from webui import models
-from webui.models import docstore
+from webui import docstores
 
 
 # Pretty labels for multiple choice fields
@@ -29,9 +29,7 @@ def forms_choice_labels():
     """
     global FORMS_CHOICE_LABELS
     if not FORMS_CHOICE_LABELS:
-        ds = docstore.DocstoreManager(
-            models.INDEX_PREFIX, settings.DOCSTORE_HOST, settings
-        )
+        ds = docstores.manager(models.INDEX_PREFIX, settings.DOCSTORE_HOST)
         forms_choices = ds.es.get(
             index='ddrforms',
             id='forms-choices'
@@ -24,12 +24,26 @@ updated and (TODO) can request an update if they want.
 
 Queue file
 
-List of collection_ids and timestamps, arranged in timestamp order (ASCENDING)
+SQLite database of collection_ids and timestamps, indexed by timestamp,
+so picking the next repo or rescheduling one does not require reading
+and sorting the whole queue.
 Collections that have not been updated are timestamped with past date (epoch)
-First line contains date of last queue_generate().
+The date of last queue_generate() is kept in the meta table.
 Timestamps represent next earliest update datetime.
 After running gitstatus on collection, next update time is scheduled.
-Time is slightly randomized so updates gradually spread out.
+Workers claim collections inside a write transaction so several Celery
+workers do not clobber each other.
+queue_dumps/queue_loads convert the queue to/from the old text format.
+
+
+Status files
+
+Each collection's status is written to STORE/tmp/{collection_id}.status.
+The first line is a versioned JSON header (timestamp, elapsed, sync status,
+fingerprint) so it can be read without parsing git-status/annex-status.
+Headers are also copied into a store-level manifest
+(STORE/tmp/gitstatus-manifest.db) so queue_generate() and list pages
+can get the headers of all collections in one read.
 
 
 Example: Update store
@@ -47,12 +61,14 @@ Example: Update store
 
 """
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import json
 import logging
 logger = logging.getLogger(__name__)
 import os
 import re
+import sqlite3
 
 from django.conf import settings
 from django.core.cache import cache
@@ -62,9 +78,14 @@ from DDR import dvcs
 from DDR.storage import is_writable
 from ddrlocal.models import DDRLocalCollection as Collection
 from webui import COLLECTION_STATUS_TIMEOUT
+from webui import catalog
+from webui import locks
 from webui.identifier import Identifier
 
 COLLECTION_SYNC_STATUS_CACHE_KEY = 'webui:collection:%s:sync-status'
+COLLECTION_GITSTATUS_DIRTY_CACHE_KEY = 'webui:collection:%s:gitstatus-dirty'
+MANIFEST_REBUILD_CACHE_KEY = 'webui:gitstatus:manifest-rebuild'
+MANIFEST_REBUILD_TIMEOUT = 60 * 10
 
 SYNC_STATUS_BOOTSTRAP_COLOR = {
     'unknown': 'muted',
@@ -75,6 +96,14 @@ SYNC_STATUS_BOOTSTRAP_COLOR = {
     'locked': 'warning',
 }
 
+# sync state of collections not (yet) in the manifest
+SYNC_STATE_UNKNOWN = {
+    'organization_id': None,
+    'status': 'unknown',
+    'color': SYNC_STATUS_BOOTSTRAP_COLOR['unknown'],
+    'timestamp': None,
+}
+
 COLLECTION_ANNEX_INFO_CACHE_KEY = 'webui:collection:%s:annex-info'
 ANNEX_WHEREIS_CACHE_KEY = 'webui:file:%s:annex-whereis'
 
@@ -130,15 +159,9 @@ def tmp_dir( base_dir ):
 def queue_path( base_dir ):
     return os.path.join(
         tmp_dir(base_dir),
-        'gitstatus-queue'
+        'gitstatus-queue.db'
     )
     
-def lock_path( base_dir ):
-    return os.path.join(
-        tmp_dir(base_dir),
-        'gitstatus-lock'
-    )
-
 def path( base_dir, collection_path ):
     """
     - STORE/status/ddr-test-123.status
@@ -157,40 +180,299 @@ def status_paths( base_dir ):
     statuses.sort()
     return statuses
 
-def dumps( timestamp, elapsed, status, annex_status, syncstatus ):
+def manifest_path( base_dir ):
+    """
+    - STORE/tmp/gitstatus-manifest.db
+    """
+    return os.path.join(tmp_dir(base_dir), 'gitstatus-manifest.db')
+
+MANIFEST_SCHEMA = """
+CREATE TABLE IF NOT EXISTS headers (
+    collection_id TEXT PRIMARY KEY,
+    header TEXT
+);
+CREATE TABLE IF NOT EXISTS sync (
+    collection_id TEXT PRIMARY KEY,
+    organization_id TEXT,
+    status TEXT,
+    timestamp TEXT
+);
+CREATE INDEX IF NOT EXISTS sync_organization ON sync (organization_id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+def _manifest_connect( base_dir ):
+    connection = sqlite3.connect(
+        manifest_path(base_dir), timeout=QUEUE_TIMEOUT, isolation_level=None
+    )
+    connection.executescript(MANIFEST_SCHEMA)
+    return connection
+
+def _manifest_put( connection, collection_id, header ):
+    """Writes header and its sync state to manifest
+    """
+    connection.execute(
+        'INSERT OR REPLACE INTO headers (collection_id, header) VALUES (?, ?)',
+        (collection_id, header)
+    )
+    syncstatus = json.loads(header).get('sync_status') or {}
+    connection.execute(
+        'INSERT OR REPLACE INTO sync'
+        ' (collection_id, organization_id, status, timestamp) VALUES (?, ?, ?, ?)',
+        (
+            collection_id,
+            # TODO use Identifier
+            collection_id.rsplit('-', 1)[0],
+            syncstatus.get('status', 'unknown'),
+            syncstatus.get('timestamp'),
+        )
+    )
+
+def manifest_update( base_dir, collection_id, header ):
+    """Adds or replaces collection's header line in store-level manifest
+    
+    Also updates the collection's row in the sync-status aggregate.
+    
+    @param base_dir: Absolute path to Store dir
+    @param collection_id: str
+    @param header: str JSON header line from .status file
+    """
+    connection = _manifest_connect(base_dir)
+    try:
+        connection.execute('BEGIN IMMEDIATE')
+        _manifest_put(connection, collection_id, header)
+        connection.execute('COMMIT')
+    except:
+        connection.execute('ROLLBACK')
+        raise
+    finally:
+        connection.close()
+
+def manifest_rebuild( base_dir ):
+    """Rebuilds store-level manifest from header lines of .status files
+    
+    @param base_dir: Absolute path to Store dir
+    """
+    log('rebuilding gitstatus manifest')
+    connection = _manifest_connect(base_dir)
+    try:
+        connection.execute('BEGIN IMMEDIATE')
+        connection.execute('DELETE FROM headers')
+        connection.execute('DELETE FROM sync')
+        for path in status_paths(base_dir):
+            collection_id = os.path.basename(path).replace('.status', '')
+            with open(path, 'r') as f:
+                header = f.readline().strip()
+            if not header.startswith('{'):
+                # old-style file; parse all of it once
+                with open(path, 'r') as f:
+                    header = header_dumps(loads(f.read()))
+            _manifest_put(connection, collection_id, header)
+        connection.execute(
+            'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+            ('built', converters.datetime_to_text(datetime.now(settings.TZ)))
+        )
+        connection.execute('COMMIT')
+    except:
+        connection.execute('ROLLBACK')
+        raise
+    finally:
+        connection.close()
+
+def manifest_built( base_dir ):
+    """Whether manifest has been built from all the .status files
+    
+    manifest_update alone only adds the collections it is given.
+    
+    @param base_dir: Absolute path to Store dir
+    @returns: boolean
+    """
+    if not os.path.exists(manifest_path(base_dir)):
+        return False
+    connection = _manifest_connect(base_dir)
+    try:
+        row = connection.execute("SELECT value FROM meta WHERE key='built'").fetchone()
+    finally:
+        connection.close()
+    return row is not None
+
+def manifest_request_rebuild( base_dir ):
+    """Starts a background manifest rebuild unless one was started recently
+    
+    For web requests, which should not wait while every .status file is read.
+    
+    @param base_dir: Absolute path to Store dir
+    @returns: boolean True if a rebuild was started
+    """
+    if not cache.add(MANIFEST_REBUILD_CACHE_KEY, 1, MANIFEST_REBUILD_TIMEOUT):
+        return False
+    # tasks import this module
+    from webui.tasks import dvcs as dvcs_tasks
+    dvcs_tasks.gitstatus_manifest_rebuild.apply_async()
+    return True
+
+def manifest_read( base_dir ):
+    """Returns headers of all .status files in Store in a single read
+    
+    Manifest is rebuilt from .status files if it has not been built.
+    For use in tasks (e.g. queue_generate).
+    
+    @param base_dir: Absolute path to Store dir
+    @returns: dict {collection_id: header}; see header_loads
+    """
+    if not manifest_built(base_dir):
+        manifest_rebuild(base_dir)
+    connection = _manifest_connect(base_dir)
+    try:
+        rows = connection.execute(
+            'SELECT collection_id, header FROM headers'
+        ).fetchall()
+    finally:
+        connection.close()
+    return {
+        collection_id: header_loads(header)
+        for collection_id,header in rows
+    }
+
+def sync_states( base_dir, organization_id=None ):
+    """Sync state of each collection in Store (or organization) in one read
+    
+    If the manifest has not been built yet a rebuild is started in the
+    background and no states are returned; callers show SYNC_STATE_UNKNOWN.
+    
+    @param base_dir: Absolute path to Store dir
+    @param organization_id: str (optional)
+    @returns: dict {collection_id: {status, color, timestamp}}
+    """
+    if not manifest_built(base_dir):
+        manifest_request_rebuild(base_dir)
+        return {}
+    connection = _manifest_connect(base_dir)
+    try:
+        if organization_id:
+            rows = connection.execute(
+                'SELECT collection_id, organization_id, status, timestamp FROM sync'
+                ' WHERE organization_id=?', (organization_id,)
+            ).fetchall()
+        else:
+            rows = connection.execute(
+                'SELECT collection_id, organization_id, status, timestamp FROM sync'
+            ).fetchall()
+    finally:
+        connection.close()
+    states = {}
+    for collection_id,oid,status,timestamp in rows:
+        if timestamp:
+            timestamp = converters.text_to_datetime(timestamp)
+        states[collection_id] = {
+            'organization_id': oid,
+            'status': status,
+            'color': SYNC_STATUS_BOOTSTRAP_COLOR.get(status, 'muted'),
+            'timestamp': timestamp,
+        }
+    return states
+
+def sync_summary( base_dir ):
+    """Store-wide sync-status counts, per organization and in total
+    
+    Reads the aggregate kept in the manifest (see write) so it is
+    one read no matter how many collections are in the Store.
+    
+    @param base_dir: Absolute path to Store dir
+    @returns: dict {total: {status: count}, organizations: {oid: {status: count}}, collections}
+    """
+    states = sync_states(base_dir)
+    total = {status: 0 for status in SYNC_STATUS_BOOTSTRAP_COLOR.keys()}
+    organizations = {}
+    for collection_id,state in states.items():
+        status = state['status']
+        total[status] = total.get(status, 0) + 1
+        counts = organizations.setdefault(state['organization_id'], {})
+        counts[status] = counts.get(status, 0) + 1
+    return {
+        'total': total,
+        'organizations': organizations,
+        'collections': states,
+    }
+
+STATUS_FORMAT_VERSION = 2
+
+def header_dumps( data ):
+    """Formats timestamp,elapsed,sync-status and fingerprint as one line of JSON
+    
+    @param data: dict (keys: timestamp,elapsed,sync_status,fingerprint)
+    @returns: str
+    """
+    syncstatus = data.get('sync_status')
+    if syncstatus and isinstance(syncstatus.get('timestamp'), datetime):
+        syncstatus = dict(syncstatus)
+        syncstatus['timestamp'] = converters.datetime_to_text(syncstatus['timestamp'])
+    timestamp = data.get('timestamp')
+    if isinstance(timestamp, datetime):
+        timestamp = converters.datetime_to_text(timestamp)
+    elapsed = data.get('elapsed')
+    if elapsed is not None:
+        elapsed = str(elapsed)
+    return json.dumps({
+        'version': STATUS_FORMAT_VERSION,
+        'timestamp': timestamp,
+        'elapsed': elapsed,
+        'sync_status': syncstatus,
+        'fingerprint': data.get('fingerprint'),
+    })
+
+def header_loads( text ):
+    """Converts JSON header line to Python objects
+    
+    @param text: str
+    @returns: dict (keys: version,timestamp,elapsed,sync_status,fingerprint)
+    """
+    header = json.loads(text)
+    if header.get('timestamp'):
+        header['timestamp'] = converters.text_to_datetime(header['timestamp'])
+    syncstatus = header.get('sync_status')
+    if syncstatus and syncstatus.get('timestamp',None):
+        syncstatus['timestamp'] = converters.text_to_datetime(syncstatus['timestamp'])
+    return header
+
+def dumps( timestamp, elapsed, status, annex_status, syncstatus, fingerprint=None ):
     """Formats git-status,git-annex-status,sync-status and timestamp as text
     
+    The first line is a JSON header so timestamp, elapsed, sync status
+    and fingerprint can be read without reading the rest of the file.
+    
     Sample:
-        {timestamp} {elapsed}
+        {"version": 2, "timestamp": ..., "elapsed": ..., "sync_status": ..., "fingerprint": ...}
         %%
         {status}
         %%
         {annex status}
-        %%
-        {sync status}
     """
-    timestamp_elapsed = ' '.join([
-        converters.datetime_to_text(timestamp),
-        str(elapsed)
-    ])
+    header = header_dumps({
+        'timestamp': timestamp,
+        'elapsed': elapsed,
+        'sync_status': syncstatus,
+        'fingerprint': fingerprint,
+    })
     return '\n%%\n'.join([
-        timestamp_elapsed,
+        header,
         status,
         json.dumps(annex_status),
-        json.dumps(syncstatus),
     ])
 
-def loads( text ):
-    """Converts status data from text to Python objects
-    
-    @returns: dict (keys: timestamp,elapsed,status,annex_status,syncstatus)
+def _loads_v1( text ):
+    """Converts status data from old (pre-header) text format
     """
     # we don't know in advance how many fields exist in .gitstatus
     # so get as many as we can
-    variables = [None,None,None,None]
+    variables = [None,None,None,None,None]
     for n,part in enumerate(text.split('%%')):
         variables[n] = part.strip()
     timestamp = None
+    elapsed = None
     meta = variables[0]
     if meta:
         ts,elapsed = meta.split(' ')
@@ -202,20 +484,50 @@ def loads( text ):
         syncstatus = json.loads(syncstatus)
         if syncstatus.get('timestamp',None):
             syncstatus['timestamp'] = converters.text_to_datetime(syncstatus['timestamp'])
+    fingerprint = None
+    if variables[4]: # not present in older files
+        fingerprint = json.loads(variables[4])
     return {
         'timestamp': timestamp,
         'elapsed': elapsed,
         'status': status,
         'annex_status': annex_status,
         'sync_status': syncstatus,
+        'fingerprint': fingerprint,
     }
 
-def write( base_dir, collection_path, timestamp, elapsed, status, annex_status, syncstatus ):
-    """Writes .gitstatus for the collection; see format.
+def loads( text ):
+    """Converts status data from text to Python objects
+    
+    annex_status is left as (JSON) text; decode it if you need it.
+    
+    @returns: dict (keys: timestamp,elapsed,status,annex_status,syncstatus,fingerprint)
     """
-    text = dumps(timestamp, elapsed, status, annex_status, syncstatus) + '\n'
+    if not text.startswith('{'):
+        return _loads_v1(text)
+    header,status,annex_status = text.split('\n%%\n', 2)
+    data = header_loads(header)
+    return {
+        'timestamp': data['timestamp'],
+        'elapsed': data['elapsed'],
+        'status': status.strip(),
+        'annex_status': annex_status.strip(),
+        'sync_status': data['sync_status'],
+        'fingerprint': data['fingerprint'],
+    }
+
+def write( base_dir, collection_path, timestamp, elapsed, status, annex_status, syncstatus, fingerprint=None ):
+    """Writes .gitstatus for the collection and updates manifest; see format.
+    """
+    text = dumps(timestamp, elapsed, status, annex_status, syncstatus, fingerprint) + '\n'
     with open(path(base_dir, collection_path), 'w') as f:
         f.write(text)
+    try:
+        manifest_update(
+            base_dir, os.path.basename(collection_path), text.split('\n', 1)[0]
+        )
+    except sqlite3.Error as err:
+        log('ERROR manifest %s %s' % (collection_path, err))
     return text
 
 def read( base_dir, collection_path ):
@@ -227,6 +539,73 @@ def read( base_dir, collection_path ):
         return loads(text)
     return {}
 
+def read_header( base_dir, collection_path ):
+    """Reads only timestamp,elapsed,sync-status,fingerprint for the collection
+    
+    @returns: dict; see header_loads
+    """
+    if os.path.exists(path(base_dir, collection_path)):
+        with open(path(base_dir, collection_path), 'r') as f:
+            header = f.readline().strip()
+            if not header.startswith('{'):
+                data = _loads_v1(header + f.read())
+                data.pop('status'); data.pop('annex_status')
+                return data
+        return header_loads(header)
+    return {}
+
+def _ref_sha( git_dir, ref ):
+    """Reads sha of ref from loose ref file or packed-refs, without running git
+    """
+    ref_path = os.path.join(git_dir, ref)
+    if os.path.exists(ref_path):
+        with open(ref_path, 'r') as f:
+            return f.read().strip()
+    packed = os.path.join(git_dir, 'packed-refs')
+    if os.path.exists(packed):
+        with open(packed, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if line.endswith(' %s' % ref):
+                    return line.split(' ')[0]
+    return None
+
+def _mtime_size( path ):
+    if os.path.exists(path):
+        st = os.stat(path)
+        return [st.st_mtime_ns, st.st_size]
+    return None
+
+def fingerprint( collection_path ):
+    """Cheap summary of repository state that changes when git-status might
+    
+    Reads a few files under .git/ instead of running git/git-annex:
+    HEAD sha, mtimes of refs/remotes, mtime/size of index,
+    and sha of the git-annex branch.
+    
+    @param collection_path: str Absolute path to collection repo
+    @returns: dict
+    """
+    git_dir = os.path.join(collection_path, '.git')
+    with open(os.path.join(git_dir, 'HEAD'), 'r') as f:
+        head = f.read().strip()
+    if head.startswith('ref:'):
+        head_ref = head.split(' ', 1)[1]
+        head = '%s %s' % (head_ref, _ref_sha(git_dir, head_ref))
+    remotes = {}
+    remotes_dir = os.path.join(git_dir, 'refs', 'remotes')
+    for root,dirs,files in os.walk(remotes_dir):
+        for filename in files:
+            path_abs = os.path.join(root, filename)
+            remotes[os.path.relpath(path_abs, git_dir)] = os.stat(path_abs).st_mtime_ns
+    return {
+        'head': head,
+        'remotes': remotes,
+        'packed_refs': _mtime_size(os.path.join(git_dir, 'packed-refs')),
+        'index': _mtime_size(os.path.join(git_dir, 'index')),
+        'annex': _ref_sha(git_dir, 'refs/heads/git-annex'),
+    }
+
 def sync_status( collection_path, git_status, timestamp, cache_set=False, force=False ):
     """Cache collection repo sync status info for collections list page.
     Used in both .collections() and .sync_status_ajax().
@@ -242,15 +621,12 @@ def sync_status( collection_path, git_status, timestamp, cache_set=False, force=
     key = COLLECTION_SYNC_STATUS_CACHE_KEY % collection_id
     data = cache.get(key)
     if force or (not data and cache_set):
-        # we're just getting this so we can call Collection.locked
-        disposable_collection = Collection.from_identifier(cidentifier)
-        # now:
         status = 'unknown'
         if   dvcs.synced(git_status): status = 'synced'
         elif dvcs.ahead(git_status): status = 'ahead'
         elif dvcs.behind(git_status): status = 'behind'
         elif dvcs.conflicted(git_status): status = 'conflicted'
-        elif disposable_collection.locked(): status = 'locked'
+        elif locks.collection_locked(collection_id): status = 'locked'
         if isinstance(timestamp, datetime):
             timestamp = converters.datetime_to_text(timestamp)
         data = {
@@ -263,130 +639,87 @@ def sync_status( collection_path, git_status, timestamp, cache_set=False, force=
         cache.set(key, data, COLLECTION_STATUS_TIMEOUT)
     return data
 
-def update( base_dir, collection_path ):
+def update( base_dir, collection_path, force=True ):
     """Gets a bunch of status info for the collection; refreshes if forced
     
-    timestamp, elapsed, status, annex_status, syncstatus
+    timestamp, elapsed, status, annex_status, syncstatus, fingerprint
+    
+    If not forced and the repository fingerprint matches the one in the
+    existing .status file, git-status and git-annex-status are skipped
+    and only the timestamp (and sync status) are refreshed.
     
     @param force: Boolean Forces refresh of status
     @returns: dict
     """
     start = datetime.now(settings.TZ)
-    repo = dvcs.repository(collection_path)
-    status = dvcs.repo_status(repo, short=True)
-    annex_status = dvcs.annex_status(repo)
+    fprint = fingerprint(collection_path)
+    previous = {}
+    if not force:
+        previous = read(base_dir, collection_path)
+    if previous and previous.get('status') and (previous.get('fingerprint') == fprint):
+        status = previous['status']
+        annex_status = json.loads(previous['annex_status'])
+        unchanged = True
+    else:
+        repo = dvcs.repository(collection_path)
+        status = dvcs.repo_status(repo, short=True)
+        annex_status = dvcs.annex_status(repo)
+        unchanged = False
     timestamp = datetime.now(settings.TZ)
     syncstatus = sync_status(collection_path, git_status=status, timestamp=timestamp, force=True)
     elapsed = timestamp - start
-    text = write(base_dir, collection_path, timestamp, elapsed, status, annex_status, syncstatus)
-    return loads(text)
+    text = write(base_dir, collection_path, timestamp, elapsed, status, annex_status, syncstatus, fprint)
+    # keep listing pages from having to update the catalog themselves
+    try:
+        catalog.update(base_dir, collection_path)
+    except Exception as err:
+        logger.error('catalog.update %s: %s' % (collection_path, err))
+    data = loads(text)
+    data['unchanged'] = unchanged
+    return data
 
 
 
 def lock( base_dir, task_id ):
     """Sets a lock to prevent update_store from running
     
-    Multiple locks can be set. Locks are added to the lockfile
-    and removed on unlock. This helps avoid a race condition:
+    Multiple locks can be set, one per task_id.  Locks are kept in Redis
+    (see webui.locks) and expire after LOCK_TIMEOUT in case the task dies.
+    This helps avoid a race condition:
     - Task A locks.
     - Task B locks.
-    - Task B unlocks, removing lockfile.
-    - gitstatus.update_store() thinks it's okay to run.
-    
-    >>> basedir = '/tmp/gitstatus'
-    >>> lockpath = lock_path(basedir)
-    >>> os.path.exists(lockpath)
-    False
-    >>> locked_global(basedir)
-    False
-    >>> lock(basedir, '1234')
-    '2014-07-15T15:17:15:254884 1234'
-    >>> os.path.exists(lockpath)
-    True
-    >>> locked_global(basedir)
-    '2014-07-15T15:17:15:254884 1234'
-    >>> lock(basedir, '1248')
-    '2014-07-15T15:17:15:254884 1234\n2014-07-15T15:17:15:254907 1248'
-    >>> locked_global(basedir)
-    '2014-07-15T15:17:15:254884 1234\n2014-07-15T15:17:15:254907 1248'
-    >>> unlock(basedir, '1234')
-    '2014-07-15T15:17:15:254907 1248'
-    >>> lock(basedir, '1248')
-    ''
-    >>> os.path.exists(lockpath)
-    False
-    >>> locked_global(basedir)
-    False
-    
-    TODO Other parts of the app may want to do this too
+    - Task B unlocks.
+    - gitstatus.update_store() still sees Task A's lock.
     
+    @param base_dir: Absolute path to Store dir (unused)
     @param task_id: Unique identifier for task.
-    @returns: Complete text of lockfile
-    """
-    ts = converters.datetime_to_text(datetime.now(settings.TZ))
-    text = '%s %s' % (ts, task_id)
-    LOCK = lock_path(base_dir)
-    locks = []
-    if os.path.exists(LOCK):
-        with open(LOCK, 'r') as f:
-            locks = f.readlines()
-    already = None
-    for lock in locks:
-        lock = lock.strip()
-        if lock:
-            ts,tsk = lock.split(' ', 1)
-            if task_id == tsk:
-                already = True
-    if not already:
-        locks.append(text)
-    cleaned = [lock.strip() for lock in locks]
-    lockfile_text = '\n'.join(cleaned)
-    with open(LOCK, 'w') as f:
-        f.write(lockfile_text)
-    return lockfile_text
+    @returns: list of task_ids holding lock
+    """
+    return locks.lock_global(task_id)
 
 def unlock( base_dir, task_id ):
     """Removes specified lock and allows update_store to run again
     
     See docs for lock().
     
+    @param base_dir: Absolute path to Store dir (unused)
     @param task_id: Unique identifier for task.
-    @returns: Complete text of lockfile
-    """
-    LOCK = lock_path(base_dir)
-    locks = []
-    if os.path.exists(LOCK):
-        with open(LOCK, 'r') as f:
-            locks = f.readlines()
-    remaining = []
-    for lock in locks:
-        lock = lock.strip()
-        if lock:
-            ts,tsk = lock.split(' ', 1)
-            if not task_id == tsk:
-                remaining.append(lock)
-    lockfile_text = '\n'.join(remaining)
-    if lockfile_text:
-        with open(LOCK, 'w') as f:
-            f.write(lockfile_text)
-    else:
-        if os.path.exists(LOCK):
-            os.remove(LOCK)
-    return lockfile_text
+    @returns: list of task_ids still holding lock
+    """
+    return locks.unlock_global(task_id)
 
 def locked_global( base_dir ):
     """Indicates whether gitstatus global lock is in effect.
     
     See docs for lock().
     
-    @returns: True, False
+    @param base_dir: Absolute path to Store dir (unused)
+    @returns: list of task_ids, False
     """
-    LOCK = lock_path(base_dir)
-    if os.path.exists(LOCK):
-        with open(LOCK, 'r') as f:
-            locks = f.readlines()
-        return locks
-    return False
+    return locks.locked_global()
+
+# queue_dumps/loads placeholder for a queue with no generated time
+GENERATED_UNKNOWN = 'unknown'
 
 def queue_loads( text ):
     """Load queue from string
@@ -403,7 +736,11 @@ def queue_loads( text ):
     }
     """
     lines = text.strip().split('\n')
-    generated = converters.text_to_datetime(lines.pop(0).strip().split()[1])
+    generated = lines.pop(0).strip().split()[1]
+    if generated == GENERATED_UNKNOWN:
+        generated = None
+    else:
+        generated = converters.text_to_datetime(generated)
     queue = {'generated':generated, 'collections':[]}
     for line in lines:
         ts,collection_id = line.split()
@@ -428,26 +765,98 @@ def queue_dumps( queue ):
             c[1],
         ]))
     lines.sort()
-    lines.insert(0, 'generated %s' % converters.datetime_to_text(queue['generated']))
+    generated = GENERATED_UNKNOWN
+    if queue.get('generated'):
+        generated = converters.datetime_to_text(queue['generated'])
+    lines.insert(0, 'generated %s' % generated)
     return '\n'.join(lines) + '\n'
 
+QUEUE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS queue (
+    collection_id TEXT PRIMARY KEY,
+    timestamp REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS queue_timestamp ON queue (timestamp);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS intervals (
+    collection_id TEXT PRIMARY KEY,
+    interval REAL NOT NULL
+);
+"""
+# Seconds to wait for another worker's write transaction to finish
+QUEUE_TIMEOUT = 30
+
+def _ts( dt ):
+    """datetime -> epoch seconds"""
+    return dt.timestamp()
+
+def _dt( ts ):
+    """epoch seconds -> datetime"""
+    return datetime.fromtimestamp(ts, settings.TZ)
+
 def queue_read( base_dir ):
-    """Read queue from file.
+    """Opens the queue database
+    
+    The connection is used as the queue argument for queue_mark_updated,
+    next_time, next_repo(s), and queue_dict. Use it as a context manager
+    to group changes into a single transaction.
+    
+    @param base_dir: Absolute path to Store dir
+    @returns: sqlite3.Connection
+    @raises: FileNotFoundError if there is no queue yet
     """
     path = queue_path(base_dir)
-    assert os.path.exists(path)
-    with open(path, 'r') as f:
-        text = f.read()
-    return queue_loads(text)
+    if not os.path.exists(path):
+        raise FileNotFoundError('No gitstatus queue: %s' % path)
+    queue = sqlite3.connect(path, timeout=QUEUE_TIMEOUT, isolation_level=None)
+    queue.executescript(QUEUE_SCHEMA)
+    return queue
 
 def queue_write( base_dir, queue ):
-    """Write queue to file.
-    if queue timestamp too old, queue_generate()
+    """Replaces queue contents with queue dict
+    
+    @param base_dir: Absolute path to Store dir
+    @param queue: dict, output of queue_generate or queue_loads
     """
     path = queue_path(base_dir)
-    text = queue_dumps(queue)
-    with open(path, 'w') as f:
-        f.write(text)
+    db = sqlite3.connect(path, timeout=QUEUE_TIMEOUT, isolation_level=None)
+    try:
+        db.executescript(QUEUE_SCHEMA)
+        db.execute('BEGIN IMMEDIATE')
+        db.execute('DELETE FROM queue')
+        db.executemany(
+            'INSERT OR REPLACE INTO queue (collection_id, timestamp) VALUES (?, ?)',
+            [(cid, _ts(timestamp)) for timestamp,cid in queue['collections']]
+        )
+        db.execute(
+            'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+            ('generated', converters.datetime_to_text(queue['generated']))
+        )
+        db.execute('COMMIT')
+    finally:
+        db.close()
+
+def queue_dict( queue ):
+    """Loads entire queue into a dict; see queue_loads
+    
+    @param queue: sqlite3.Connection
+    @returns: dict
+    """
+    row = queue.execute(
+        "SELECT value FROM meta WHERE key='generated'"
+    ).fetchone()
+    return {
+        'generated': converters.text_to_datetime(row[0]) if row else None,
+        'collections': [
+            [_dt(ts), cid]
+            for cid,ts in queue.execute(
+                'SELECT collection_id, timestamp FROM queue ORDER BY timestamp'
+            )
+        ],
+    }
 
 def queue_generate( base_dir, repos_orgs ):
     """Generates a new queue file
@@ -459,11 +868,9 @@ def queue_generate( base_dir, repos_orgs ):
     log('regenerating gitstatus queue')
     queue = {'collections': []}
     cids = []
-    # gitstatuses
-    for path in status_paths(base_dir):
-        collection_id = path.replace(tmp_dir(base_dir), '').replace('/','').replace('.status', '')
-        status = read(base_dir, collection_id)  # read timestamp from .status file
-        queue['collections'].append( (status['timestamp'],collection_id) )
+    # gitstatuses (timestamps from manifest of .status headers)
+    for collection_id,header in sorted(manifest_read(base_dir).items()):
+        queue['collections'].append( (header['timestamp'],collection_id) )
         cids.append(collection_id)
     # collections without gitstatuses
     epoch = datetime(1969, 12, 31, 16, 0, tzinfo=settings.TZ)
@@ -480,85 +887,225 @@ def queue_generate( base_dir, repos_orgs ):
 def queue_mark_updated( queue, collection_id, delta, minimum ):
     """Resets or adds collection timestamp and returns queue
     
-    @param queue
+    @param queue: sqlite3.Connection
     @param collection_id
     @param delta: int (seconds) Delta added to highest available timestamp
     @param minimum: int (seconds) Minimum delta
     @returns: queue with updated collection timestamp
     """
     timestamp = next_time(queue, delta, minimum)
-    present = False
-    for line in queue['collections']:
-        ts,cid = line
-        if cid == collection_id:
-            line[0] = timestamp
-            present = True
-    if not present:
-        queue['collections'].append([timestamp, collection_id])
+    queue.execute(
+        'INSERT OR REPLACE INTO queue (collection_id, timestamp) VALUES (?, ?)',
+        (collection_id, _ts(timestamp))
+    )
     return queue
 
+def queue_reschedule( queue, collection_id, changed, floor, ceiling, initial ):
+    """Adjusts collection's refresh interval and schedules next update
+    
+    Interval is halved when the repo changed since the last update
+    and doubled when it did not, within ${floor} and ${ceiling}.
+    Collections without an interval start at ${initial}.
+    
+    @param queue: sqlite3.Connection
+    @param collection_id
+    @param changed: boolean Repository fingerprint changed
+    @param floor: int (seconds) Minimum interval
+    @param ceiling: int (seconds) Maximum interval
+    @param initial: int (seconds) Starting interval
+    @returns: datetime Next update time
+    """
+    row = queue.execute(
+        'SELECT interval FROM intervals WHERE collection_id=?', (collection_id,)
+    ).fetchone()
+    if row:
+        interval = row[0]
+        if changed:
+            interval = interval / 2
+        else:
+            interval = interval * 2
+    else:
+        interval = initial
+    interval = max(floor, min(ceiling, interval))
+    timestamp = datetime.now(settings.TZ) + timedelta(seconds=interval)
+    queue.execute(
+        'INSERT OR REPLACE INTO intervals (collection_id, interval) VALUES (?, ?)',
+        (collection_id, interval)
+    )
+    queue.execute(
+        'INSERT OR REPLACE INTO queue (collection_id, timestamp) VALUES (?, ?)',
+        (collection_id, _ts(timestamp))
+    )
+    return timestamp
+
+def touch( base_dir, collection_path, floor=None, delay=0 ):
+    """Moves a collection that was just modified to the front of the queue
+    
+    Called after edit/sync/import tasks.  The collection's interval is
+    reset to ${floor} since someone is actively working on it.
+    Does nothing if there is no queue yet.
+    
+    @param base_dir: Absolute path to Store dir
+    @param collection_path: Absolute path to collection repo
+    @param floor: int (seconds) Minimum interval (default GITSTATUS_INTERVAL_MIN)
+    @param delay: int (seconds) Schedule next update this far in the future
+    """
+    if floor is None:
+        floor = settings.GITSTATUS_INTERVAL_MIN
+    if not os.path.exists(queue_path(base_dir)):
+        return
+    collection_id = os.path.basename(collection_path)
+    queue = None
+    try:
+        queue = queue_read(base_dir)
+        queue.execute('BEGIN IMMEDIATE')
+        queue.execute(
+            'INSERT OR REPLACE INTO intervals (collection_id, interval) VALUES (?, ?)',
+            (collection_id, floor)
+        )
+        queue.execute(
+            'INSERT OR REPLACE INTO queue (collection_id, timestamp) VALUES (?, ?)',
+            (collection_id, _ts(datetime.now(settings.TZ) + timedelta(seconds=delay)))
+        )
+        queue.execute('COMMIT')
+    except (sqlite3.Error, FileNotFoundError) as err:
+        # uncommitted changes are rolled back when the connection is closed
+        log('ERROR touch %s %s' % (collection_id, err))
+    finally:
+        if queue:
+            queue.close()
+
+def mark_dirty( collection_path, timeout ):
+    """Records that collection needs a gitstatus refresh
+    
+    @param collection_path: Absolute path to collection repo
+    @param timeout: int (seconds)
+    @returns: True if collection was not already marked dirty
+    """
+    key = COLLECTION_GITSTATUS_DIRTY_CACHE_KEY % os.path.basename(collection_path)
+    return cache.add(key, datetime.now(settings.TZ), timeout)
+
+def clear_dirty( collection_path ):
+    """Clears dirty flag; call before (not after) refreshing
+    
+    Changes made during the refresh will then request another refresh.
+    """
+    cache.delete(COLLECTION_GITSTATUS_DIRTY_CACHE_KEY % os.path.basename(collection_path))
+
 def next_time( queue, delta, minimum ):
     """Chooses the next earliest time a repo can be updated
     
     Chooses highest timestamp in queue plus ${delta},
     or at least ${now} + ${minimum}.
     
-    @param queue
+    @param queue: sqlite3.Connection
     @param delta: int (seconds) Delta added to highest available timestamp
     @param minimum: int (seconds) Minimum delta
     @returns: datetime
     """
-    latest = None
-    for ts,cid in sorted(queue['collections']):
-        if (not latest) or (ts > latest):
-            latest = ts
-    timestamp = latest + timedelta(seconds=delta)
     earliest = datetime.now(settings.TZ) + timedelta(seconds=minimum)
+    latest = queue.execute('SELECT MAX(timestamp) FROM queue').fetchone()[0]
+    if latest is None:
+        return earliest
+    timestamp = _dt(latest) + timedelta(seconds=delta)
     if timestamp < earliest:
         timestamp = earliest
     return timestamp
 
+def next_repos( queue, limit=1, local=False, lease=60*5 ):
+    """Claims collection_paths that are due to be updated
+    
+    Collections are returned in order of timestamp (earliest first).
+    Claimed collections are pushed ${lease} seconds into the future
+    in the same transaction so other workers will not pick them up.
+    If the worker dies they become available again when the lease runs out.
+    
+    @param queue: sqlite3.Connection
+    @param limit: int Maximum number of collection_paths to return.
+    @param local: Boolean Use local per-collection locks or global lock.
+    @param lease: int (seconds)
+    @returns: list of collection_paths or ('notready',next_available)
+    """
+    paths = []
+    next_available = None
+    now = datetime.now(settings.TZ)
+    leased = _ts(now + timedelta(seconds=lease))
+    queue.execute('BEGIN IMMEDIATE')
+    try:
+        # index scan in ascending order by timestamp
+        due = queue.execute(
+            'SELECT collection_id, timestamp FROM queue'
+            ' WHERE timestamp < ? ORDER BY timestamp',
+            (_ts(now),)
+        )
+        claimed = []
+        locked = {}
+        if local:
+            locked = locks.locked_collections()
+        for cid,ts in due:
+            if len(paths) >= limit:
+                break
+            # local: skip collections that are locked
+            if cid in locked:
+                continue
+            ci = Identifier(id=cid)
+            paths.append(ci.path_abs())
+            claimed.append(cid)
+        queue.executemany(
+            'UPDATE queue SET timestamp=? WHERE collection_id=?',
+            [(leased, cid) for cid in claimed]
+        )
+        if not paths:
+            row = queue.execute(
+                'SELECT MIN(timestamp) FROM queue WHERE timestamp >= ?',
+                (_ts(now),)
+            ).fetchone()
+            if row and row[0] is not None:
+                next_available = _dt(row[0])
+        queue.execute('COMMIT')
+    except:
+        queue.execute('ROLLBACK')
+        raise
+    if paths:
+        return paths
+    return ('notready',next_available)
+
 def next_repo( queue, local=False ):
     """Gets next collection_path or time til next ready to be updated
         
-    @param queue: 
+    @param queue: sqlite3.Connection
     @param local: Boolean Use local per-collection locks or global lock.
     @returns: collection_path or (msg,timedelta)
     """
-    collection_path = None
-    message = None
-    next_available = None
-    # sorts collections in ascending order by timestamp
-    collections = sorted(queue['collections'])
-    # now choose
-    if local:
-        # choose first collection that is not locked
-        for timestamp,cid in collections:
-            if datetime.now(settings.TZ) > timestamp:
-                ci = Identifier(id=cid)
-                if not Collection.from_identifier(ci).locked():
-                    return ci.path_abs()
-            if (not next_available) or (timestamp < next_available):
-                next_available = timestamp
-    else:
-        # global lock - just take the first collection
-        for timestamp,cid in collections:
-            if datetime.now(settings.TZ) > timestamp:
-                ci = Identifier(id=cid)
-                return ci.path_abs()
-            if (not next_available) or (timestamp < next_available):
-                next_available = timestamp
-    return ('notready',next_available)
+    response = next_repos(queue, limit=1, local=local)
+    if isinstance(response, list):
+        return response[0]
+    return response
+
+def _update_repo( base_dir, collection_path ):
+    """Runs update() for one collection, trapping errors so a batch can finish
+    
+    @returns: (collection_path, elapsed, unchanged, error)
+    """
+    try:
+        status = update(base_dir, collection_path, force=False)
+        return collection_path,status['elapsed'],status['unchanged'],None
+    except Exception as err:
+        log('ERROR %s %s' % (collection_path, err))
+        return collection_path,None,None,err
 
-def update_store( base_dir, delta, minimum, local=False ):
+def update_store( base_dir, delta, minimum, local=False, batch_size=1, workers=1, floor=None, ceiling=None ):
     """
     
     - Ensures only one gitstatus_update task running at a time
     - Checks to make sure MEDIA_BASE is readable and that no
       other process has requested a lock.
-    - Pulls next collection_path off the queue.
-    - Triggers a gitstatus update/write
-    - 
+    - Pulls up to ${batch_size} due collection_paths off the queue.
+    - Triggers gitstatus update/writes in a pool of ${workers} threads;
+      repos whose fingerprint has not changed only get a new timestamp.
+    - Reschedules the batch in one queue transaction when all updates are finished.
+      Each collection's interval starts at ${minimum} and shrinks or grows
+      (within ${floor}/${ceiling}) depending on whether it changed.
     
     Reference: Ensuring only one gitstatus_update runs at a time
     http://docs.celeryproject.org/en/latest/tutorials/task-cookbook.html#cookbook-task-serial
@@ -567,12 +1114,20 @@ def update_store( base_dir, delta, minimum, local=False ):
     @param delta: int (seconds) Delta added to highest available timestamp
     @param minimum: int (seconds) Minimum delta
     @param local: boolean Use per-collection locks
+    @param batch_size: int Maximum number of collections to update
+    @param workers: int Maximum number of simultaneous updates
+    @param floor: int (seconds) Minimum per-collection interval
+    @param ceiling: int (seconds) Maximum per-collection interval
     @returns: success/fail message
     """
+    if floor is None:
+        floor = minimum
+    if ceiling is None:
+        ceiling = minimum
     if not os.path.exists(base_dir):
         raise Exception('base_dir does not exist. No Store mounted?: %s' % base_dir)
     GITSTATUS_LOCK_ID = 'gitstatus-update-lock'
-    GITSTATUS_LOCK_EXPIRE = 60 * 5
+    GITSTATUS_LOCK_EXPIRE = 60 * 5 * max(1, batch_size // max(1, workers))
     acquire_lock = lambda: cache.add(GITSTATUS_LOCK_ID, 'true', GITSTATUS_LOCK_EXPIRE)
     release_lock = lambda: cache.delete(GITSTATUS_LOCK_ID)
     #logger.debug('git status: %s', collection_path)
@@ -586,26 +1141,60 @@ def update_store( base_dir, delta, minimum, local=False ):
             
             locked = None
             if not local:
-                messages.append('using global lockfile')
+                messages.append('using global lock')
                 locked = locked_global(base_dir)
             if locked:
                 messages.append('locked: %s' % locked)
             
             if writable and not locked:
-                collection_path = None
+                collection_paths = []
                 queue = queue_read(base_dir)
-                response = next_repo(queue, local=local)
-                if isinstance(response, list) or isinstance(response, tuple):
-                    messages.append('next_repo %s' % str(response))
-                elif isinstance(response, str) and os.path.exists(response):
-                    collection_path = response
-                if collection_path:
-                    timestamp,elapsed,status,annex_status,syncstatus = update(base_dir, collection_path)
-                    # TODO use Identifier
-                    collection_id = os.path.basename(collection_path)
-                    queue = queue_mark_updated(queue, collection_id, delta, minimum)
-                    queue_write(base_dir, queue)
-                    messages.append('%s updated' % (collection_path))
+                try:
+                    response = next_repos(
+                        queue, limit=batch_size, local=local,
+                        lease=GITSTATUS_LOCK_EXPIRE
+                    )
+                    if isinstance(response, tuple):
+                        messages.append('next_repo %s' % str(response))
+                    else:
+                        collection_paths = response
+                    results = []
+                    existing = [path for path in collection_paths if os.path.exists(path)]
+                    if existing:
+                        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+                            results = list(pool.map(
+                                lambda path: _update_repo(base_dir, path),
+                                existing
+                            ))
+                    # reschedule everything that was claimed, even if it failed,
+                    # so one bad repo doesn't block the head of the queue
+                    updated = {
+                        collection_path: unchanged
+                        for collection_path,elapsed,unchanged,err in results
+                        if not err
+                    }
+                    queue.execute('BEGIN IMMEDIATE')
+                    for collection_path in collection_paths:
+                        # TODO use Identifier
+                        collection_id = os.path.basename(collection_path)
+                        if collection_path in updated:
+                            queue_reschedule(
+                                queue, collection_id,
+                                changed=not updated[collection_path],
+                                floor=floor, ceiling=ceiling, initial=minimum
+                            )
+                        else:
+                            queue_mark_updated(queue, collection_id, delta, minimum)
+                    queue.execute('COMMIT')
+                    for collection_path,elapsed,unchanged,err in results:
+                        if err:
+                            messages.append('%s failed: %s' % (collection_path, err))
+                        elif unchanged:
+                            messages.append('%s unchanged (%s)' % (collection_path, elapsed))
+                        else:
+                            messages.append('%s updated (%s)' % (collection_path, elapsed))
+                finally:
+                    queue.close()
             
         finally:
             release_lock()
@@ -1,5 +1,7 @@
+from collections import OrderedDict
 from copy import deepcopy
 import os
+import threading
 
 from django.conf import settings
 from django.http import HttpRequest
@@ -21,7 +23,62 @@ for k,v in deepcopy(DDR_MODEL_CLASSES).items():
     MODEL_CLASSES[k] = v
 
 
-class Identifier(DDRIdentifier):
+_identifiers = OrderedDict()
+_identifiers_lock = threading.Lock()
+
+def _intern_key(cls, args, kwargs):
+    """Cache key for Identifier(oid), Identifier(id=...), Identifier(path=...)
+    
+    Other forms (request, idparts dict, etc) are not cached.
+    """
+    base_path = kwargs.get('base_path', settings.MEDIA_BASE)
+    other = set(kwargs.keys()) - set(['base_path'])
+    if len(args) == 1 and isinstance(args[0], str) and not other:
+        return (cls, 'arg', args[0], base_path)
+    if not args and len(other) == 1:
+        name = other.pop()
+        if name in ['id', 'path'] and isinstance(kwargs[name], str):
+            return (cls, name, kwargs[name], base_path)
+    return None
+
+
+class InterningIdentifierType(type):
+    """Returns the same Identifier instance for the same id or path
+    
+    Parsing an id/path with DDR's regexes is relatively slow and the
+    same Identifiers are made again and again (lists, breadcrumbs, API).
+    Keeps up to settings.IDENTIFIER_CACHE_SIZE Identifiers, LRU.
+    Identifiers are shared, so they are frozen once made: setting an
+    attribute raises AttributeError (see Identifier.__setattr__).
+    Copy dicts like idparts before changing them.
+    """
+    
+    def __call__(cls, *args, **kwargs):
+        size = settings.IDENTIFIER_CACHE_SIZE
+        key = None
+        if size:
+            key = _intern_key(cls, args, kwargs)
+        if key is None:
+            return super().__call__(*args, **kwargs)
+        with _identifiers_lock:
+            oi = _identifiers.get(key)
+            if oi is not None:
+                _identifiers.move_to_end(key)
+                return oi
+        oi = super().__call__(*args, **kwargs)
+        oi.__dict__['_frozen'] = True
+        with _identifiers_lock:
+            _identifiers[key] = oi
+            while len(_identifiers) > size:
+                _identifiers.popitem(last=False)
+        return oi
+
+def identifier_cache_clear():
+    with _identifiers_lock:
+        _identifiers.clear()
+
+
+class Identifier(DDRIdentifier, metaclass=InterningIdentifierType):
 
     def __init__(self, *args, **kwargs):
         if kwargs and 'request' in kwargs:
@@ -45,6 +102,47 @@ class Identifier(DDRIdentifier):
     def __repr__(self):
         return "<%s.%s %s:%s>" % (self.__module__, self.__class__.__name__, self.model, self.id)
     
+    def __setattr__(self, name, value):
+        """Interned Identifiers are shared and cannot be changed
+        """
+        if self.__dict__.get('_frozen'):
+            raise AttributeError(
+                "Identifier %s is shared; can't set %s" % (self.id, name)
+            )
+        super(Identifier, self).__setattr__(name, value)
+    
+    def _memoized(self, name, function, args, kwargs):
+        """Returns result of function, computed once per instance and args
+        """
+        if not settings.IDENTIFIER_CACHE_SIZE:
+            return function(*args, **kwargs)
+        memo = self.__dict__.setdefault('_memo', {})
+        key = (name, args, tuple(sorted(kwargs.items())))
+        if key not in memo:
+            memo[key] = function(*args, **kwargs)
+        return memo[key]
+    
+    def path_abs(self, *args, **kwargs):
+        return self._memoized(
+            'path_abs', super(Identifier, self).path_abs, args, kwargs
+        )
+    
+    def lineage(self, *args, **kwargs):
+        # copy: callers pop() from the list
+        return list(self._memoized(
+            'lineage', super(Identifier, self).lineage, args, kwargs
+        ))
+    
+    def parent_id(self, *args, **kwargs):
+        return self._memoized(
+            'parent_id', super(Identifier, self).parent_id, args, kwargs
+        )
+    
+    def collection_id(self, *args, **kwargs):
+        return self._memoized(
+            'collection_id', super(Identifier, self).collection_id, args, kwargs
+        )
+    
     def absolute_url(self):
         return reverse('webui-%s' % self.model, args=[self.id])
     
@@ -0,0 +1,121 @@
+"""
+identitymap - Request-scoped identity map for repository objects
+
+Within one request the same Collection/Entity/File is often loaded
+several times (the view, check_parents, entity.collection(), templates).
+While a request is being handled (see webui.middleware.IdentityMapMiddleware)
+objects loaded through webui.documents are remembered here, and later
+loads of the same document return the same instance.
+
+Outside of a request (tasks, management commands) the map is not active
+and nothing is remembered.
+
+Other values that only need to be looked up once per request (e.g. the
+document generations in webui.documents) can be kept with memo().
+
+Counters record how many documents were loaded during the request and
+how many of those were read from disk, to help catch N+1 problems.
+"""
+
+import contextvars
+
+_map = contextvars.ContextVar('webui_identitymap', default=None)
+
+
+def start():
+    """Activates an empty identity map for the current request
+    
+    @returns: contextvars.Token, pass to stop()
+    """
+    return _map.set({
+        'objects': {},
+        'memo': {},
+        'hits': 0,
+        'loaded': 0,
+        'read': 0,
+    })
+
+def stop(token):
+    """Deactivates identity map and returns its counters
+    
+    @returns: dict {hits, loaded, read}
+    """
+    data = _map.get()
+    _map.reset(token)
+    if data is None:
+        return {}
+    return {key: data[key] for key in ['hits', 'loaded', 'read']}
+
+def active():
+    return _map.get() is not None
+
+def get(key):
+    """Returns object already loaded during this request, or None
+    
+    @param key: (object_class, path_abs, kwargs)
+    """
+    data = _map.get()
+    if data is None:
+        return None
+    document = data['objects'].get(key)
+    if document is not None:
+        data['hits'] += 1
+    return document
+
+def put(key, document, read=False):
+    """Remembers object loaded during this request
+    
+    @param key: hashable
+    @param document: object
+    @param read: boolean Object was read from disk (not from process cache)
+    """
+    data = _map.get()
+    if data is None:
+        return
+    data['objects'][key] = document
+    data['loaded'] += 1
+    if read:
+        data['read'] += 1
+
+def invalidate(path_abs, prefix=None):
+    """Forgets objects loaded from path_abs or from files under prefix
+    """
+    data = _map.get()
+    if data is None:
+        return
+    for key in [
+            key for key in data['objects'].keys()
+            if (key[1] == path_abs) or (prefix and key[1].startswith(prefix))
+    ]:
+        data['objects'].pop(key)
+
+def memo(key, function):
+    """Value computed once per request
+    
+    Outside of a request function is called every time.
+    
+    @param key: hashable
+    @param function: Called with no arguments
+    """
+    data = _map.get()
+    if data is None:
+        return function()
+    if key not in data['memo']:
+        data['memo'][key] = function()
+    return data['memo'][key]
+
+def set_memo(key, value):
+    """Replaces value kept by memo(), e.g. after changing it
+    """
+    data = _map.get()
+    if data is None:
+        return
+    data['memo'][key] = value
+
+def counters():
+    """Counters for current request so far
+    """
+    data = _map.get()
+    if data is None:
+        return {}
+    return {key: data[key] for key in ['hits', 'loaded', 'read']}
@@ -0,0 +1,367 @@
+"""
+indexbuild - Rebuild the search indexes without taking search offline
+
+The search-reindex task used to delete the live indexes, recreate them,
+and publish the whole Store into them one document at a time; search was
+empty or partial until it finished, hours later on a full Store.
+
+Now each run builds a complete new set of indexes next to the live ones
+and swaps them in at the end:
+
+- A DocstoreManager with a versioned index prefix (e.g. "ddr20261018t120000-")
+  creates the indexes with the current mappings, so its index_name() is
+  e.g. "ddr20261018t120000-entity" where the live one is "ddrentity".
+- Replicas and refresh are turned off on the new indexes while loading.
+- Collections are fanned out to REINDEX_WORKERS threads, each of which
+  sends a collection's documents with the bulk API.  Each finished
+  collection is recorded in Redis.
+- Indexes not built from the Store (facets, etc) are copied from the live
+  ones by Elasticsearch.
+- Replica/refresh settings are restored, and each live name is made an
+  alias of its new index in one atomic update_aliases call.  The old
+  indexes are then deleted.
+
+Documents saved while a build is running, up to the moment the aliases
+are swapped, are sent to the new indexes as well as the live ones (see
+mirror() and webui.tasks.index_outbox_drain).
+
+If the worker dies the run state stays in Redis; starting search-reindex
+again continues where it left off, skipping collections already done,
+unless restart=True.
+
+>>> from webui import indexbuild
+>>> indexbuild.status()
+{'version': '20261018t120000', 'collections': 812, 'done': 140, ...}
+"""
+
+from datetime import datetime
+import json
+import logging
+logger = logging.getLogger(__name__)
+import re
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from elasticsearch import helpers
+from elasticsearch import NotFoundError
+
+from DDR import converters
+from DDR.models.common import from_json
+
+from webui import docstores
+from webui import querycache
+from webui.cache import redis_connection
+from webui.modeldefs import document_ids
+
+# models published from the Store; other indexes are copied
+MODELS = ['collection', 'entity', 'segment', 'file']
+STATE_KEY = 'webui:indexbuild:state'
+DONE_KEY = 'webui:indexbuild:%s:done'
+LOCK_KEY = 'webui:indexbuild:lock'
+# refreshed while publishing; a dead run's lock goes away after this
+LOCK_TIMEOUT = 60 * 30
+# seconds between lock refreshes while publishing a collection
+LOCK_REFRESH = 60
+# <version>-<model> part of a build index name
+BUILD_INDEX_RE = re.compile(r'^\d{8}t\d{6}-(?P<model>.+)$')
+# used while loading, then restored to the values the indexes were created with
+BULK_SETTINGS = {'refresh_interval': '-1', 'number_of_replicas': 0}
+
+
+def lock():
+    """Only one reindex may run at a time
+
+    @returns: boolean True if lock acquired
+    """
+    return cache.add(LOCK_KEY, 1, LOCK_TIMEOUT)
+
+def lock_refresh():
+    cache.touch(LOCK_KEY, LOCK_TIMEOUT)
+
+def unlock():
+    cache.delete(LOCK_KEY)
+
+
+# run state ------------------------------------------------------------
+
+def state():
+    """State of the current (or interrupted) run, or None
+
+    @returns: dict
+    """
+    text = redis_connection().get(STATE_KEY)
+    if text:
+        return json.loads(text)
+    return None
+
+def save_state(data):
+    redis_connection().set(STATE_KEY, json.dumps(data))
+
+def clear_state(data):
+    r = redis_connection()
+    r.delete(DONE_KEY % data['version'], STATE_KEY)
+
+def collection_done(data, collection_path):
+    redis_connection().sadd(DONE_KEY % data['version'], collection_path)
+
+def collections_done(data):
+    return redis_connection().smembers(DONE_KEY % data['version'])
+
+def status():
+    """Summary of current run for display
+
+    @returns: dict or None
+    """
+    data = state()
+    if not data:
+        return None
+    return {
+        'version': data['version'],
+        'started': data['started'],
+        'stage': data.get('stage'),
+        'collections': data.get('collections'),
+        'done': redis_connection().scard(DONE_KEY % data['version']),
+    }
+
+
+# indexes --------------------------------------------------------------
+
+def build_prefix(index_prefix, version):
+    """
+    >>> build_prefix('ddr', '20261018t120000')
+    'ddr20261018t120000-'
+    """
+    return '%s%s-' % (index_prefix, version)
+
+def index_model(index, index_prefix):
+    """Model name from a live or build index name (e.g. a hit's _index)
+
+    Documents read through an alias report the concrete (build) index.
+
+    >>> index_model('ddrentity', 'ddr')
+    'entity'
+    >>> index_model('ddr20261018t120000-entity', 'ddr')
+    'entity'
+    """
+    match = BUILD_INDEX_RE.match(index[len(index_prefix):])
+    if index.startswith(index_prefix) and match:
+        return match.group('model')
+    return index.replace(index_prefix, '')
+
+def live_name(data, index):
+    """Live (alias) name of a build index
+
+    >>> live_name({'prefix': 'ddr20261018t120000-', 'index_prefix': 'ddr'}, 'ddr20261018t120000-entity')
+    'ddrentity'
+    """
+    return data['index_prefix'] + index[len(data['prefix']):]
+
+def build_manager(ds, data):
+    """DocstoreManager that reads/writes the build indexes
+
+    @param ds: DocstoreManager for the live indexes (its client is reused)
+    @param data: dict Run state
+    @returns: DocstoreManager
+    """
+    return docstores.make_manager(data['prefix'], settings.DOCSTORE_HOST, ds.es)
+
+def _build_indexes(ds, data):
+    return sorted(ds.es.indices.get(index=data['prefix'] + '*').keys())
+
+def start(ds, index_prefix, collection_paths):
+    """Creates build indexes for a new run
+
+    @param ds: DocstoreManager for the live indexes
+    @param index_prefix: str Live index prefix
+    @param collection_paths: list
+    @returns: dict Run state
+    """
+    version = datetime.now(settings.TZ).strftime('%Y%m%dt%H%M%S')
+    data = {
+        'version': version,
+        'index_prefix': index_prefix,
+        'prefix': build_prefix(index_prefix, version),
+        'started': converters.datetime_to_text(datetime.now(settings.TZ)),
+        'stage': 'create',
+        'collections': len(collection_paths),
+        'restore': {},
+    }
+    bds = build_manager(ds, data)
+    bds.create_indices()
+    indexes = _build_indexes(ds, data)
+    current = ds.es.indices.get_settings(index=','.join(indexes))
+    for index in indexes:
+        values = current[index]['settings']['index']
+        data['restore'][index] = {
+            key: values.get(key) for key in BULK_SETTINGS.keys()
+        }
+    ds.es.indices.put_settings(index=','.join(indexes), settings={'index': BULK_SETTINGS})
+    save_state(data)
+    logger.info('reindex %s: created %s' % (version, indexes))
+    return data
+
+def abandon(ds, data):
+    """Deletes build indexes and state of an unfinished run
+    """
+    indexes = _build_indexes(ds, data)
+    if indexes:
+        ds.es.indices.delete(index=','.join(indexes))
+    clear_state(data)
+
+def building():
+    """Run state if a reindex is loading documents, else None
+
+    Includes the swap stage: until the aliases point to the build
+    indexes, saves must reach them too.
+    """
+    data = state()
+    if data and (data.get('stage') in ['create', 'publish', 'copy', 'swap']):
+        return data
+    return None
+
+def mirror(actions):
+    """Copies of bulk actions for live indexes, aimed at the build indexes
+
+    @param actions: list of bulk action dicts
+    @returns: list
+    """
+    data = building()
+    if not data:
+        return []
+    prefix = data['index_prefix']
+    mirrored = []
+    for action in actions:
+        index = action['_index']
+        if index.startswith(prefix):
+            copy = dict(action)
+            copy['_index'] = data['prefix'] + index[len(prefix):]
+            mirrored.append(copy)
+    return mirrored
+
+def mirror_post(ds, document):
+    """Posts document to the build indexes if a reindex is loading them
+
+    For documents that are posted with DocstoreManager.post rather than
+    sent as bulk actions.
+
+    @param ds: DocstoreManager for the live indexes
+    @param document: Collection, Entity, File
+    """
+    data = building()
+    if data:
+        build_manager(ds, data).post(document)
+
+
+# publishing -----------------------------------------------------------
+
+def index_action(ds, oid, identifier_class):
+    """Bulk action that indexes the current version of a document
+
+    Documents are parsed with DDR.models.common.from_json rather than
+    through webui.documents so the walk does not flush the page cache.
+
+    @param ds: DocstoreManager whose indexes the action is for
+    @param oid: str
+    @param identifier_class: webui.identifier.Identifier
+    @returns: dict
+    """
+    oi = identifier_class(oid)
+    document = from_json(oi.object_class(), oi.path_abs('json'), oi)
+    return {
+        '_op_type': 'index',
+        '_index': ds.index_name(oi.model),
+        '_id': oid,
+        '_source': document.to_esobject().to_dict(),
+    }
+
+def _actions(bds, collection_path, identifier_class, errors):
+    refreshed = time.time()
+    for oid in document_ids(collection_path):
+        # large collections can take longer than LOCK_TIMEOUT
+        if time.time() - refreshed > LOCK_REFRESH:
+            lock_refresh()
+            refreshed = time.time()
+        try:
+            yield index_action(bds, oid, identifier_class)
+        except Exception as err:
+            logger.error('reindex %s: %s' % (oid, err))
+            errors.append(oid)
+
+def publish_collection(bds, collection_path, identifier_class):
+    """Sends all documents in a collection to the build indexes
+
+    Connection errors are raised; the collection is not marked done and
+    will be published again when the run is resumed.
+
+    @param bds: DocstoreManager from build_manager()
+    @param collection_path: str
+    @param identifier_class: webui.identifier.Identifier
+    @returns: (int indexed, list failed IDs)
+    """
+    errors = []
+    ok,failed = helpers.bulk(
+        bds.es,
+        _actions(bds, collection_path, identifier_class, errors),
+        chunk_size=settings.REINDEX_BATCH_SIZE,
+        raise_on_error=False,
+    )
+    for error in failed:
+        op,info = list(error.items())[0]
+        logger.error('reindex %s: %s' % (info.get('_id'), info.get('error')))
+        errors.append(info.get('_id'))
+    return ok,errors
+
+def copy_other(ds, bds, data, models):
+    """Copies indexes not built from the Store (facets, etc) from live ones
+
+    @param ds: DocstoreManager for the live indexes
+    @param bds: DocstoreManager from build_manager()
+    @param data: dict Run state
+    @param models: list Models that were published from the Store
+    """
+    published = [bds.index_name(model) for model in models]
+    for index in _build_indexes(ds, data):
+        if index in published:
+            continue
+        source = live_name(data, index)
+        try:
+            ds.es.reindex(
+                source={'index': source}, dest={'index': index},
+                wait_for_completion=True, refresh=False,
+            )
+        except NotFoundError:
+            logger.info('reindex %s: no %s to copy' % (data['version'], source))
+
+def finish(ds, data):
+    """Restores settings and swaps the live names over to the build indexes
+
+    @returns: list of new index names
+    """
+    indexes = _build_indexes(ds, data)
+    for index in indexes:
+        ds.es.indices.put_settings(
+            index=index, settings={'index': data['restore'].get(index, {})}
+        )
+    ds.es.indices.refresh(index=','.join(indexes))
+    actions = []
+    old = []
+    for index in indexes:
+        alias = live_name(data, index)
+        if ds.es.indices.exists_alias(name=alias):
+            for previous in ds.es.indices.get_alias(name=alias).keys():
+                actions.append({'remove': {'index': previous, 'alias': alias}})
+                old.append(previous)
+        elif ds.es.indices.exists(index=alias):
+            # first run: live index was a concrete index, not an alias
+            actions.append({'remove_index': {'index': alias}})
+        actions.append({'add': {'index': index, 'alias': alias}})
+    ds.es.indices.update_aliases(actions=actions)
+    # saves now reach the new indexes through the aliases; stop mirroring
+    clear_state(data)
+    logger.info('reindex %s: aliases %s' % (data['version'], actions))
+    querycache.invalidate()
+    if old:
+        ds.es.indices.delete(index=','.join(old), ignore_unavailable=True)
+    return indexes
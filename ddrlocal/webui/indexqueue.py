@@ -0,0 +1,193 @@
+"""
+indexqueue - Outbox of search index updates
+
+Saving a Collection, Entity, or File used to post the document to
+Elasticsearch right away, one HTTP request per document, inside the
+request or task; if the cluster was down the update was logged and lost.
+
+Now saves call post() or delete(), which record the document ID in a Redis
+hash.  Repeated saves of the same document before the outbox is drained
+are coalesced into one update.  The webui.tasks.index_outbox_drain task
+takes the whole hash, loads the current version of each document from
+the Store, and sends them to Elasticsearch with the bulk API in batches
+of INDEX_OUTBOX_BATCH_SIZE.  Updates that fail because the cluster is
+unreachable are put back in the outbox and retried on the next run.
+Documents that still fail after INDEX_OUTBOX_MAX_ATTEMPTS runs are moved
+to a dead-letter hash (DEAD_KEY) along with the last error, where they
+can be inspected and replayed once the cause is fixed.
+
+>>> from webui import indexqueue
+>>> indexqueue.post(entity)
+>>> indexqueue.pending()
+1
+>>> indexqueue.dead_letters()
+{'ddr-test-123-1': {'op': 'post', 'queued': 1700000000.0, 'attempts': 3, 'error': '...'}}
+>>> indexqueue.replay(['ddr-test-123-1'])
+1
+"""
+
+import json
+import logging
+logger = logging.getLogger(__name__)
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from webui.cache import redis_connection
+
+OUTBOX_KEY = 'webui:index:outbox'
+PROCESSING_KEY = 'webui:index:outbox:processing'
+DEAD_KEY = 'webui:index:outbox:dead'
+DRAIN_SCHEDULED_KEY = 'webui:index:outbox:scheduled'
+DRAIN_LOCK_KEY = 'webui:index:outbox:lock'
+DRAIN_LOCK_TIMEOUT = 60 * 30
+
+# move outbox entries into processing (newer entries win) and return
+# processing, in one step so entries queued meanwhile are not lost
+TAKE_SCRIPT = """
+local newer = redis.call('hgetall', KEYS[1])
+for i = 1, #newer, 2 do
+    redis.call('hset', KEYS[2], newer[i], newer[i+1])
+end
+redis.call('del', KEYS[1])
+return redis.call('hgetall', KEYS[2])
+"""
+
+
+def _put(oid, op):
+    r = redis_connection()
+    r.hset(OUTBOX_KEY, oid, json.dumps({'op': op, 'queued': time.time()}))
+    schedule_drain()
+
+def post(document):
+    """Queues document to be (re)indexed
+
+    @param document: Collection, Entity, File
+    """
+    _put(document.id, 'post')
+
+def delete(oid):
+    """Queues document to be removed from index
+
+    @param oid: str
+    """
+    _put(oid, 'delete')
+
+def schedule_drain():
+    """Starts a drain task in INDEX_OUTBOX_DELAY seconds unless one is pending
+
+    Saves made in the meantime go out in the same batch.
+    """
+    delay = settings.INDEX_OUTBOX_DELAY
+    if cache.add(DRAIN_SCHEDULED_KEY, 1, delay + 60):
+        # tasks import webui.models, which imports this module
+        from webui.tasks import docstore as docstore_tasks
+        docstore_tasks.index_outbox_drain.apply_async(countdown=delay)
+
+def drain_started():
+    cache.delete(DRAIN_SCHEDULED_KEY)
+
+def drain_lock():
+    """Only one drain task may run at a time
+
+    @returns: boolean True if lock acquired
+    """
+    return cache.add(DRAIN_LOCK_KEY, 1, DRAIN_LOCK_TIMEOUT)
+
+def drain_unlock():
+    cache.delete(DRAIN_LOCK_KEY)
+
+def take():
+    """Moves outbox contents aside for processing
+
+    If a previous run died while processing, its entries are returned
+    (merged with anything newer).
+
+    @returns: dict oid: {'op', 'queued'[, 'attempts']}
+    """
+    r = redis_connection()
+    take = r.register_script(TAKE_SCRIPT)
+    values = take(keys=[OUTBOX_KEY, PROCESSING_KEY])
+    return {
+        oid: json.loads(value)
+        for oid,value in zip(values[0::2], values[1::2])
+    }
+
+def done(oids):
+    """Removes entries that have been processed
+
+    @param oids: list
+    """
+    if oids:
+        redis_connection().hdel(PROCESSING_KEY, *oids)
+
+def requeue(entries):
+    """Puts entries back in outbox, unless document was queued again since
+
+    @param entries: dict oid: entry
+    """
+    if not entries:
+        return
+    r = redis_connection()
+    pipe = r.pipeline()
+    for oid,entry in entries.items():
+        pipe.hsetnx(OUTBOX_KEY, oid, json.dumps(entry))
+    pipe.hdel(PROCESSING_KEY, *entries.keys())
+    pipe.execute()
+
+def bury(entries):
+    """Moves entries that keep failing to the dead-letter hash
+
+    @param entries: dict oid: entry (with 'error')
+    """
+    if not entries:
+        return
+    r = redis_connection()
+    pipe = r.pipeline()
+    pipe.hset(DEAD_KEY, mapping={
+        oid: json.dumps(entry) for oid,entry in entries.items()
+    })
+    pipe.hdel(PROCESSING_KEY, *entries.keys())
+    pipe.execute()
+
+def dead_letters():
+    """Entries that failed INDEX_OUTBOX_MAX_ATTEMPTS times
+
+    @returns: dict oid: {'op', 'queued', 'attempts', 'error'}
+    """
+    return {
+        oid: json.loads(value)
+        for oid,value in redis_connection().hgetall(DEAD_KEY).items()
+    }
+
+def replay(oids=None):
+    """Puts dead-letter entries back in the outbox with fresh attempts
+
+    @param oids: list (default: all)
+    @returns: int Number of entries replayed
+    """
+    dead = dead_letters()
+    if oids is not None:
+        dead = {oid: entry for oid,entry in dead.items() if oid in oids}
+    if not dead:
+        return 0
+    r = redis_connection()
+    pipe = r.pipeline()
+    for oid,entry in dead.items():
+        # newer saves in the outbox win
+        pipe.hsetnx(OUTBOX_KEY, oid, json.dumps(
+            {'op': entry['op'], 'queued': entry['queued']}
+        ))
+    pipe.hdel(DEAD_KEY, *dead.keys())
+    pipe.execute()
+    schedule_drain()
+    return len(dead)
+
+def pending():
+    """Number of documents waiting to be indexed
+
+    @returns: int
+    """
+    r = redis_connection()
+    return r.hlen(OUTBOX_KEY) + r.hlen(PROCESSING_KEY)
@@ -0,0 +1,236 @@
+"""
+indexsync - Reindex only the documents that changed since the last reindex
+
+Collection.reindex (after sync, file import, or from the reindex button)
+used to post every document in the collection, even when a sync had only
+pulled a handful of changed entity.json files.
+
+Now the commit that was indexed is recorded per collection, along with a
+fingerprint of the search index mappings.  The next
+reindex asks git what changed since then:
+
+    git diff --name-status <last>..HEAD
+
+and sends only the added/modified documents (and deletes the removed
+ones) in one bulk request.  The full reindex runs as before when there is
+no marker, the marked commit is gone (e.g. history was rewritten), or the
+mappings changed.  A search-reindex alias swap does not count as a change.
+
+>>> from webui import indexsync
+>>> indexsync.changes('/var/www/media/ddr/ddr-test-123', 'a1b2c3d')
+(['ddr-test-123-4', 'ddr-test-123-4-master-a1b2c3d4e5'], ['ddr-test-123-5'])
+"""
+
+import hashlib
+import json
+import logging
+logger = logging.getLogger(__name__)
+import os
+import subprocess
+
+from elasticsearch import helpers
+
+from webui import indexbuild
+from webui import querycache
+from webui.cache import redis_connection
+
+MARKERS_KEY = 'webui:indexsync:markers'
+
+
+def _git(collection_path, args):
+    return subprocess.run(
+        ['git', '-C', collection_path] + args,
+        capture_output=True, text=True
+    )
+
+def head(collection_path):
+    """Current commit of collection repo, or None
+
+    @param collection_path: str
+    @returns: str
+    """
+    proc = _git(collection_path, ['rev-parse', '--verify', 'HEAD'])
+    if proc.returncode != 0:
+        return None
+    return proc.stdout.strip()
+
+def document_id(collection_path, path_rel):
+    """ID of the document a changed file belongs to, or None
+
+    >>> document_id('/base/ddr-test-123', 'collection.json')
+    'ddr-test-123'
+    >>> document_id('/base/ddr-test-123', 'files/ddr-test-123-4/entity.json')
+    'ddr-test-123-4'
+    >>> document_id('/base/ddr-test-123', 'files/ddr-test-123-4/files/ddr-test-123-4-master-a1b2c3d4e5.json')
+    'ddr-test-123-4-master-a1b2c3d4e5'
+    >>> document_id('/base/ddr-test-123', 'files/ddr-test-123-4/files/ddr-test-123-4-master-a1b2c3d4e5.jpg')
+
+    @param collection_path: str
+    @param path_rel: str Path relative to collection repo
+    @returns: str or None
+    """
+    parts = path_rel.split('/')
+    if path_rel == 'collection.json':
+        return os.path.basename(collection_path.rstrip('/'))
+    if (len(parts) >= 3) and (parts[0] == 'files') and (parts[-1] == 'entity.json'):
+        return parts[-2]
+    if (len(parts) >= 4) and (parts[-2] == 'files') and parts[-1].endswith('.json'):
+        return os.path.splitext(parts[-1])[0]
+    return None
+
+def changes(collection_path, since, until='HEAD'):
+    """Documents added/modified and removed between two commits
+
+    Renames are treated as a delete plus an add.
+
+    @param collection_path: str
+    @param since: str Commit
+    @param until: str Commit
+    @returns: (posted, deleted) lists of IDs, or None if git diff failed
+    """
+    proc = _git(collection_path, [
+        'diff', '--name-status', '--no-renames', '-z', '%s..%s' % (since, until)
+    ])
+    if proc.returncode != 0:
+        logger.debug('%s: %s' % (collection_path, proc.stderr.strip()))
+        return None
+    posted = set()
+    deleted = set()
+    fields = proc.stdout.split('\0')
+    for status,path_rel in zip(fields[0::2], fields[1::2]):
+        oid = document_id(collection_path, path_rel)
+        if not oid:
+            continue
+        if status == 'D':
+            deleted.add(oid)
+        else:
+            posted.add(oid)
+    # e.g. a file's JSON was rewritten by git rm + add
+    deleted -= posted
+    return sorted(posted), sorted(deleted)
+
+def fingerprint(ds):
+    """Changes when the index mappings change
+
+    Only the mappings count, not the physical indexes: search-reindex
+    swaps new indexes in behind the same names, and that alone should
+    not make every collection do a full reindex.  Responses are keyed by
+    concrete index name, which changes with each build, so the mappings
+    are hashed as a sorted list.
+
+    @param ds: DocstoreManager
+    @returns: str
+    """
+    names = [ds.index_name(model) for model in indexbuild.MODELS]
+    mappings = ds.es.indices.get_mapping(index=','.join(names), ignore_unavailable=True)
+    data = sorted(
+        json.dumps(index['mappings'], sort_keys=True)
+        for index in mappings.values()
+    )
+    return hashlib.sha1(
+        json.dumps(data).encode('utf-8')
+    ).hexdigest()
+
+
+# markers --------------------------------------------------------------
+
+def marker(collection_id):
+    """Commit and index fingerprint at last reindex, or None
+
+    @param collection_id: str
+    @returns: dict {'commit', 'fingerprint'}
+    """
+    text = redis_connection().hget(MARKERS_KEY, collection_id)
+    if text:
+        return json.loads(text)
+    return None
+
+def set_marker(collection_id, commit, fp):
+    if commit:
+        redis_connection().hset(
+            MARKERS_KEY, collection_id,
+            json.dumps({'commit': commit, 'fingerprint': fp})
+        )
+
+def clear_marker(collection_id):
+    redis_connection().hdel(MARKERS_KEY, collection_id)
+
+
+# reindex --------------------------------------------------------------
+
+def bulk(ds, posted, deleted, identifier_class):
+    """Indexes posted and removes deleted documents in one bulk request
+
+    Documents whose JSON is gone are removed.  Actions are mirrored into
+    indexes being built by search-reindex.
+
+    @param ds: DocstoreManager
+    @param posted: list of IDs
+    @param deleted: list of IDs
+    @param identifier_class: webui.identifier.Identifier
+    @returns: dict {'posted', 'deleted', 'failed'}
+    """
+    failed = []
+    actions = []
+    gone = list(deleted)
+    for oid in posted:
+        oi = identifier_class(oid)
+        if not os.path.exists(oi.path_abs('json')):
+            gone.append(oid)
+            continue
+        try:
+            actions.append(indexbuild.index_action(ds, oid, identifier_class))
+        except Exception as err:
+            logger.error('indexsync %s: %s' % (oid, err))
+            failed.append(oid)
+    for oid in gone:
+        oi = identifier_class(oid)
+        actions.append(
+            {'_op_type': 'delete', '_index': ds.index_name(oi.model), '_id': oid}
+        )
+    actions += indexbuild.mirror(actions)
+    ok,errors = helpers.bulk(ds.es, actions, raise_on_error=False)
+    querycache.invalidate(set(action['_index'] for action in actions))
+    for error in errors:
+        op,info = list(error.items())[0]
+        if (op == 'delete') and (info.get('status') == 404):
+            continue
+        logger.error('indexsync %s: %s' % (info.get('_id'), info.get('error')))
+        failed.append(info.get('_id'))
+    return {
+        'posted': len(posted) - (len(gone) - len(deleted)),
+        'deleted': len(gone),
+        'failed': failed,
+    }
+
+def reindex(collection, ds, full_reindex, full=False):
+    """Reindexes documents changed since last reindex, or all of them
+
+    @param collection: Collection
+    @param ds: DocstoreManager
+    @param full_reindex: function Reindexes the whole collection
+    @param full: boolean Do a full reindex regardless of marker
+    @returns: dict
+    """
+    commit = head(collection.path)
+    fp = fingerprint(ds)
+    last = marker(collection.id)
+    if commit and last and not full and (last['fingerprint'] == fp):
+        diff = changes(collection.path, last['commit'], commit)
+        if diff is not None:
+            posted,deleted = diff
+            result = bulk(ds, posted, deleted, collection.identifier.__class__)
+            logger.debug('%s %s..%s %s' % (
+                collection.id, last['commit'][:7], commit[:7], result
+            ))
+            # failed documents are sent again next time, from the same commit
+            if not result['failed']:
+                set_marker(collection.id, commit, fp)
+            result['full'] = False
+            return result
+    logger.debug('%s full reindex at %s' % (collection.id, commit))
+    # marker is the commit from before the reindex, so anything committed
+    # while it runs is picked up next time
+    status = full_reindex()
+    set_marker(collection.id, commit, fp)
+    return {'full': True, 'status': status}
@@ -0,0 +1,357 @@
+"""
+locks - Global, collection, and entity locks kept in Redis
+
+Tasks that must not be interrupted by gitstatus set a global lock;
+tasks that modify a collection or entity lock it.  Each lock records
+the owner (Celery task_id) and expires after a timeout, so locks left
+behind by crashed workers go away on their own.
+
+Global locks are members of a sorted set scored by expiration time,
+so several tasks can hold the global lock at the same time.
+Collection locks are individual keys (one owner each) plus an index
+sorted set, so "which collections are locked" takes one round trip.
+Entity locks are individual keys.  webui.models also writes the repo
+lockfiles, so ddr-cmdln and other tools still see collection and entity
+locks.
+
+While a Celery task runs, the collection and entity locks it holds are
+extended every LOCK_REFRESH seconds (see task_prerun_heartbeat), so a
+long import does not lose its lock after LOCK_TIMEOUT.
+
+Locks are only visible to processes using the same Redis.  Each process
+notes the Redis it uses in STORE/tmp/locks-redis and logs a warning if
+the Store was last used with a different one (e.g. several VMs with
+their own Redis sharing a Store, or a Store moved between machines),
+since locks set on the other machine are not seen here.
+
+>>> from webui import locks
+>>> locks.lock_global('1234')
+['1234']
+>>> locks.locked_global()
+['1234']
+>>> locks.unlock_global('1234')
+[]
+>>> locks.lock_collection('ddr-test-123', '5678')
+'ok'
+>>> locks.collection_locked('ddr-test-123')
+'5678'
+>>> locks.locked_collections()
+{'ddr-test-123': 1700000000.0}
+>>> locks.unlock_collection('ddr-test-123', '5678')
+'ok'
+>>> locks.lock_entity('ddr-test-123-1', '5678')
+'ok'
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+import os
+import socket
+import threading
+import time
+
+from celery.signals import task_postrun, task_prerun
+from django.conf import settings
+
+from webui.cache import redis_connection
+
+GLOBAL_LOCKS_KEY = 'webui:locks:global'
+COLLECTION_LOCKS_KEY = 'webui:locks:collections'
+COLLECTION_LOCK_KEY = 'webui:lock:collection:%s'
+ENTITY_LOCK_KEY = 'webui:lock:entity:%s'
+# lock keys held by a task
+TASK_LOCKS_KEY = 'webui:locks:task:%s'
+# seconds between extensions of a running task's locks
+LOCK_REFRESH = 60
+# hosts whose Redis is only reachable from the machine itself
+LOCAL_HOSTS = ['localhost', '127.0.0.1', '::1']
+
+# delete lock only if it belongs to task; remove from index if there is one
+UNLOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    redis.call('del', KEYS[1])
+    if #KEYS > 1 then
+        redis.call('zrem', KEYS[2], ARGV[2])
+    end
+    return 1
+end
+return 0
+"""
+
+# extend the locks that still belong to task; returns the keys extended
+EXTEND_SCRIPT = """
+local extended = {}
+for i, key in ipairs(KEYS) do
+    if redis.call('get', key) == ARGV[1] then
+        redis.call('expire', key, ARGV[2])
+        table.insert(extended, key)
+    end
+end
+return extended
+"""
+
+# Stores checked by this process
+_checked = set()
+# task_id -> threading.Event that stops the task's heartbeat
+_heartbeats = {}
+
+
+def redis_name():
+    """Names the Redis that holds locks, as seen from any machine
+
+    @returns: str host:port/db
+    """
+    host = settings.REDIS_HOST
+    if host in LOCAL_HOSTS:
+        host = socket.getfqdn()
+    return '%s:%s/%s' % (host, settings.REDIS_PORT, settings.REDIS_DB_CACHE)
+
+def check_store(base_dir):
+    """Warns if Store was last used with a different Redis
+
+    Records this process's Redis in STORE/tmp/locks-redis.
+    Checked once per process; does nothing if the Store is not mounted.
+
+    @param base_dir: Absolute path to Store dir
+    @returns: str Redis recorded before, or None
+    """
+    if base_dir in _checked:
+        return None
+    if not os.path.isdir(base_dir):
+        return None
+    _checked.add(base_dir)
+    path = os.path.join(base_dir, 'tmp', 'locks-redis')
+    name = redis_name()
+    recorded = None
+    try:
+        with open(path, 'r') as f:
+            recorded = f.read().strip()
+    except OSError:
+        pass
+    if recorded == name:
+        return recorded
+    if recorded:
+        logger.warning(
+            'Store %s was last locked through Redis at %s, now %s; '
+            'locks set through the other Redis are not visible here.' % (
+                base_dir, recorded, name
+        ))
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(name)
+    except OSError as err:
+        logger.error('locks %s: %s' % (path, err))
+    return recorded
+
+def _redis():
+    check_store(settings.MEDIA_BASE)
+    return redis_connection()
+
+def _timeout(timeout):
+    if timeout is None:
+        return settings.LOCK_TIMEOUT
+    return timeout
+
+def _live(pipe, key):
+    """Queues removal of expired members and listing of live ones
+    """
+    pipe.zremrangebyscore(key, '-inf', time.time())
+    pipe.zrange(key, 0, -1, withscores=True)
+    return pipe
+
+
+# global ---------------------------------------------------------------
+
+def lock_global(task_id, timeout=None):
+    """Sets a global lock to prevent gitstatus.update_store from running
+
+    @param task_id: str Unique identifier for task.
+    @param timeout: int (seconds) Lock expires after this (default LOCK_TIMEOUT)
+    @returns: list of task_ids holding global lock
+    """
+    expires = time.time() + _timeout(timeout)
+    pipe = _redis().pipeline()
+    pipe.zadd(GLOBAL_LOCKS_KEY, {task_id: expires})
+    results = _live(pipe, GLOBAL_LOCKS_KEY).execute()
+    return [task for task,score in results[-1]]
+
+def unlock_global(task_id):
+    """Removes task's global lock
+
+    @param task_id: str Unique identifier for task.
+    @returns: list of task_ids still holding global lock
+    """
+    pipe = _redis().pipeline()
+    pipe.zrem(GLOBAL_LOCKS_KEY, task_id)
+    results = _live(pipe, GLOBAL_LOCKS_KEY).execute()
+    return [task for task,score in results[-1]]
+
+def locked_global():
+    """Indicates whether global lock is in effect
+
+    @returns: list of task_ids holding global lock, or False
+    """
+    results = _live(_redis().pipeline(), GLOBAL_LOCKS_KEY).execute()
+    tasks = [task for task,score in results[-1]]
+    if tasks:
+        return tasks
+    return False
+
+
+# objects --------------------------------------------------------------
+
+def _lock(key, task_id, timeout):
+    r = _redis()
+    if not r.set(key, task_id, nx=True, ex=timeout):
+        owner = r.get(key)
+        if owner != task_id:
+            return 'locked by %s' % owner
+        r.expire(key, timeout)
+    pipe = r.pipeline()
+    pipe.sadd(TASK_LOCKS_KEY % task_id, key)
+    pipe.expire(TASK_LOCKS_KEY % task_id, timeout)
+    pipe.execute()
+    return 'ok'
+
+def _unlock(keys, task_id, member=None):
+    r = _redis()
+    unlock = r.register_script(UNLOCK_SCRIPT)
+    if unlock(keys=keys, args=[task_id, member or '']):
+        r.srem(TASK_LOCKS_KEY % task_id, keys[0])
+        return 'ok'
+    owner = r.get(keys[0])
+    if owner:
+        return 'locked by %s' % owner
+    return 'not locked'
+
+def _owner(key):
+    owner = _redis().get(key)
+    if owner:
+        return owner
+    return False
+
+
+# collections ----------------------------------------------------------
+
+def lock_collection(collection_id, task_id, timeout=None):
+    """Locks collection for task
+
+    Locking again with the same task_id extends the lock.
+
+    @param collection_id: str
+    @param task_id: str Unique identifier for task.
+    @param timeout: int (seconds) Lock expires after this (default LOCK_TIMEOUT)
+    @returns: 'ok' or error message
+    """
+    timeout = _timeout(timeout)
+    status = _lock(COLLECTION_LOCK_KEY % collection_id, task_id, timeout)
+    if status == 'ok':
+        _redis().zadd(COLLECTION_LOCKS_KEY, {collection_id: time.time() + timeout})
+    return status
+
+def unlock_collection(collection_id, task_id):
+    """Removes collection lock if it belongs to task
+
+    @param collection_id: str
+    @param task_id: str Unique identifier for task.
+    @returns: 'ok' or error message
+    """
+    return _unlock(
+        [COLLECTION_LOCK_KEY % collection_id, COLLECTION_LOCKS_KEY],
+        task_id, collection_id
+    )
+
+def collection_locked(collection_id):
+    """Returns task_id holding collection lock
+
+    @param collection_id: str
+    @returns: task_id or False
+    """
+    return _owner(COLLECTION_LOCK_KEY % collection_id)
+
+def locked_collections():
+    """Returns all locked collections in one round trip
+
+    @returns: dict {collection_id: expiration timestamp}
+    """
+    results = _live(_redis().pipeline(), COLLECTION_LOCKS_KEY).execute()
+    return {cid: expires for cid,expires in results[-1]}
+
+
+# entities -------------------------------------------------------------
+
+def lock_entity(entity_id, task_id, timeout=None):
+    """Locks entity for task
+
+    Locking again with the same task_id extends the lock.
+
+    @param entity_id: str
+    @param task_id: str Unique identifier for task.
+    @param timeout: int (seconds) Lock expires after this (default LOCK_TIMEOUT)
+    @returns: 'ok' or error message
+    """
+    return _lock(ENTITY_LOCK_KEY % entity_id, task_id, _timeout(timeout))
+
+def unlock_entity(entity_id, task_id):
+    """Removes entity lock if it belongs to task
+
+    @param entity_id: str
+    @param task_id: str Unique identifier for task.
+    @returns: 'ok' or error message
+    """
+    return _unlock([ENTITY_LOCK_KEY % entity_id], task_id)
+
+def entity_locked(entity_id):
+    """Returns task_id holding entity lock
+
+    @param entity_id: str
+    @returns: task_id or False
+    """
+    return _owner(ENTITY_LOCK_KEY % entity_id)
+
+
+# heartbeat ------------------------------------------------------------
+
+def extend(task_id, timeout=None):
+    """Extends the collection and entity locks held by task
+
+    @param task_id: str Unique identifier for task.
+    @param timeout: int (seconds) Locks expire after this (default LOCK_TIMEOUT)
+    @returns: list of lock keys extended
+    """
+    timeout = _timeout(timeout)
+    r = _redis()
+    keys = list(r.smembers(TASK_LOCKS_KEY % task_id))
+    if not keys:
+        return []
+    script = r.register_script(EXTEND_SCRIPT)
+    extended = script(keys=keys, args=[task_id, timeout])
+    pipe = r.pipeline()
+    prefix = COLLECTION_LOCK_KEY % ''
+    for key in extended:
+        if key.startswith(prefix):
+            pipe.zadd(COLLECTION_LOCKS_KEY, {key[len(prefix):]: time.time() + timeout})
+    pipe.expire(TASK_LOCKS_KEY % task_id, timeout)
+    pipe.execute()
+    return extended
+
+@task_prerun.connect
+def task_prerun_heartbeat(sender=None, task_id=None, **kwargs):
+    """Keeps running task's locks from expiring
+    """
+    stop = threading.Event()
+    def beat():
+        while not stop.wait(LOCK_REFRESH):
+            try:
+                extend(task_id)
+            except Exception as err:
+                logger.error('locks.extend %s: %s' % (task_id, err))
+    _heartbeats[task_id] = stop
+    threading.Thread(target=beat, name='locks-%s' % task_id, daemon=True).start()
+
+@task_postrun.connect
+def task_postrun_heartbeat(sender=None, task_id=None, **kwargs):
+    stop = _heartbeats.pop(task_id, None)
+    if stop:
+        stop.set()
@@ -0,0 +1,32 @@
+import logging
+logger = logging.getLogger(__name__)
+
+from django.conf import settings
+
+from webui import identitymap
+
+
+class IdentityMapMiddleware:
+    """Gives each request its own identity map; see webui.identitymap
+    
+    With DEBUG on, the number of documents loaded (and read from disk)
+    is logged and added to the response as X-Documents-Loaded.
+    """
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+    
+    def __call__(self, request):
+        token = identitymap.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            counters = identitymap.stop(token)
+        if settings.DEBUG:
+            logger.debug('%s documents loaded=%s read=%s reused=%s' % (
+                request.path, counters['loaded'], counters['read'], counters['hits']
+            ))
+            response['X-Documents-Loaded'] = '%s loaded, %s read, %s reused' % (
+                counters['loaded'], counters['read'], counters['hits']
+            )
+        return response
@@ -0,0 +1,218 @@
+"""
+modeldefs - Compare documents with repository model definitions (ddr-defs)
+
+Every detail and edit page calls webui.models.model_def_commits and
+model_def_fields, which built a modules.Module, asked git for the module's
+latest commit, compared it with the document's commit in the module repo's
+log, and reread and diffed the document's JSON.
+
+Here the module commit is looked up at most once per
+MODULE_COMMIT_TIMEOUT seconds per process per module, so a ddr-defs
+update is noticed without restarting the app.  The commit comparison is
+memoized on
+(module, document commit, module commit) and the field comparison on
+(module, module commit, JSON path, mtime_ns, size).
+
+report() runs the same comparisons for every document in a list of
+collections and writes the out-of-date ones to STORE/tmp/modeldefs.json
+(see webui.tasks.modeldefs_report), so the whole Store can be checked
+without visiting each page.
+
+>>> from webui import modeldefs
+>>> modeldefs.commits_op(document)
+'lt'
+>>> modeldefs.fields_diff(document)
+(['new_field'], [])
+"""
+
+import json
+import logging
+logger = logging.getLogger(__name__)
+import os
+import threading
+import time
+
+from django.utils import timezone
+
+from DDR import converters
+from DDR import fileio
+from DDR import modules
+from DDR.models.common import from_json
+
+CACHE_SIZE = 10000
+# seconds before a module's latest commit is looked up again
+MODULE_COMMIT_TIMEOUT = 60
+
+_lock = threading.Lock()
+# module name -> (time looked up, module commit)
+_module_commits = {}
+# (module name, document commit, module commit) -> op
+_commits = {}
+# (module name, module commit, json_path) -> ((mtime_ns, size), added, removed)
+_fields = {}
+
+
+def _put(cache, key, value):
+    with _lock:
+        if len(cache) >= CACHE_SIZE:
+            cache.pop(next(iter(cache)))
+        cache[key] = value
+
+def module_commit(module):
+    """Latest commit of module's repository
+
+    Looked up again after MODULE_COMMIT_TIMEOUT seconds.
+
+    @param module: modules.Module
+    @returns: str or None
+    """
+    name = module.module.__name__
+    cached = _module_commits.get(name)
+    if (not cached) or (time.time() - cached[0] > MODULE_COMMIT_TIMEOUT):
+        cached = (time.time(), module.module_commit())
+        _module_commits[name] = cached
+    return cached[1]
+
+def commits_op(document):
+    """Compares document's model definitions commit with module's
+
+    @param document: Collection, Entity, File
+    @returns: str One of the MODEL_DEF_COMMITS_STATUS_* ops
+    """
+    module = modules.Module(document.identifier.fields_module())
+    document_commit = module.document_commit(document)
+    mcommit = module_commit(module)
+    if document_commit and mcommit:
+        key = (module.module.__name__, document_commit, mcommit)
+        op = _commits.get(key)
+        if op is None:
+            op = module.cmp_model_definition_commits(document_commit, mcommit)['op']
+            _put(_commits, key, op)
+        return op
+    elif document_commit and not mcommit:
+        return '-m'
+    elif mcommit and not document_commit:
+        return '-d'
+    return '--'
+
+def fields_diff(document):
+    """Fields added to/removed from model definitions, from POV of document
+
+    'File.path_rel' is created when instantiating Files and is not part
+    of model definitions so it is never listed.
+
+    @param document: Collection, Entity, File
+    @returns: (added, removed) lists of field names
+    """
+    module = modules.Module(document.identifier.fields_module())
+    st = os.stat(document.json_path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    key = (module.module.__name__, module_commit(module), document.json_path)
+    cached = _fields.get(key)
+    if cached and cached[0] == stamp:
+        return list(cached[1]), list(cached[2])
+    json_text = fileio.read_text(document.json_path)
+    result = module.cmp_model_definition_fields(json_text)
+    added = [f for f in result['added'] if f != 'path_rel']
+    removed = [f for f in result['removed'] if f != 'path_rel']
+    _put(_fields, key, (stamp, added, removed))
+    return list(added), list(removed)
+
+def clear():
+    with _lock:
+        _module_commits.clear()
+        _commits.clear()
+        _fields.clear()
+
+
+# store-wide report ----------------------------------------------------
+
+def report_path(base_dir):
+    """
+    - STORE/tmp/modeldefs.json
+    """
+    return os.path.join(base_dir, 'tmp', 'modeldefs.json')
+
+def document_ids(collection_path):
+    """IDs of collection and all entities/segments/files in it
+    """
+    yield os.path.basename(collection_path.rstrip('/'))
+    files_dir = os.path.join(collection_path, 'files')
+    for root,subdirs,filenames in os.walk(files_dir):
+        if 'entity.json' in filenames:
+            yield os.path.basename(root)
+        if os.path.basename(root) == 'files' and root != files_dir:
+            for filename in filenames:
+                if filename.endswith('.json'):
+                    yield os.path.splitext(filename)[0]
+
+def check_collection(collection_path, identifier_class):
+    """Out-of-date documents in one collection
+
+    Documents are parsed with DDR.models.common.from_json rather than
+    through webui.documents so the walk does not flush the page cache.
+
+    @param collection_path: str Absolute path to collection repo
+    @param identifier_class: webui.identifier.Identifier
+    @returns: list of dicts (id, op, added, removed)
+    """
+    results = []
+    for oid in document_ids(collection_path):
+        try:
+            oi = identifier_class(oid)
+            document = from_json(oi.object_class(), oi.path_abs('json'), oi)
+            op = commits_op(document)
+            added,removed = fields_diff(document)
+        except Exception as err:
+            logger.error('%s %s' % (oid, err))
+            results.append(
+                {'id': oid, 'op': 'err', 'added': [], 'removed': [], 'error': str(err)}
+            )
+            continue
+        if (op != 'eq') or added or removed:
+            results.append(
+                {'id': oid, 'op': op, 'added': added, 'removed': removed}
+            )
+    return results
+
+def report(base_dir, collection_paths, identifier_class):
+    """Checks all documents in collections, writes out-of-date ones to report
+
+    @param base_dir: Absolute path to Store dir
+    @param collection_paths: list of absolute paths to collection repos
+    @param identifier_class: webui.identifier.Identifier
+    @returns: dict
+    """
+    documents = []
+    for collection_path in collection_paths:
+        documents += check_collection(collection_path, identifier_class)
+    data = {
+        'timestamp': converters.datetime_to_text(timezone.now()),
+        'collections': len(collection_paths),
+        'module_commits': {
+            name: commit for name,(looked_up,commit) in _module_commits.items()
+        },
+        'counts': {
+            op: len([d for d in documents if d['op'] == op])
+            for op in set(d['op'] for d in documents)
+        },
+        'documents': documents,
+    }
+    path = report_path(base_dir)
+    tmp = '%s.%s' % (path, os.getpid())
+    with open(tmp, 'w') as f:
+        f.write(json.dumps(data, indent=1))
+    os.replace(tmp, path)
+    return data
+
+def read_report(base_dir):
+    """Latest report written by report(), or None
+
+    @param base_dir: Absolute path to Store dir
+    @returns: dict or None
+    """
+    try:
+        with open(report_path(base_dir), 'r') as f:
+            return json.loads(f.read())
+    except (OSError, ValueError):
+        return None
@@ -12,11 +12,8 @@ from django.urls import reverse, NoReverseMatch
 
 from rest_framework.reverse import reverse
 
-from elastictools.docstore import ConnectionError
 from DDR import commands
-from DDR import docstore
 from DDR import dvcs
-from DDR import fileio
 from DDR import modules
 from DDR.models.common import from_json
 from DDR.models.common import Stub as DDRStub
@@ -25,7 +22,16 @@ from DDR.models import Collection as DDRCollection
 from DDR.models import Entity as DDREntity
 from DDR.models import File as DDRFile
 
+from webui import docstores
+from webui import documents
+from webui import indexbuild
 from webui import gitstatus
+from webui import indexqueue
+from webui import indexsync
+from webui import locks
+from webui import modeldefs
+from webui import querycache
+from webui import remotes
 from webui import WEBUI_MESSAGES
 from webui import COLLECTION_CHILDREN_CACHE_KEY
 from webui import COLLECTION_FETCH_CACHE_KEY
@@ -39,7 +45,7 @@ from webui.identifier import Identifier, MODULES, VALID_COMPONENTS
 INDEX_PREFIX = 'ddr'
 
 # see if cluster is available, quit with nice message if not
-docstore.DocstoreManager(INDEX_PREFIX, settings.DOCSTORE_HOST, settings).start_test()
+docstores.manager(INDEX_PREFIX, settings.DOCSTORE_HOST).start_test()
 
 # whitelist of params recognized in URL query
 # TODO move to ddr-defs/repo_models/elastic.py?
@@ -206,6 +212,64 @@ PERSONS_TEMPLATE = """
 """
 
 
+# module name -> valid
+_models_valid = {}
+
+def models_valid():
+    """Indicates whether all repo_models modules are valid
+    
+    MODULES are imported once per process, so changes to repo_models
+    files take effect (and are checked) only when the process restarts.
+    Each module is therefore checked once per process, which makes this
+    cheap enough to call on every request.
+    
+    @returns: boolean
+    """
+    valid = True
+    for model,module in MODULES.items():
+        if model not in _models_valid:
+            module_valid,msg = modules.Module(module).is_valid()
+            if not module_valid:
+                logger.error('%s: %s' % (model, msg))
+            _models_valid[model] = module_valid
+        valid = valid and _models_valid[model]
+    return valid
+
+def _lock_mirrored(document, ddr_class, lock, unlock, task_id):
+    """Locks document in Redis (see webui.locks) and writes its lockfile
+    
+    Fails if the lockfile belongs to someone else, e.g. ddr-cmdln.
+    
+    @param document: Collection or Entity
+    @param ddr_class: DDRCollection or DDREntity
+    @param lock: function e.g. locks.lock_collection
+    @param unlock: function e.g. locks.unlock_collection
+    @param task_id: Unique identifier for task.
+    @returns: 'ok' or error message
+    """
+    status = lock(document.id, task_id)
+    if status != 'ok':
+        return status
+    owner = ddr_class.locked(document)
+    if owner and (owner.strip() != task_id):
+        unlock(document.id, task_id)
+        return 'locked by %s' % owner.strip()
+    if not owner:
+        ddr_class.lock(document, task_id)
+    return 'ok'
+
+def _unlock_mirrored(document, ddr_class, unlock, task_id):
+    """Removes Redis lock and lockfile if they belong to task
+    """
+    status = unlock(document.id, task_id)
+    owner = ddr_class.locked(document)
+    if owner and (owner.strip() == task_id):
+        ddr_class.unlock(document, task_id)
+        if status == 'not locked':
+            # Redis lock had expired
+            status = 'ok'
+    return status
+
 def repo_models_valid(request):
     """Displays alerts if repo_models are absent or undefined
     
@@ -214,47 +278,26 @@ def repo_models_valid(request):
     @param request
     @returns: boolean
     """
-    valid = True
     NOIMPORT_MSG = 'Error: Could not import model definitions!'
     UNDEFINED_MSG = 'Error: One or more models improperly defined.'
-    # don't check again if messages already added
-    added = False
+    if models_valid():
+        return True
+    # don't add message again if already added
     for m in messages.get_messages(request):
         if (NOIMPORT_MSG in m.message) or (UNDEFINED_MSG in m.message):
-            added = True
-    if added:
-        valid = False
-    else:
-        valid_modules = [
-            modules.Module(module).is_valid()
-            for model,module in MODULES.items()
-        ]
-        if not (valid_modules):
-            valid = False
-            messages.error(request, UNDEFINED_MSG)
-    return valid
+            return False
+    messages.error(request, UNDEFINED_MSG)
+    return False
 
 def model_def_commits(document):
     """
     Wrapper around DDR.models.model_def_commits
     
+    Comparisons are memoized in webui.modeldefs.
+    
     @param document: Collection, Entity, File
     """
-    module = modules.Module(document.identifier.fields_module())
-    document_commit = module.document_commit(document)
-    module_commit = module.module_commit()
-    if document_commit and module_commit:
-        result = module.cmp_model_definition_commits(
-            document_commit,
-            module_commit
-        )
-        op = result['op']
-    elif document_commit and not module_commit:
-        op = '-m'
-    elif module_commit and not document_commit:
-        op = '-d'
-    else:
-        op = '--'
+    op = modeldefs.commits_op(document)
     alert,msg = WEBUI_MESSAGES['MODEL_DEF_COMMITS_STATUS_%s' % op]
     document.model_def_commits_alert = alert
     document.model_def_commits_msg = msg
@@ -263,18 +306,7 @@ def model_def_fields(document):
     """
     Wrapper around DDR.models.model_def_fields
     """
-    module = document.identifier.fields_module()
-    json_text = fileio.read_text(document.json_path)
-    result = modules.Module(module).cmp_model_definition_fields(json_text)
-    added = result['added']
-    removed = result['removed']
-    # 'File.path_rel' is created when instantiating Files,
-    # is not part of model definitions.
-    def rm_path_rel(fields):
-        if 'path_rel' in fields:
-            fields.remove('path_rel')
-    rm_path_rel(added)
-    rm_path_rel(removed)
+    added,removed = modeldefs.fields_diff(document)
     if added:
         document.model_def_fields_added = added
         document.model_def_fields_added_msg = WEBUI_MESSAGES['MODEL_DEF_FIELDS_ADDED'] % added
@@ -429,7 +461,7 @@ class Collection( DDRCollection ):
         @param identifier: [optional] Identifier
         @returns: Collection
         """
-        return from_json(Collection, path_abs, identifier)
+        return documents.load(Collection, path_abs, identifier, from_json)
     
     @staticmethod
     def from_identifier(identifier):
@@ -438,7 +470,9 @@ class Collection( DDRCollection ):
         @param identifier: Identifier
         @returns: Collection
         """
-        return from_json(Collection, identifier.path_abs('json'), identifier)
+        return documents.load(
+            Collection, identifier.path_abs('json'), identifier, from_json
+        )
     
     @staticmethod
     def from_request(request):
@@ -544,10 +578,36 @@ class Collection( DDRCollection ):
         """
         return '%s/?p=%s/.git;a=tree' % (settings.GITWEB_URL, self.id)
     
+    def lock( self, task_id ):
+        """Locks collection for task; see webui.locks
+        
+        Sets an expiring lock in Redis and writes the repo lockfile,
+        which ddr-cmdln and other tools read.
+        
+        @param task_id: Unique identifier for task.
+        @returns: 'ok' or error message
+        """
+        return _lock_mirrored(
+            self, DDRCollection, locks.lock_collection, locks.unlock_collection, task_id
+        )
+    
+    def unlock( self, task_id ):
+        """Removes collection lock and lockfile if they belong to task
+        
+        @param task_id: Unique identifier for task.
+        @returns: 'ok' or error message
+        """
+        return _unlock_mirrored(self, DDRCollection, locks.unlock_collection, task_id)
+    
+    def locked( self ):
+        """Returns task_id of task holding collection lock or lockfile, or False
+        """
+        return locks.collection_locked(self.id) or DDRCollection.locked(self)
+    
     def unlock_url(self):
-        """Generate unlock URL if a lockfile is present.
+        """Generate unlock URL if collection is locked.
         
-        See DDR.models.collection.Collection.locked.
+        See Collection.locked.
         """
         if self.locked():
             unlock_task_id = self.locked()
@@ -570,6 +630,25 @@ class Collection( DDRCollection ):
             cache.set(key, data, COLLECTION_FETCH_TIMEOUT)
         return data
     
+    def remote_behind( self ):
+        """Server has commits this collection does not
+        
+        Reads result of webui.tasks.remotes_check instead of fetching.
+        If there is no result, or it is older than REMOTES_CHECK_PERIOD
+        (e.g. GITSTATUS_BACKGROUND_ACTIVE is off), fetches as before.
+        
+        @returns: boolean
+        """
+        behind = remotes.stored_behind(
+            self.path,
+            remotes.read(settings.MEDIA_BASE, self.id),
+            settings.REMOTES_CHECK_PERIOD
+        )
+        if behind is None:
+            self.repo_fetch()
+            return self.repo_behind()
+        return behind
+    
     def repo_status( self, force=False ):
         key = COLLECTION_STATUS_CACHE_KEY % self.id
         data = cache.get(key)
@@ -642,15 +721,45 @@ class Collection( DDRCollection ):
         # [delete cache], update search index
         #collection.cache_delete()
         if settings.DOCSTORE_ENABLED:
-            try:
-                docstore.DocstoreManager(
-                    INDEX_PREFIX, settings.DOCSTORE_HOST, settings
-                ).post(collection)
-            except ConnectionError:
-                logger.error('Could not post to Elasticsearch.')
+            indexqueue.post(collection)
         
         return exit,status
     
+    def write_json(self, *args, **kwargs):
+        """Writes JSON and drops object from webui.documents cache
+        """
+        result = super(Collection, self).write_json(*args, **kwargs)
+        documents.invalidate(self.identifier.path_abs('json'))
+        return result
+    
+    def reindex(self, full=False):
+        """Updates search index with documents changed since last reindex
+        
+        See webui.indexsync.
+        
+        @param full: boolean Reindex every document in the collection
+        @returns: dict
+        """
+        return indexsync.reindex(
+            self,
+            docstores.manager(INDEX_PREFIX, settings.DOCSTORE_HOST),
+            self._reindex_full,
+            full=full
+        )
+    
+    def _reindex_full(self):
+        result = super(Collection, self).reindex()
+        querycache.invalidate()
+        return result
+    
+    def post_json(self, *args, **kwargs):
+        """Posts collection to search index and invalidates cached searches
+        """
+        result = super(Collection, self).post_json(*args, **kwargs)
+        ds = docstores.manager(INDEX_PREFIX, settings.DOCSTORE_HOST)
+        querycache.invalidate([ds.index_name('collection')])
+        return result
+    
     def save( self, git_name, git_mail, cleaned_data={}, commit=True ):
         """Save Collection metadata.
         
@@ -670,15 +779,12 @@ class Collection( DDRCollection ):
             self.selected_inheritables(cleaned_data),
             commit=commit
         )
+        # descendants may have inherited changes
+        documents.invalidate(self.identifier.path_abs('json'))
         
         self.cache_delete()
         if settings.DOCSTORE_ENABLED:
-            try:
-                docstore.DocstoreManager(
-                    INDEX_PREFIX, settings.DOCSTORE_HOST, settings
-                ).post(self)
-            except ConnectionError:
-                logger.error('Could not post to Elasticsearch.')
+            indexqueue.post(self)
         
         return exit,status,updated_files
     
@@ -732,7 +838,7 @@ class Entity( DDREntity ):
         @param identifier: [optional] Identifier
         @returns: Entity
         """
-        return from_json(Entity, path_abs, identifier)
+        return documents.load(Entity, path_abs, identifier, from_json)
     
     @staticmethod
     def from_identifier(identifier):
@@ -741,7 +847,9 @@ class Entity( DDREntity ):
         @param identifier: Identifier
         @returns: Entity
         """
-        return from_json(Entity, identifier.path_abs('json'), identifier)
+        return documents.load(
+            Entity, identifier.path_abs('json'), identifier, from_json
+        )
     
     @staticmethod
     def from_request(request):
@@ -781,14 +889,14 @@ class Entity( DDREntity ):
         return reverse('webui-file-batch', args=args)
     
     def file_browse_url(self, role):
-        idparts = self.identifier.idparts
+        idparts = self.identifier.idparts.copy()
         idparts['model'] = 'file-role'
         idparts['role'] = role
         ri = Identifier(idparts)
         return reverse('webui-file-browse', args=[ri.id])
     
     def file_external_url(self, role):
-        idparts = self.identifier.idparts
+        idparts = self.identifier.idparts.copy()
         idparts['model'] = 'file-role'
         idparts['role'] = role
         ri = Identifier(idparts)
@@ -873,10 +981,33 @@ class Entity( DDREntity ):
             os.path.dirname(self.json_path_rel)
         )
     
+    def lock( self, task_id ):
+        """Locks entity for task; see Collection.lock
+        
+        @param task_id: Unique identifier for task.
+        @returns: 'ok' or error message
+        """
+        return _lock_mirrored(
+            self, DDREntity, locks.lock_entity, locks.unlock_entity, task_id
+        )
+    
+    def unlock( self, task_id ):
+        """Removes entity lock and lockfile if they belong to task
+        
+        @param task_id: Unique identifier for task.
+        @returns: 'ok' or error message
+        """
+        return _unlock_mirrored(self, DDREntity, locks.unlock_entity, task_id)
+    
+    def locked( self ):
+        """Returns task_id of task holding entity lock or lockfile, or False
+        """
+        return locks.entity_locked(self.id) or DDREntity.locked(self)
+    
     def unlock_url(self):
-        """Generate unlock URL if a lockfile is present.
+        """Generate unlock URL if entity is locked.
         
-        See DDR.models.entity.Entity.locked.
+        See Entity.locked.
         """
         if self.locked():
             unlock_task_id = self.locked()
@@ -945,15 +1076,17 @@ class Entity( DDREntity ):
         # delete cache, update search index
         collection.cache_delete()
         if settings.DOCSTORE_ENABLED:
-            try:
-                docstore.DocstoreManager(
-                    INDEX_PREFIX, settings.DOCSTORE_HOST, settings
-                ).post(entity)
-            except ConnectionError:
-                logger.error('Could not post to Elasticsearch.')
+            indexqueue.post(entity)
         
         return exit,status
     
+    def write_json(self, *args, **kwargs):
+        """Writes JSON and drops object from webui.documents cache
+        """
+        result = super(Entity, self).write_json(*args, **kwargs)
+        documents.invalidate(self.identifier.path_abs('json'))
+        return result
+    
     def save( self, git_name, git_mail, agent=settings.AGENT, collection=None, cleaned_data={}, commit=True ):
         """Save Entity metadata
         
@@ -977,15 +1110,12 @@ class Entity( DDREntity ):
             inheritables=self.selected_inheritables(cleaned_data),
             commit=commit
         )
+        # descendants may have inherited changes
+        documents.invalidate(self.identifier.path_abs('json'))
         
         collection.cache_delete()
         if settings.DOCSTORE_ENABLED:
-            try:
-                docstore.DocstoreManager(
-                    INDEX_PREFIX, settings.DOCSTORE_HOST, settings
-                ).post(self)
-            except ConnectionError:
-                logger.error('Could not post to Elasticsearch.')
+            indexqueue.post(self)
         
         return exit,status,updated_files
     
@@ -1040,7 +1170,7 @@ class File( DDRFile ):
         @param inherit: boolean Whether to inherit values from ancestor(s)
         @returns: File
         """
-        return from_json(File, path_abs, identifier, inherit=inherit)
+        return documents.load(File, path_abs, identifier, from_json, inherit=inherit)
     
     @staticmethod
     def from_identifier(identifier, inherit=True):
@@ -1138,6 +1268,13 @@ class File( DDRFile ):
         """
         model_def_fields(self)
     
+    def write_json(self, *args, **kwargs):
+        """Writes JSON and drops object from webui.documents cache
+        """
+        result = super(File, self).write_json(*args, **kwargs)
+        documents.invalidate(self.identifier.path_abs('json'))
+        return result
+    
     def save( self, git_name, git_mail, agent=settings.AGENT, cleaned_data={}, commit=True ):
         """Save file metadata
         
@@ -1161,15 +1298,12 @@ class File( DDRFile ):
             inheritables=self.selected_inheritables(cleaned_data),
             commit=commit
         )
+        # descendants may have inherited changes
+        documents.invalidate(self.identifier.path_abs('json'))
         
         collection.cache_delete()
         if settings.DOCSTORE_ENABLED:
-            try:
-                docstore.DocstoreManager(
-                    INDEX_PREFIX, settings.DOCSTORE_HOST, settings
-                ).post(self)
-            except ConnectionError:
-                logger.error('Could not post to Elasticsearch.')
+            indexqueue.post(self)
         
         return exit,status,updated_files
 
@@ -1207,12 +1341,11 @@ def format_object_detail(document, request, listitem=False):
     """
     if document.get('_source'):
         oid = document['_id']
-        model = document['_index']
+        model = indexbuild.index_model(document['_index'], INDEX_PREFIX)
         document = document['_source']
     else:
         oid = document.pop('id')
-        model = document.pop('model')
-    model = model.replace(INDEX_PREFIX, '')
+        model = document.pop('model').replace(INDEX_PREFIX, '')
     
     d = OrderedDict()
     d['id'] = oid
@@ -0,0 +1,145 @@
+"""
+progress - Live progress of background tasks
+
+Long tasks report how far along they are with a Progress object:
+
+>>> from webui.progress import Progress
+>>> progress = Progress(self, total=len(rows), stage='Importing')
+>>> for n,row in enumerate(rows):
+...     import_row(row)
+...     progress.update(n+1)
+
+Each update sets the Celery task state to PROGRESS (with done, total,
+stage, and ETA in its meta) and publishes the same dict on a Redis
+pub/sub channel.  When any task finishes a final message with its state
+is published (see task_postrun below).  Updates are throttled to one per
+PROGRESS_INTERVAL seconds per task.
+
+webui.views.task_events streams these messages to the browser as
+server-sent events, so the notification area only reloads when a task
+actually finishes.
+"""
+
+import json
+import logging
+logger = logging.getLogger(__name__)
+import time
+
+from celery import states
+from celery.signals import task_postrun
+
+from webui import cache
+
+PROGRESS_CHANNEL = 'webui:tasks:progress'
+PROGRESS_KEY = 'webui:task:%s:progress'
+PROGRESS_STATE = 'PROGRESS'
+# seconds between updates
+PROGRESS_INTERVAL = 1.0
+# snapshots are kept in case a browser connects after the update was sent
+PROGRESS_TIMEOUT = 60 * 60 * 24
+
+
+def publish(data):
+    """Saves progress snapshot and publishes it to listeners
+
+    @param data: dict Must contain 'task_id'
+    """
+    r = cache.redis_connection()
+    text = json.dumps(data)
+    pipe = r.pipeline()
+    pipe.set(PROGRESS_KEY % data['task_id'], text, ex=PROGRESS_TIMEOUT)
+    pipe.publish(PROGRESS_CHANNEL, text)
+    pipe.execute()
+
+def snapshots(task_ids):
+    """Latest progress of tasks
+
+    @param task_ids: list
+    @returns: dict task_id: dict
+    """
+    if not task_ids:
+        return {}
+    values = cache.redis_connection().mget([PROGRESS_KEY % i for i in task_ids])
+    return {
+        task_id: json.loads(value)
+        for task_id,value in zip(task_ids, values)
+        if value
+    }
+
+
+class Progress():
+    """Reports progress of a bound Celery task
+    """
+
+    def __init__(self, task, total=None, stage=None):
+        """
+        @param task: celery.Task The bound task (self)
+        @param total: int Number of items to process, if known
+        @param stage: str Description of current step
+        """
+        self.task = task
+        self.task_id = task.request.id
+        self.total = total
+        self.stage = stage
+        self.done = 0
+        self.started = time.time()
+        self.sent = 0
+
+    def data(self):
+        elapsed = time.time() - self.started
+        eta = None
+        percent = None
+        if self.total:
+            percent = int(100 * self.done / self.total)
+            if self.done:
+                eta = int(elapsed / self.done * (self.total - self.done))
+        return {
+            'task_id': self.task_id,
+            'state': PROGRESS_STATE,
+            'stage': self.stage,
+            'done': self.done,
+            'total': self.total,
+            'percent': percent,
+            'elapsed': int(elapsed),
+            'eta': eta,
+        }
+
+    def update(self, done=None, total=None, stage=None, force=False):
+        """Records progress; sends it if PROGRESS_INTERVAL has passed
+
+        @param done: int Number of items processed so far
+        @param total: int
+        @param stage: str Starting a new stage always sends an update
+        @param force: boolean Send regardless of interval
+        """
+        if stage is not None and stage != self.stage:
+            self.stage = stage
+            self.done = 0
+            force = True
+        if total is not None:
+            self.total = total
+        if done is not None:
+            self.done = done
+        now = time.time()
+        if not self.task_id or not (force or (now - self.sent >= PROGRESS_INTERVAL)):
+            return
+        self.sent = now
+        data = self.data()
+        self.task.update_state(state=PROGRESS_STATE, meta=data)
+        try:
+            publish(data)
+        except Exception as err:
+            # progress is nice to have, never fail the task over it
+            logger.error('Could not publish progress: %s' % err)
+
+
+@task_postrun.connect
+def task_postrun_publish(sender=None, task_id=None, state=None, **kwargs):
+    """Tells listeners that a task has finished
+    """
+    if state not in states.READY_STATES:
+        return
+    try:
+        publish({'task_id': task_id, 'state': state})
+    except Exception as err:
+        logger.error('Could not publish task state: %s' % err)
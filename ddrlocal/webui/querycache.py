@@ -0,0 +1,165 @@
+"""
+querycache - Cache of Elasticsearch search responses
+
+webui.views.search.search_ui and api.Search.grep ran the same query,
+aggregations and all, every time someone paged back, toggled list and
+gallery views, or reloaded.
+
+After Searcher.prepare the views call enable(searcher), which swaps the
+searcher's elasticsearch_dsl.Search for a CachedSearch.  Its execute()
+looks for the response in the cache under a hash of the index names and
+the query body (built from SEARCH_PARAM_WHITELIST params only, so
+equivalent requests get the same key), and stores the response as
+compressed JSON on a miss.
+
+Each index has a generation counter in Redis that is part of the key.
+Anything that writes to an index calls invalidate(), which bumps the
+counters, so entries made before the write are never read again (they
+expire after QUERY_CACHE_TIMEOUT).  Elasticsearch only makes writes
+visible at the next refresh, so for SETTLE seconds after an invalidate
+responses are not stored.
+
+stats() reports hits, misses, and the Elasticsearch "took" time spent on
+misses and saved by hits (see webui.views.querycache_stats).
+
+>>> from webui import querycache
+>>> querycache.enable(searcher)
+>>> results = searcher.execute(limit, offset)
+>>> querycache.invalidate(['ddrentity'])
+>>> querycache.stats()
+{'hits': 120, 'misses': 40, 'hit_rate': 0.75, 'took_ms': 5200, 'saved_ms': 15900, ...}
+"""
+
+import hashlib
+import json
+import logging
+logger = logging.getLogger(__name__)
+import zlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+from elastictools.docstore import elasticsearch_dsl
+
+from webui.cache import redis_connection
+
+ENTRY_KEY = 'webui:querycache:%s'
+GENERATION_KEY = 'webui:querycache:gen:%s'
+SETTLE_KEY = 'webui:querycache:settle:%s'
+STATS_KEY = 'webui:querycache:stats'
+# bumped when all indexes change
+ALL = '*'
+# seconds after a write before results may be cached (refresh_interval is 1s)
+SETTLE = 2
+
+
+def _names(indexes):
+    return [ALL] + sorted(indexes or [])
+
+def key(index, body, generations):
+    """
+    @param index: list of index names
+    @param body: dict Query body
+    @param generations: list of generation numbers (str or None)
+    @returns: str
+    """
+    text = json.dumps(
+        {'index': sorted(index or []), 'body': body, 'gen': generations},
+        sort_keys=True
+    )
+    return ENTRY_KEY % hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def invalidate(indexes=None):
+    """Makes cached results for indexes (default: all) unreachable
+
+    @param indexes: list of index names
+    """
+    names = [ALL] if indexes is None else list(indexes)
+    if not names:
+        return
+    try:
+        pipe = redis_connection().pipeline()
+        for name in names:
+            pipe.incr(GENERATION_KEY % name)
+            pipe.set(SETTLE_KEY % name, 1, ex=SETTLE)
+        pipe.execute()
+    except Exception as err:
+        logger.error('querycache.invalidate %s: %s' % (names, err))
+
+def _count(**fields):
+    try:
+        pipe = redis_connection().pipeline()
+        for field,n in fields.items():
+            pipe.hincrby(STATS_KEY, field, n)
+        pipe.execute()
+    except Exception as err:
+        logger.error('querycache stats: %s' % err)
+
+def stats():
+    """Cache hits/misses and Elasticsearch time spent and saved
+
+    @returns: dict
+    """
+    data = {
+        field: int(n)
+        for field,n in redis_connection().hgetall(STATS_KEY).items()
+    }
+    for field in ['hits', 'misses', 'uncached', 'took_ms', 'saved_ms']:
+        data.setdefault(field, 0)
+    lookups = data['hits'] + data['misses']
+    data['hit_rate'] = round(data['hits'] / lookups, 3) if lookups else None
+    return data
+
+def reset_stats():
+    redis_connection().delete(STATS_KEY)
+
+
+class CachedSearch(elasticsearch_dsl.Search):
+    """Search whose execute() reads and writes the query cache
+
+    Slicing, filtering, etc return CachedSearches too.
+    """
+
+    def execute(self, ignore_cache=False):
+        if ignore_cache:
+            return super(CachedSearch, self).execute(ignore_cache)
+        names = _names(self._index)
+        try:
+            r = redis_connection()
+            generations = r.mget([GENERATION_KEY % name for name in names])
+            settling = any(r.mget([SETTLE_KEY % name for name in names]))
+        except Exception as err:
+            logger.error('querycache: %s' % err)
+            return super(CachedSearch, self).execute(ignore_cache)
+        k = key(self._index, self.to_dict(), generations)
+        compressed = cache.get(k)
+        if compressed is not None:
+            data = json.loads(zlib.decompress(compressed).decode('utf-8'))
+            self._response = self._response_class(self, data)
+            _count(hits=1, saved_ms=data.get('took', 0))
+            return self._response
+        response = super(CachedSearch, self).execute(ignore_cache)
+        data = response.to_dict()
+        if settling:
+            _count(uncached=1, took_ms=data.get('took', 0))
+        else:
+            cache.set(
+                k, zlib.compress(json.dumps(data).encode('utf-8')),
+                settings.QUERY_CACHE_TIMEOUT
+            )
+            _count(misses=1, took_ms=data.get('took', 0))
+        return response
+
+
+def enable(searcher):
+    """Makes an elastictools Searcher use the query cache
+
+    Call after Searcher.prepare.
+
+    @param searcher: elastictools.search.Searcher
+    """
+    if not settings.QUERY_CACHE_TIMEOUT:
+        return
+    s = searcher.s._clone()
+    s.__class__ = CachedSearch
+    searcher.s = s
@@ -0,0 +1,319 @@
+"""
+remotes - Compare local collection refs with the Gitolite server
+
+Collection.repo_fetch runs a network git-fetch for one collection and
+used to be called on every edit page load.  This module instead lists the
+branch heads on the server for all collections in one pass (git ls-remote)
+reusing a single multiplexed SSH connection, and compares them with the
+local refs without fetching anything.
+
+Results are written to STORE/tmp/gitstatus-remotes.db next to the
+gitstatus files.  Edit views read them with read() (see
+webui.models.Collection.remote_behind); a row saying the collection is
+behind no longer counts once the server's commit is in the local branch
+(stored_behind), and the sync task refreshes its collection's row when
+it finishes (refresh).  Missing or stale rows fall back to git fetch.
+
+State of each collection:
+- synced:   local and remote branch point to the same commit
+- ahead:    remote commit is an ancestor of local
+- behind:   remote has commits that local does not
+- diverged: both sides have commits the other does not
+- unknown:  branch or remote missing, or ls-remote failed
+
+>>> from webui import remotes
+>>> results = remotes.check(['/var/www/media/ddr/ddr-test-123'], 'origin')
+>>> remotes.write(settings.MEDIA_BASE, results)
+>>> remotes.read(settings.MEDIA_BASE, 'ddr-test-123')['state']
+'behind'
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import logging
+logger = logging.getLogger(__name__)
+import os
+import sqlite3
+import subprocess
+
+from django.conf import settings
+
+from DDR import converters
+
+# ssh -o ControlPath: one master connection per user/host/port
+SSH_CONTROL_PATH = '/tmp/ddrlocal-ssh-%r@%h:%p'
+# Seconds master connection stays open after last ls-remote
+SSH_CONTROL_PERSIST = 60
+
+REMOTES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS remotes (
+    collection_id TEXT PRIMARY KEY,
+    state TEXT,
+    branch TEXT,
+    local TEXT,
+    remote TEXT,
+    error TEXT,
+    timestamp TEXT
+);
+"""
+REMOTES_TIMEOUT = 30
+
+
+def db_path(base_dir):
+    """
+    - STORE/tmp/gitstatus-remotes.db
+    """
+    return os.path.join(base_dir, 'tmp', 'gitstatus-remotes.db')
+
+def ssh_command(control_path=SSH_CONTROL_PATH, persist=SSH_CONTROL_PERSIST):
+    """GIT_SSH_COMMAND that shares one SSH connection between git processes
+    """
+    return ' '.join([
+        'ssh',
+        '-o BatchMode=yes',
+        '-o ControlMaster=auto',
+        '-o ControlPath=%s' % control_path,
+        '-o ControlPersist=%s' % persist,
+    ])
+
+def _git(collection_path, args, env=None, timeout=None):
+    return subprocess.run(
+        ['git', '-C', collection_path] + args,
+        capture_output=True, text=True, env=env, timeout=timeout
+    )
+
+def remote_url(collection_path, remote_name):
+    """URL of remote as configured in the collection repo
+
+    @param collection_path: str Absolute path to collection repo
+    @param remote_name: str
+    @returns: str or None
+    """
+    result = _git(collection_path, ['config', '--get', 'remote.%s.url' % remote_name])
+    return result.stdout.strip() or None
+
+def _parse_refs(text):
+    """Parses output of git ls-remote/for-each-ref ("{sha} {ref}" lines)
+
+    @returns: dict {ref: sha}
+    """
+    refs = {}
+    for line in text.strip().splitlines():
+        sha,ref = line.split()
+        refs[ref] = sha
+    return refs
+
+def ls_remote(collection_path, url, env=None, timeout=None):
+    """Branch heads on remote, without fetching
+
+    @returns: dict {ref: sha}
+    """
+    result = _git(collection_path, ['ls-remote', '--heads', url], env=env, timeout=timeout)
+    if result.returncode:
+        raise Exception(result.stderr.strip())
+    return _parse_refs(result.stdout)
+
+def local_refs(collection_path):
+    """Branch heads in local repo
+
+    @returns: dict {ref: sha}
+    """
+    result = _git(collection_path, [
+        'for-each-ref', '--format=%(objectname) %(refname)', 'refs/heads/'
+    ])
+    return _parse_refs(result.stdout)
+
+def _has_commit(collection_path, sha):
+    return _git(collection_path, ['cat-file', '-e', '%s^{commit}' % sha]).returncode == 0
+
+def _is_ancestor(collection_path, ancestor, descendant):
+    return _git(collection_path, [
+        'merge-base', '--is-ancestor', ancestor, descendant
+    ]).returncode == 0
+
+def compare(collection_path, local, remote):
+    """Compares local and remote commits of a branch
+
+    Runs only local git commands.
+
+    @param collection_path: str Absolute path to collection repo
+    @param local: str sha or None
+    @param remote: str sha or None
+    @returns: str synced, ahead, behind, diverged, unknown
+    """
+    if not (local and remote):
+        return 'unknown'
+    if local == remote:
+        return 'synced'
+    if not _has_commit(collection_path, remote):
+        return 'behind'
+    if _is_ancestor(collection_path, remote, local):
+        return 'ahead'
+    if _is_ancestor(collection_path, local, remote):
+        return 'behind'
+    return 'diverged'
+
+def check_repo(collection_path, remote_name, branch='master', env=None, timeout=None):
+    """Compares one collection's branch with its remote
+
+    @param collection_path: str Absolute path to collection repo
+    @param remote_name: str
+    @param branch: str
+    @param env: dict Environment for git (see ssh_command)
+    @param timeout: int (seconds)
+    @returns: dict
+    """
+    ref = 'refs/heads/%s' % branch
+    data = {
+        'collection_id': os.path.basename(collection_path),
+        'state': 'unknown',
+        'branch': branch,
+        'local': None,
+        'remote': None,
+        'error': None,
+        'timestamp': datetime.now(settings.TZ),
+    }
+    try:
+        url = remote_url(collection_path, remote_name)
+        if not url:
+            raise Exception('no remote "%s"' % remote_name)
+        data['remote'] = ls_remote(collection_path, url, env, timeout).get(ref)
+        data['local'] = local_refs(collection_path).get(ref)
+        data['state'] = compare(collection_path, data['local'], data['remote'])
+    except Exception as err:
+        logger.error('%s %s' % (collection_path, err))
+        data['error'] = str(err)
+    return data
+
+def check(collection_paths, remote_name, branch='master', workers=4, timeout=30):
+    """Compares branch of each collection with the server in one pass
+
+    The first ls-remote runs alone so it becomes the SSH ControlMaster;
+    the rest run ${workers} at a time over the same connection.
+
+    @param collection_paths: list of absolute paths to collection repos
+    @param remote_name: str
+    @param branch: str
+    @param workers: int
+    @param timeout: int (seconds) Per ls-remote
+    @returns: list of dicts (see check_repo)
+    """
+    if not collection_paths:
+        return []
+    env = dict(os.environ, GIT_SSH_COMMAND=ssh_command())
+    check_one = lambda path: check_repo(path, remote_name, branch, env, timeout)
+    results = [check_one(collection_paths[0])]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        results += list(pool.map(check_one, collection_paths[1:]))
+    return results
+
+def _connect(base_dir):
+    connection = sqlite3.connect(
+        db_path(base_dir), timeout=REMOTES_TIMEOUT, isolation_level=None
+    )
+    connection.executescript(REMOTES_SCHEMA)
+    return connection
+
+def write(base_dir, results):
+    """Stores output of check()
+
+    @param base_dir: Absolute path to Store dir
+    @param results: list of dicts
+    """
+    connection = _connect(base_dir)
+    try:
+        connection.execute('BEGIN IMMEDIATE')
+        connection.executemany(
+            'INSERT OR REPLACE INTO remotes'
+            ' (collection_id, state, branch, local, remote, error, timestamp)'
+            ' VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [
+                (
+                    r['collection_id'], r['state'], r['branch'],
+                    r['local'], r['remote'], r['error'],
+                    converters.datetime_to_text(r['timestamp']),
+                )
+                for r in results
+            ]
+        )
+        connection.execute('COMMIT')
+    except:
+        connection.execute('ROLLBACK')
+        raise
+    finally:
+        connection.close()
+
+def read(base_dir, collection_id):
+    """Last stored comparison for collection
+
+    @param base_dir: Absolute path to Store dir
+    @param collection_id: str
+    @returns: dict or None
+    """
+    if not os.path.exists(db_path(base_dir)):
+        return None
+    connection = _connect(base_dir)
+    try:
+        row = connection.execute(
+            'SELECT collection_id, state, branch, local, remote, error, timestamp'
+            ' FROM remotes WHERE collection_id=?', (collection_id,)
+        ).fetchone()
+    finally:
+        connection.close()
+    if not row:
+        return None
+    data = dict(zip(
+        ['collection_id', 'state', 'branch', 'local', 'remote', 'error', 'timestamp'],
+        row
+    ))
+    data['timestamp'] = converters.text_to_datetime(data['timestamp'])
+    return data
+
+def _age(timestamp):
+    """Seconds since timestamp (aware or naive)
+    """
+    if timestamp.tzinfo is None:
+        return (datetime.now() - timestamp).total_seconds()
+    return (datetime.now(timestamp.tzinfo) - timestamp).total_seconds()
+
+def stored_behind(collection_path, data, max_age):
+    """Whether stored comparison says collection is behind the server
+
+    A row that says behind/diverged is overridden if the stored remote
+    commit is now in the local branch, i.e. the collection was synced
+    after the row was written.
+
+    @param collection_path: str Absolute path to collection repo
+    @param data: dict from read() or None
+    @param max_age: int (seconds) Older rows are not trusted
+    @returns: True, False, or None if the row cannot answer (missing,
+        stale, or failed check); caller should fetch
+    """
+    if (not data) or data['error'] or (data['state'] == 'unknown'):
+        return None
+    if (not data['timestamp']) or (_age(data['timestamp']) > max_age):
+        return None
+    if data['state'] not in ['behind', 'diverged']:
+        return False
+    local = local_refs(collection_path).get('refs/heads/%s' % data['branch'])
+    remote = data['remote']
+    if local and remote and (
+        (local == remote)
+        or (_has_commit(collection_path, remote)
+            and _is_ancestor(collection_path, remote, local))
+    ):
+        return False
+    return True
+
+def refresh(base_dir, collection_path, remote_name, branch='master'):
+    """Checks one collection now and stores the result, e.g. after sync
+
+    @param base_dir: Absolute path to Store dir
+    @param collection_path: str Absolute path to collection repo
+    @param remote_name: str
+    @param branch: str
+    @returns: dict (see check_repo)
+    """
+    results = check([collection_path], remote_name, branch, workers=1)
+    write(base_dir, results)
+    return results[0]
@@ -0,0 +1,4 @@
+# connects the task_postrun handler that announces finished tasks
+from webui import progress
+# connects the handlers that keep running tasks' locks from expiring
+from webui import locks
@@ -18,11 +18,14 @@ from DDR import signatures
 from DDR import util
 
 from elastictools import search
-from elastictools.docstore import DocstoreManager
 from elastictools.docstore import ConnectionError, RequestError, TransportError
 from webui import batch
 from webui import csvio
+from webui import docstores
+from webui import documents
 from webui import gitstatus
+from webui import remotes
+from webui.progress import Progress
 from webui.models import Collection, INDEX_PREFIX
 from webui.identifier import Identifier
 from webui.tasks import dvcs as dvcs_tasks
@@ -122,7 +125,7 @@ class CollectionNewTask(Task):
         collection_id = retval['collection_id']
         collection = Collection.from_identifier(Identifier(id=collection_id))
         lockstatus = collection.unlock(task_id)
-        gitstatus.update(settings.MEDIA_BASE, collection.path)
+        dvcs_tasks.gitstatus_request(collection.path)
         # locking uses common name
         gitstatus.unlock(settings.MEDIA_BASE, TASK_COLLECTION_NEW_NAME)
 
@@ -157,11 +160,6 @@ def collection_new_manual(collection_path, git_name, git_mail):
         collection.post_json()
     except ConnectionError:
         logger.error('Could not post to Elasticsearch.')
-    # do whatever this is
-    dvcs_tasks.gitstatus_update.apply_async(
-        (collection_path,),
-        countdown=2
-    )
     return status,collection_path
 
 @shared_task(base=CollectionNewTask, name=TASK_COLLECTION_NEW_IDSERVICE_NAME)
@@ -217,11 +215,6 @@ def collection_new_idservice(organization_id, idservice_token, git_name, git_mai
         collection.post_json()
     except ConnectionError:
         logger.error('Could not post to Elasticsearch.')
-    # do whatever this is
-    dvcs_tasks.gitstatus_update.apply_async(
-        (collection.path,),
-        countdown=2
-    )
     return {
         'status':status,
         'collection_id': collection.id,
@@ -262,7 +255,7 @@ class CollectionEditTask(Task):
         collection_path = args[0]
         collection = Collection.from_identifier(Identifier(path=collection_path))
         lockstatus = collection.unlock(task_id)
-        gitstatus.update(settings.MEDIA_BASE, collection.path)
+        dvcs_tasks.gitstatus_request(collection.path)
         gitstatus.unlock(settings.MEDIA_BASE, 'collection_edit')
 
 @shared_task(base=CollectionEditTask, name='collection-edit')
@@ -291,11 +284,6 @@ def save(collection_path, cleaned_data, git_name, git_mail):
         logger.error("RequestError: {0}".format(err))
         exit = 1; status = {'error': err}
     
-    dvcs_tasks.gitstatus_update.apply_async(
-        (collection_path,),
-        countdown=2
-    )
-    
     return status,collection_path
 
 
@@ -317,7 +305,14 @@ class CollectionSyncDebugTask(Task):
         #       starts in webui.views.collections.sync
         collection.unlock(task_id)
         collection.cache_delete()
-        gitstatus.update(settings.MEDIA_BASE, collection_path)
+        dvcs_tasks.gitstatus_request(collection_path)
+        # edit views read remotes.db; don't leave it saying "behind"
+        try:
+            remotes.refresh(
+                settings.MEDIA_BASE, collection_path, settings.GIT_REMOTE_NAME
+            )
+        except Exception as err:
+            logger.error('remotes.refresh %s: %s' % (collection_path, err))
         gitstatus.unlock(settings.MEDIA_BASE, 'collection_sync')
 
 @shared_task(base=CollectionSyncDebugTask, name='collection-sync')
@@ -338,6 +333,8 @@ def sync( git_name, git_mail, collection_path ):
         git_name, git_mail,
         collection
     )
+    # pulled files may keep their size and (coarse) mtime
+    documents.invalidate(collection_path)
     logger.debug('Updating Elasticsearch')
     if settings.DOCSTORE_ENABLED:
         try:
@@ -366,11 +363,11 @@ class CollectionSignaturesDebugTask(Task):
         #       starts in webui.views.collections.signatures
         collection.unlock(task_id)
         collection.cache_delete()
-        gitstatus.update(settings.MEDIA_BASE, collection_path)
+        dvcs_tasks.gitstatus_request(collection_path)
         gitstatus.unlock(settings.MEDIA_BASE, 'collection_signatures')
 
-@shared_task(base=CollectionSignaturesDebugTask, name='collection-signatures')
-def signatures(collection_path, git_name, git_mail):
+@shared_task(base=CollectionSignaturesDebugTask, name='collection-signatures', bind=True)
+def signatures(self, collection_path, git_name, git_mail):
     """Identifies signature files for collection and entities.
     
     @param collection_path: Absolute path to collection repo.
@@ -379,11 +376,15 @@ def signatures(collection_path, git_name, git_mail):
     @return collection_path: Absolute path to collection.
     """
     gitstatus.lock(settings.MEDIA_BASE, 'collection_signatures')
+    progress = Progress(self, total=4)
+    progress.update(0, stage='Finding signatures')
     collection = Collection.from_identifier(Identifier(path=collection_path))
     updates = signatures.find_updates(collection)
+    progress.update(1, stage='Writing %s signatures' % len(updates))
     files_written = signatures.write_updates(updates)
 
     # TODO move this code to webui.models.Collection
+    progress.update(2, stage='Committing %s files' % len(files_written))
     status,msg = signatures.commit_updates(
         collection,
         files_written,
@@ -392,6 +393,7 @@ def signatures(collection_path, git_name, git_mail):
     logger.debug('DONE')
     logger.debug('Updating Elasticsearch')
     if settings.DOCSTORE_ENABLED:
+        progress.update(3, stage='Indexing')
         collection = Collection.from_identifier(Identifier(path=collection_path))
         try:
             collection.post_json()
@@ -507,11 +509,11 @@ class CSVImportTask(Task):
         log = util.FileLogger(log_path=log_path)
         collection = Collection.from_identifier(Identifier(path=collection_path))
         lockstatus = collection.unlock(task_id)
-        gitstatus.update(settings.MEDIA_BASE, collection.path)
+        dvcs_tasks.gitstatus_request(collection.path)
         gitstatus.unlock(settings.MEDIA_BASE, 'csv_import')
 
-@shared_task(base=CSVImportTask, name='webui-csv-import-model')
-def csv_import_model(collection_path, model, csv_path, git_name, git_mail):
+@shared_task(base=CSVImportTask, name='webui-csv-import-model', bind=True)
+def csv_import_model(self, collection_path, model, csv_path, git_name, git_mail):
     """Import collection {model} metadata to CSV file.
     
     @return collection_path: Absolute path to collection.
@@ -526,6 +528,8 @@ def csv_import_model(collection_path, model, csv_path, git_name, git_mail):
     log.info(f'========================================================================')
     ci = Identifier(path=collection_path)
     collection = Collection.from_identifier(ci)
+    progress = Progress(self, total=5)
+    progress.update(0, stage='Checking CSV')
     
     rowds,errors = batch.load_csv_run_checks(collection, model, csv_path)
     if errors:
@@ -534,6 +538,7 @@ def csv_import_model(collection_path, model, csv_path, git_name, git_mail):
             'Please see import log.'
         )
     gitstatus.lock(settings.MEDIA_BASE, 'csv_import')
+    progress.update(1, stage='Importing %s rows' % len(rowds))
     imported = batch.Importer.import_files(
         csv_path=csv_path,
         rowds=rowds,
@@ -544,18 +549,21 @@ def csv_import_model(collection_path, model, csv_path, git_name, git_mail):
         agent='ddr-local',
         log_path=log_path,
     )
+    progress.update(2, stage='Committing')
     commit = dvcs.commit(
         repo=dvcs.repository(collection_path, git_name, git_mail),
         msg=f'Batch file import\n\nCSV: {csv_path}',
         agent='ddr-local',
         log=log,
     )
+    progress.update(3, stage='Updating signatures')
     status,msg = batch.csv_update_signatures(
         collection, rowds, git_name, git_mail, agent='ddr-local', log=log
     )
 
     logger.debug('Updating Elasticsearch')
     if settings.DOCSTORE_ENABLED:
+        progress.update(4, stage='Indexing')
         try:
             collection.reindex()
         except ConnectionError:
@@ -567,11 +575,11 @@ def csv_import_model(collection_path, model, csv_path, git_name, git_mail):
 
 TASK_COLLECTION_REINDEX = 'collection-reindex'
 
-def reindex(request, collection):
+def reindex(request, collection, full=False):
     # start tasks
     collection_path = collection.path
     result = collection_reindex.apply_async(
-        (collection_path,),
+        (collection_path, full),
         countdown=2
     )
     # add celery task_id to session
@@ -597,11 +605,15 @@ class ReindexDebugTask(Task):
     def after_return(self, status, retval, task_id, args, kwargs, cinfo):
         pass
 
-@shared_task(base=ReindexDebugTask, name=TASK_COLLECTION_REINDEX)
-def collection_reindex(collection_path):
+@shared_task(base=ReindexDebugTask, name=TASK_COLLECTION_REINDEX, bind=True)
+def collection_reindex(self, collection_path, full=False):
     """Reindexes collection
     
+    Only documents changed since the last reindex are sent unless full
+    (see webui.indexsync).
+    
     @param collection_path: Absolute path to collection repo.
+    @param full: boolean Reindex every document.
     @return collection_path: Absolute path to collection.
     """
     logger.debug('tasks.collection.reindex({})'.format(collection_path))
@@ -609,14 +621,13 @@ def collection_reindex(collection_path):
     if settings.DOCSTORE_ENABLED:
         # nice UI if Elasticsearch is down
         try:
-            DocstoreManager(
-                INDEX_PREFIX, settings.DOCSTORE_HOST, settings
-            ).status()
+            docstores.manager(INDEX_PREFIX, settings.DOCSTORE_HOST).status()
         except TransportError:
             raise Exception(
                 "<b>TransportError</b>: Cannot connect to search engine."
             )
-        collection.reindex()
+        Progress(self).update(stage='Indexing %s' % collection.id)
+        collection.reindex(full=full)
     else:
         raise Exception('Search engine disabled (DOCSTORE_ENABLED=False)')
     return collection_path
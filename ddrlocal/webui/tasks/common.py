@@ -1,21 +1,37 @@
 from celery.utils.log import get_task_logger
 logger = get_task_logger(__name__)
 
+from datetime import datetime, timedelta
+
+from celery import current_app
 from celery import shared_task
 from celery import states
-from celery.result import AsyncResult
+from celery.backends.redis import RedisBackend
 from celery.utils import get_full_cls_name
 from kombu.utils.encoding import safe_repr
 
 from django.conf import settings
+from django.core.cache import cache
 from django.urls import reverse
 
+from DDR import converters
+
 from webui import identifier
+from webui import progress
 
 
-TASK_STATUSES = ['STARTED', 'PENDING', 'SUCCESS', 'FAILURE', 'RETRY', 'REVOKED',]
+TASK_STATUSES = ['STARTED', 'PENDING', 'PROGRESS', 'SUCCESS', 'FAILURE', 'RETRY', 'REVOKED',]
 TASK_STATUSES_DISMISSABLE = ['STARTED', 'SUCCESS', 'FAILURE', 'RETRY', 'REVOKED',]
 
+# Final states of finished tasks are cached so Celery is not asked again.
+TASK_STATE_CACHE_KEY = 'webui:task:%s:state'
+TASK_STATE_TIMEOUT = 60 * 60 * 24 * 30
+# Finished tasks are dropped from a user's session if there are more than
+# SESSION_TASKS_MAX of them or they are older than SESSION_TASKS_EXPIRE.
+# Unfinished tasks are never dropped.
+SESSION_TASKS_MAX = 50
+SESSION_TASKS_EXPIRE = timedelta(days=7)
+
 # Background task status messages.
 # IMPORTANT: These are templates.  Arguments (words in {parentheses}) MUST match keys in the task dict. 
 # See "Accessing arguments by name" section on http://docs.python.org/2.7/library/string.html#format-examples
@@ -102,6 +118,15 @@ TASK_STATUS_MESSAGES = {
         #'REVOKED': '',
     },
 
+    'search-reindex': {
+        #'STARTED': '',
+        'PENDING': 'Rebuilding search indexes.',
+        'SUCCESS': 'Rebuilt search indexes.',
+        'FAILURE': 'Rebuilding search indexes failed! Run it again to resume.',
+        #'RETRY': '',
+        #'REVOKED': '',
+    },
+
     'entity-edit': {
         #'STARTED': '',
         'PENDING': 'Saving changes to object <b><a href="{entity_url}">{entity_id}</a></b>...',
@@ -181,6 +206,92 @@ TASK_STATUS_MESSAGES = {
 }
 
 
+def _state(task_id, meta):
+    """Task status dict from Celery result-backend metadata
+    """
+    state = meta.get('status', states.PENDING)
+    retval = meta.get('result')
+    data = {'id': task_id, 'status': state, 'result': retval}
+    if state in states.EXCEPTION_STATES:
+        data.update({'result': safe_repr(retval),
+                     'exc': get_full_cls_name(retval.__class__),
+                     'traceback': meta.get('traceback')})
+    return data
+
+def task_states(task_ids):
+    """Gets statuses of many tasks at once
+    
+    Final (SUCCESS, FAILURE, REVOKED) states come from the cache.  The
+    rest are read from the Celery result backend, with a single MGET if
+    it is Redis, and any that have finished are added to the cache.
+    
+    @param task_ids: list
+    @returns: dict task_id: {'id', 'status', 'result'[, 'exc', 'traceback']}
+    """
+    cached = cache.get_many([TASK_STATE_CACHE_KEY % task_id for task_id in task_ids])
+    data = {}
+    missing = []
+    for task_id in task_ids:
+        state = cached.get(TASK_STATE_CACHE_KEY % task_id)
+        if state:
+            data[task_id] = state
+        else:
+            missing.append(task_id)
+    if not missing:
+        return data
+    backend = current_app.backend
+    if isinstance(backend, RedisBackend):
+        values = backend.client.mget([
+            backend.get_key_for_task(task_id) for task_id in missing
+        ])
+        metas = [backend.decode_result(value) if value else {} for value in values]
+    else:
+        metas = [backend.get_task_meta(task_id) for task_id in missing]
+    finished = {}
+    for task_id,meta in zip(missing, metas):
+        data[task_id] = _state(task_id, meta)
+        if data[task_id]['status'] in states.READY_STATES:
+            finished[TASK_STATE_CACHE_KEY % task_id] = data[task_id]
+    if finished:
+        cache.set_many(finished, TASK_STATE_TIMEOUT)
+    return data
+
+def _task_start(task):
+    """Task start time; older sessions have naive local times
+    """
+    start = converters.text_to_datetime(task['start'])
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=settings.TZ)
+    return start
+
+def _trim_session_tasks(request, tasks, states_):
+    """Drops old finished tasks from session
+    
+    @returns: dict tasks that were kept
+    """
+    cutoff = datetime.now(settings.TZ) - SESSION_TASKS_EXPIRE
+    finished = sorted(
+        [
+            task for task_id,task in tasks.items()
+            if states_.get(task_id, {}).get('status') in states.READY_STATES
+        ],
+        key=_task_start,
+        reverse=True
+    )
+    drop = [
+        task['task_id'] for n,task in enumerate(finished)
+        if (n >= SESSION_TASKS_MAX)
+        or (_task_start(task) < cutoff)
+    ]
+    if not drop:
+        return tasks
+    kept = {
+        task_id: task for task_id,task in tasks.items() if task_id not in drop
+    }
+    request.session[settings.CELERY_TASKS_SESSION_KEY] = kept
+    cache.delete_many([TASK_STATE_CACHE_KEY % task_id for task_id in drop])
+    return {task_id: dict(task) for task_id,task in kept.items()}
+
 def session_tasks( request ):
     """Gets task statuses from Celery API, appends to task dicts from session.
     
@@ -193,6 +304,11 @@ def session_tasks( request ):
     # basic tasks info from session:
     # task_id, action ('name' argument of @shared_task), start time, args
     tasks = request.session.get(settings.CELERY_TASKS_SESSION_KEY, {})
+    if not tasks:
+        return {}
+    # get status, retval for all tasks at once
+    states_ = task_states(list(tasks.keys()))
+    tasks = _trim_session_tasks(request, tasks, states_)
     # add entity URLs
     for task_id in list(tasks.keys()):
         task = tasks.get(task_id, None)
@@ -201,28 +317,17 @@ def session_tasks( request ):
                                        'webui-file-new-access']:
                 # Add entity_url to task for newly-created file
                 task['entity_url'] = reverse('webui-entity', args=[task['entity_id']])
-    # Hit the celery-task_status view for status updates on each task.
-    # get status, retval from celery
-    # TODO Don't create a new ctask/task dict here!!! >:-O
-    traceback = None
     for task_id in list(tasks.keys()):
-        # Skip the HTTP and get directly from Celery API
-        # djcelery.views.task_status
-        result = AsyncResult(task_id)
-        state, retval = result.state, result.result
-        response_data = {'id': task_id, 'status': state, 'result': retval}
-        if state in states.EXCEPTION_STATES:
-            traceback = result.traceback
-            response_data.update({'result': safe_repr(retval),
-                                  'exc': get_full_cls_name(retval.__class__),
-                                  'traceback': traceback})
-        # end djcelery.views.task_status
-        task = response_data
+        task = states_[task_id]
         # construct collection/entity/file urls if possible
         if task:
             ctask = tasks[task['id']]
             ctask['status'] = task.get('status', None)
             ctask['result'] = task.get('result', None)
+            if task.get('traceback'):
+                ctask['traceback'] = task['traceback']
+            if ctask['status'] == progress.PROGRESS_STATE:
+                ctask['progress'] = ctask['result']
             # try to convert 'result' into a collection/entity/file URL
             if (ctask['status'] != 'FAILURE') and ctask['result']:
                 r = ctask['result']
@@ -242,6 +347,8 @@ def session_tasks( request ):
         template = None
         if messages and status:
             template = messages.get(status, None)
+            if (not template) and (status == progress.PROGRESS_STATE):
+                template = messages.get('PENDING', None)
         if template:
             msg = template.format(**task)
             task['message'] = msg
@@ -250,9 +357,6 @@ def session_tasks( request ):
         task = tasks[task_id]
         if task.get('status', None):
             task['dismissable'] = (task['status'] in TASK_STATUSES_DISMISSABLE)
-    # include traceback in task if present
-    if traceback:
-        task['traceback'] = traceback
     # done
     return tasks
 
@@ -282,3 +386,4 @@ def dismiss_session_task( request, task_id ):
                 task.pop('startd')
             newtasks[tid] = task
     request.session[settings.CELERY_TASKS_SESSION_KEY] = newtasks
+    cache.delete(TASK_STATE_CACHE_KEY % task_id)
@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 import os
 
@@ -9,7 +10,19 @@ logger = get_task_logger(__name__)
 from django.conf import settings
 
 from DDR import converters
-from DDR import models
+
+from elasticsearch import helpers
+from elastictools.docstore import ConnectionError, TransportError
+from ddrlocal.models import DDRLocalCollection as Collection
+from webui import docstores
+from webui import gitolite
+from webui import gitstatus
+from webui import indexqueue
+from webui import querycache
+from webui import indexbuild
+from webui.identifier import Identifier
+from webui.models import INDEX_PREFIX
+from webui.progress import Progress
 
 
 class ElasticsearchTask(Task):
@@ -22,57 +35,110 @@ class ElasticsearchTask(Task):
         logger.debug('ElasticsearchTask.on_success(%s, %s, %s, %s)' % (retval, task_id, args, kwargs))
     
     def after_return(self, status, retval, task_id, args, kwargs, einfo):
-        gitstatus.unlock(settings.MEDIA_BASE, 'reindex')
         logger.debug('ElasticsearchTask.after_return(%s, %s, %s, %s, %s)' % (status, retval, task_id, args, kwargs))
 
-@shared_task(base=ElasticsearchTask, name='search-reindex')
-def reindex( index ):
-    """
-    @param index: Name of index to create or update
+@shared_task(base=ElasticsearchTask, name='search-reindex', bind=True)
+def reindex( self, restart=False ):
+    """Rebuilds search indexes from the Store and swaps them in
+    
+    Search keeps working from the old indexes until the end.
+    An interrupted run is resumed unless restart is True.
+    See webui.indexbuild.
+    
+    @param restart: boolean Discard an interrupted run and start over
     """
-    gitstatus.lock(settings.MEDIA_BASE, 'reindex')
-    logger.debug('------------------------------------------------------------------------')
-    logger.debug('webui.tasks.reindex(%s)' % index)
-    statuses = []
     if not settings.DOCSTORE_ENABLED:
         raise Exception('Elasticsearch is not enabled. Please see your settings.')
     if not os.path.exists(settings.MEDIA_BASE):
         raise NameError('MEDIA_BASE does not exist - you need to remount!')
-    logger.debug('webui.tasks.reindex(%s)' % index)
+    if not indexbuild.lock():
+        raise Exception('A reindex is already running.')
+    gitstatus.lock(settings.MEDIA_BASE, 'reindex')
+    try:
+        return _reindex(self, restart)
+    finally:
+        gitstatus.unlock(settings.MEDIA_BASE, 'reindex')
+        indexbuild.unlock()
+
+def _reindex(task, restart):
+    logger.debug('webui.tasks.reindex(restart=%s)' % restart)
     logger.debug('DOCSTORE_HOST: %s' % settings.DOCSTORE_HOST)
-    ds = docstore.Docstore(index=index)
-    logger.debug('- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - ')
-    logger.debug('deleting existing index: %s' % index)
-    delete_status = ds.delete_index()
-    logger.debug(delete_status)
-    logger.debug('- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - ')
-    logger.debug('creating new index: %s' % index)
-    create_status = ds.create_index()
-    logger.debug(create_status)
-    logger.debug('- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - ')
-    logger.debug('mappings: %s, %s' % (docstore.HARD_CODED_MAPPINGS_PATH, models.MODELS_DIR))
-    mappings_status = ds.put_mappings(
-        docstore.HARD_CODED_MAPPINGS_PATH, models.MODELS_DIR
-    )
-    logger.debug(mappings_status)
-    logger.debug('- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - ')
-    logger.debug('facets')
-    facets_status = ds.put_facets()
-    logger.debug(facets_status)
-    logger.debug('- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - ')
-    logger.debug('indexing/publishing')
-    publish_status = ds.publish(
-        path=settings.MEDIA_BASE,
-        recursive=True, public=False
-    )
-    logger.debug(publish_status)
-    return statuses
+    ds = docstores.manager(INDEX_PREFIX, settings.DOCSTORE_HOST)
+    collection_paths = []
+    for o in gitolite.get_repos_orgs():
+        repo,org = o.split('-')
+        collection_paths += Collection.collection_paths(
+            settings.MEDIA_BASE, repo, org
+        )
+    progress = Progress(task, total=len(collection_paths))
+    
+    data = indexbuild.state()
+    if data and restart:
+        logger.debug('abandoning %s' % data['version'])
+        indexbuild.abandon(ds, data)
+        data = None
+    if data:
+        logger.debug('resuming %s' % data['version'])
+    else:
+        progress.update(0, stage='Creating indexes')
+        data = indexbuild.start(ds, INDEX_PREFIX, collection_paths)
+    bds = indexbuild.build_manager(ds, data)
+    
+    data['stage'] = 'publish'
+    data['collections'] = len(collection_paths)
+    indexbuild.save_state(data)
+    done = indexbuild.collections_done(data)
+    todo = [path for path in collection_paths if path not in done]
+    progress.update(len(done), stage='Publishing')
+    indexed = 0
+    failed = []
+    with ThreadPoolExecutor(max_workers=settings.REINDEX_WORKERS) as pool:
+        futures = {
+            pool.submit(indexbuild.publish_collection, bds, path, Identifier): path
+            for path in todo
+        }
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                ok,errors = future.result()
+            except:
+                # connection errors end the run; it can be resumed.
+                # don't send the queued collections to a failing cluster
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise
+            indexed += ok
+            failed += errors
+            indexbuild.collection_done(data, path)
+            indexbuild.lock_refresh()
+            done.add(path)
+            progress.update(len(done))
+            logger.debug('%s: %s indexed, %s failed' % (path, ok, len(errors)))
+    
+    data['stage'] = 'copy'
+    indexbuild.save_state(data)
+    indexbuild.lock_refresh()
+    progress.update(0, total=1, stage='Copying other indexes')
+    indexbuild.copy_other(ds, bds, data, indexbuild.MODELS)
+    
+    data['stage'] = 'swap'
+    indexbuild.save_state(data)
+    indexbuild.lock_refresh()
+    progress.update(0, total=1, stage='Swapping indexes')
+    indexes = indexbuild.finish(ds, data)
+    return {
+        'version': data['version'],
+        'indexes': indexes,
+        'collections': len(collection_paths),
+        'indexed': indexed,
+        'failed': failed,
+    }
 
-def reindex_and_notify( index ):
-    """Drop existing index and build another from scratch; hand off to Celery.
+def reindex_and_notify( request, restart=False ):
+    """Build new search indexes and swap them in; hand off to Celery.
     This function is intended for use in a view.
     """
-    result = reindex(index).apply_async(
+    result = reindex.apply_async(
+        (restart,),
         countdown=2
     )
     celery_tasks = request.session.get(settings.CELERY_TASKS_SESSION_KEY, {})
@@ -80,8 +146,144 @@ def reindex_and_notify( index ):
     task = {
         'task_id': result.task_id,
         'action': 'search-reindex',
-        'index': index,
         'start': converters.datetime_to_text(datetime.now(settings.TZ)),
     }
     celery_tasks[result.task_id] = task
     request.session[settings.CELERY_TASKS_SESSION_KEY] = celery_tasks
+
+
+# ----------------------------------------------------------------------
+
+def _bulk_action(ds, oid, entry):
+    """Elasticsearch bulk action for an outbox entry
+    
+    Returns None if document was posted directly (see below).
+    """
+    oi = Identifier(oid)
+    index = ds.index_name(oi.model)
+    if entry['op'] == 'delete':
+        return {'_op_type': 'delete', '_index': index, '_id': oid}
+    if not os.path.exists(oi.path_abs('json')):
+        # deleted after it was queued
+        return {'_op_type': 'delete', '_index': index, '_id': oid}
+    document = oi.object()
+    try:
+        source = document.to_esobject().to_dict()
+    except (AttributeError, TypeError):
+        # not something we know how to serialize; let DocstoreManager do it
+        ds.post(document)
+        indexbuild.mirror_post(ds, document)
+        querycache.invalidate([index])
+        return None
+    return {'_op_type': 'index', '_index': index, '_id': oid, '_source': source}
+
+@shared_task(base=ElasticsearchTask, name='webui.tasks.index_outbox_drain')
+def index_outbox_drain():
+    """Sends queued document updates to Elasticsearch in bulk
+    
+    See webui.indexqueue.
+    """
+    indexqueue.drain_started()
+    if not settings.DOCSTORE_ENABLED:
+        return 'disabled'
+    if not indexqueue.drain_lock():
+        # another drain is running; it or the next one will get these
+        return 'busy'
+    try:
+        return _index_outbox_drain()
+    finally:
+        indexqueue.drain_unlock()
+
+def _mirror(ds, actions):
+    """Sends updates to indexes being built by search-reindex, if any
+    
+    @returns: (list oids to retry, dict oid: error)
+    """
+    mirrored = indexbuild.mirror(actions)
+    if not mirrored:
+        return [],{}
+    try:
+        ok,errors = helpers.bulk(ds.es, mirrored, raise_on_error=False)
+    except (ConnectionError, TransportError) as err:
+        logger.error('index_outbox_drain mirror: %s' % err)
+        return [action['_id'] for action in mirrored],{}
+    failed = {}
+    for error in errors:
+        op,info = list(error.items())[0]
+        if (op == 'delete') and (info.get('status') == 404):
+            # not published to the build indexes yet
+            continue
+        logger.error('index_outbox_drain mirror %s: %s' % (info.get('_id'), info.get('error')))
+        failed[info.get('_id')] = str(info.get('error'))
+    return [],failed
+
+def _index_outbox_drain():
+    entries = indexqueue.take()
+    if not entries:
+        return {'indexed': 0, 'failed': 0, 'requeued': 0, 'dead': 0}
+    ds = docstores.manager(INDEX_PREFIX, settings.DOCSTORE_HOST)
+    batch_size = settings.INDEX_OUTBOX_BATCH_SIZE
+    oids = sorted(entries.keys())
+    indexed = 0
+    # oid: last error
+    failed = {}
+    requeue = {}
+    for n in range(0, len(oids), batch_size):
+        batch = oids[n:n+batch_size]
+        actions = []
+        for oid in batch:
+            try:
+                action = _bulk_action(ds, oid, entries[oid])
+            except Exception as err:
+                logger.error('index_outbox_drain %s: %s' % (oid, err))
+                failed[oid] = str(err)
+                continue
+            if action:
+                actions.append(action)
+            else:
+                indexed += 1
+        try:
+            ok,errors = helpers.bulk(ds.es, actions, raise_on_error=False)
+        except (ConnectionError, TransportError) as err:
+            # cluster unreachable: keep this and all following batches
+            logger.error('index_outbox_drain: %s' % err)
+            for oid in oids[n:]:
+                if oid not in failed:
+                    requeue[oid] = entries[oid]
+            break
+        indexed += ok
+        querycache.invalidate(set(action['_index'] for action in actions))
+        # documents the build indexes missed are sent again on the next run
+        retry,mirror_failed = _mirror(ds, actions)
+        for oid in retry:
+            requeue[oid] = entries[oid]
+        failed.update(mirror_failed)
+        for error in errors:
+            op,info = list(error.items())[0]
+            if (op == 'delete') and (info.get('status') == 404):
+                indexed += 1
+                continue
+            logger.error('index_outbox_drain %s: %s' % (info.get('_id'), info.get('error')))
+            failed[info.get('_id')] = str(info.get('error'))
+    # failed documents are retried a few times, e.g. after a mapping is fixed,
+    # then set aside in the dead-letter hash for an operator to look at
+    dead = {}
+    for oid,error in failed.items():
+        entry = entries.get(oid)
+        if not entry:
+            continue
+        entry['attempts'] = entry.get('attempts', 0) + 1
+        if entry['attempts'] < settings.INDEX_OUTBOX_MAX_ATTEMPTS:
+            requeue[oid] = entry
+        else:
+            entry['error'] = error
+            dead[oid] = entry
+    for oid in dead:
+        requeue.pop(oid, None)
+    indexqueue.requeue(requeue)
+    indexqueue.bury(dead)
+    indexqueue.done([oid for oid in oids if (oid not in requeue) and (oid not in dead)])
+    return {
+        'indexed': indexed, 'failed': len(failed),
+        'requeued': len(requeue), 'dead': len(dead),
+    }
@@ -7,8 +7,13 @@ logger = get_task_logger(__name__)
 
 from django.conf import settings
 
+from ddrlocal.models import DDRLocalCollection as Collection
+from webui import catalog
 from webui import gitolite
 from webui import gitstatus
+from webui import modeldefs
+from webui import remotes
+from webui.identifier import Identifier
 
 
 class DebugTask(Task):
@@ -42,8 +47,37 @@ class GitStatusTask(Task):
         logger.debug('GitStatusTask.after_return(%s, %s, %s, %s, %s, %s)' % (status, retval, task_id, args, kwargs, einfo))
         gitstatus.log('GitStatusTask.after_return(%s, %s, %s, %s, %s, %s)' % (status, retval, task_id, args, kwargs, einfo))
 
+def gitstatus_request( collection_path ):
+    """Requests a background gitstatus refresh for a modified collection
+    
+    Requests within GITSTATUS_REFRESH_WINDOW seconds of the first one
+    are coalesced into a single gitstatus_update task, so the calling
+    task does not wait for git-status/git-annex-status.
+    
+    @param collection_path: Absolute path to collection repo
+    @returns: True if a refresh was scheduled
+    """
+    window = settings.GITSTATUS_REFRESH_WINDOW
+    # children listing reads the catalog; bring it up to date with the
+    # commit just made (only changed entities are reparsed)
+    try:
+        catalog.update(settings.MEDIA_BASE, collection_path)
+    except Exception as err:
+        logger.error('catalog.update %s: %s' % (collection_path, err))
+    # reset interval; regular queue picks it up again after the refresh
+    gitstatus.touch(
+        settings.MEDIA_BASE, collection_path,
+        delay=window + settings.GITSTATUS_INTERVAL_MIN
+    )
+    # flag expires eventually in case the refresh task is lost
+    if gitstatus.mark_dirty(collection_path, window + 60*5):
+        gitstatus_update.apply_async((collection_path,), countdown=window)
+        return True
+    return False
+
 @shared_task(base=GitStatusTask, name='webui.tasks.gitstatus_update')
 def gitstatus_update( collection_path ):
+    gitstatus.clear_dirty(collection_path)
     if not os.path.exists(settings.MEDIA_BASE):
         raise Exception('base_dir does not exist. No Store mounted?: %s' % settings.MEDIA_BASE)
     if not os.path.exists(gitstatus.queue_path(settings.MEDIA_BASE)):
@@ -54,6 +88,14 @@ def gitstatus_update( collection_path ):
         gitstatus.queue_write(settings.MEDIA_BASE, queue)
     return gitstatus.update(settings.MEDIA_BASE, collection_path)
 
+@shared_task(base=GitStatusTask, name='webui.tasks.gitstatus_manifest_rebuild')
+def gitstatus_manifest_rebuild():
+    """Rebuilds the gitstatus manifest; see gitstatus.manifest_request_rebuild
+    """
+    if not os.path.exists(settings.MEDIA_BASE):
+        raise Exception('base_dir does not exist. No Store mounted?: %s' % settings.MEDIA_BASE)
+    return gitstatus.manifest_rebuild(settings.MEDIA_BASE)
+
 @shared_task(base=GitStatusTask, name='webui.tasks.gitstatus_update_store')
 def gitstatus_update_store():
     if not os.path.exists(settings.MEDIA_BASE):
@@ -68,4 +110,57 @@ def gitstatus_update_store():
         base_dir=settings.MEDIA_BASE,
         delta=60,
         minimum=settings.GITSTATUS_INTERVAL,
+        batch_size=settings.GITSTATUS_BATCH_SIZE,
+        workers=settings.GITSTATUS_WORKERS,
+        floor=settings.GITSTATUS_INTERVAL_MIN,
+        ceiling=settings.GITSTATUS_INTERVAL_MAX,
+    )
+
+
+# ----------------------------------------------------------------------
+
+@shared_task(base=DebugTask, name='webui.tasks.remotes_check')
+def remotes_check():
+    """Compares branches of all collections in Store with Gitolite server
+    
+    Results are read by edit views instead of running git fetch.
+    """
+    if settings.OFFLINE:
+        return 'offline'
+    if not os.path.exists(settings.MEDIA_BASE):
+        raise Exception('base_dir does not exist. No Store mounted?: %s' % settings.MEDIA_BASE)
+    collection_paths = []
+    for o in gitolite.get_repos_orgs():
+        repo,org = o.split('-')
+        collection_paths += Collection.collection_paths(
+            settings.MEDIA_BASE, repo, org
+        )
+    results = remotes.check(
+        collection_paths, settings.GIT_REMOTE_NAME,
+        workers=settings.REMOTES_CHECK_WORKERS,
     )
+    remotes.write(settings.MEDIA_BASE, results)
+    return {
+        state: len([r for r in results if r['state'] == state])
+        for state in set(r['state'] for r in results)
+    }
+
+
+# ----------------------------------------------------------------------
+
+@shared_task(base=DebugTask, name='webui.tasks.modeldefs_report')
+def modeldefs_report():
+    """Lists documents in Store that are out of date with model definitions
+    
+    See webui.modeldefs.
+    """
+    if not os.path.exists(settings.MEDIA_BASE):
+        raise Exception('base_dir does not exist. No Store mounted?: %s' % settings.MEDIA_BASE)
+    collection_paths = []
+    for o in gitolite.get_repos_orgs():
+        repo,org = o.split('-')
+        collection_paths += Collection.collection_paths(
+            settings.MEDIA_BASE, repo, org
+        )
+    data = modeldefs.report(settings.MEDIA_BASE, collection_paths, Identifier)
+    return data['counts']
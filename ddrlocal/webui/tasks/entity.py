@@ -9,9 +9,10 @@ from django.conf import settings
 
 from DDR import converters
 
-from elastictools.docstore import DocstoreManager, ConnectionError, RequestError
+from elastictools.docstore import ConnectionError, RequestError
+from webui import indexqueue
 from webui import gitstatus
-from webui.models import Collection, Entity, INDEX_PREFIX
+from webui.models import Collection, Entity
 from webui.identifier import Identifier
 from webui.tasks import dvcs as dvcs_tasks
 
@@ -55,7 +56,7 @@ class EntityEditTask(Task):
         collection_path = args[0]
         collection = Collection.from_identifier(Identifier(path=collection_path))
         lockstatus = collection.unlock(task_id)
-        gitstatus.update(settings.MEDIA_BASE, collection_path)
+        dvcs_tasks.gitstatus_request(collection_path)
         gitstatus.unlock(settings.MEDIA_BASE, 'entity_edit')
 
 @shared_task(base=EntityEditTask, name='entity-edit')
@@ -90,10 +91,6 @@ def entity_edit(collection_path, entity_id, form_data, git_name, git_mail, agent
         logger.error("FileNotFoundError: {0}".format(err))
         exit = 1; status = {'error': str(err)}
     
-    dvcs_tasks.gitstatus_update.apply_async(
-        (collection.path,),
-        countdown=2
-    )
     return status,collection_path,entity_id
 
 # ------------------------------------------------------------------------
@@ -139,7 +136,7 @@ class DeleteEntityTask(Task):
         collection_path = args[0]
         collection = Collection.from_identifier(Identifier(path=collection_path))
         lockstatus = collection.unlock(task_id)
-        gitstatus.update(settings.MEDIA_BASE, collection_path)
+        dvcs_tasks.gitstatus_request(collection_path)
         gitstatus.unlock(settings.MEDIA_BASE, 'entity_delete')
 
 @shared_task(base=DeleteEntityTask, name='entity-delete')
@@ -171,19 +168,9 @@ def entity_delete(collection_path, entity_id, git_name, git_mail, agent):
         logger.error("RequestError: {0}".format(err))
         exit = 1; status = {'error': err}
     
-    dvcs_tasks.gitstatus_update.apply_async(
-        (collection.path,),
-        countdown=2
-    )
-    
     logger.debug('Updating Elasticsearch')
     if settings.DOCSTORE_ENABLED:
-        try:
-            DocstoreManager(
-                INDEX_PREFIX, settings.DOCSTORE_HOST, settings
-            ).delete(entity.id)
-        except ConnectionError:
-            logger.error('Could not delete document from Elasticsearch.')
+        indexqueue.delete(entity.id)
     return status,message,collection.path_abs,entity.id
 
 # ----------------------------------------------------------------------
@@ -225,7 +212,7 @@ class EntityReloadTask(Task):
         entity_id = args[1]
         entity = Entity.from_identifier(Identifier(id=entity_id))
         lockstatus = collection.unlock(task_id)
-        gitstatus.update(settings.MEDIA_BASE, collection_path)
+        dvcs_tasks.gitstatus_request(collection_path)
         gitstatus.unlock(settings.MEDIA_BASE, 'reload_files')
 
 @shared_task(base=EntityReloadTask, name='entity-reload-files')
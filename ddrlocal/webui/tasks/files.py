@@ -11,9 +11,10 @@ from django.conf import settings
 from DDR import converters
 from DDR.util import FileLogger
 
-from elastictools.docstore import DocstoreManager, ConnectionError, RequestError
+from elastictools.docstore import ConnectionError, RequestError
+from webui import indexqueue
 from webui import gitstatus
-from webui.models import Collection, Entity, File, INDEX_PREFIX
+from webui.models import Collection, Entity, File
 from webui.identifier import Identifier
 from webui.tasks import dvcs as dvcs_tasks
 
@@ -56,7 +57,7 @@ def add_local(request, form_data, entity, role, src_path, git_name, git_mail):
 
 def add_external(request, form_data, entity, file_role, git_name, git_mail):
     collection = entity.collection()
-    idparts = file_role.identifier.idparts
+    idparts = file_role.identifier.idparts.copy()
     idparts['model'] = 'file'
     idparts['sha1'] = form_data['sha1']
     fi = Identifier(parts=idparts)
@@ -166,7 +167,7 @@ class FileAddDebugTask(Task):
             log.error(lockstatus)
         log.debug('END task_id %s\n' % task_id)
         collection.cache_delete()
-        gitstatus.update(settings.MEDIA_BASE, collection.path)
+        dvcs_tasks.gitstatus_request(collection.path)
         gitstatus.unlock(settings.MEDIA_BASE, 'file-add-*')
 
 @shared_task(base=FileAddDebugTask, name=TASK_FILE_ADD_LOCAL_NAME)
@@ -193,17 +194,7 @@ def file_add_local(entity_path, src_path, role, data, git_name, git_mail):
     log.debug('Updating Elasticsearch')
     logger.debug('Updating Elasticsearch')
     if settings.DOCSTORE_ENABLED:
-        try:
-            result = file_.post_json()
-            log.debug('| %s' % result)
-        except ConnectionError as err:
-            log.error("ConnectionError: {0}".format(err))
-        except RequestError as err:
-            log.error("RequestError: {0}".format(err))
-        except FileNotFoundError as err:
-            # don't crash if file absent from Internet Archive
-            logger.error("FileNotFoundError: {0}".format(err))
-            exit = 1; status = {'error': str(err)}
+        indexqueue.post(file_)
     return {
         'id': file_.id,
         'status': 'ok'
@@ -230,17 +221,7 @@ def file_add_external(entity_path, data, git_name, git_mail):
     log.debug('Updating Elasticsearch')
     logger.debug('Updating Elasticsearch')
     if settings.DOCSTORE_ENABLED:
-        try:
-            result = file_.post_json()
-            log.debug('| %s' % result)
-        except ConnectionError as err:
-            log.error("ConnectionError: {0}".format(err))
-        except RequestError as err:
-            log.error("RequestError: {0}".format(err))
-        except FileNotFoundError as err:
-            # don't crash if file absent from Internet Archive
-            logger.error("FileNotFoundError: {0}".format(err))
-            exit = 1; status = {'error': str(err)}
+        indexqueue.post(file_)
     return {
         'id': file_.id,
         'status': 'ok'
@@ -272,16 +253,7 @@ def file_add_access(entity_path, file_data, src_path, git_name, git_mail):
     log.debug('Updating Elasticsearch')
     logger.debug('Updating Elasticsearch')
     if settings.DOCSTORE_ENABLED:
-        try:
-            file_.post_json()
-        except ConnectionError as err:
-            log.error("ConnectionError: {0}".format(err))
-        except RequestError as err:
-            log.error("RequestError: {0}".format(err))
-        except FileNotFoundError as err:
-            # don't crash if file absent from Internet Archive
-            logger.error("FileNotFoundError: {0}".format(err))
-            exit = 1; status = {'error': str(err)}
+        indexqueue.post(file_)
     return {
         'id': file_.id,
         'status': 'ok'
@@ -317,7 +289,7 @@ class FileEditTask(Task):
         collection_path = args[0]
         collection = Collection.from_identifier(Identifier(path=collection_path))
         lockstatus = collection.unlock(task_id)
-        gitstatus.update(settings.MEDIA_BASE, collection_path)
+        dvcs_tasks.gitstatus_request(collection_path)
         gitstatus.unlock(settings.MEDIA_BASE, 'file_edit')
 
 @shared_task(base=FileEditTask, name='file-edit')
@@ -350,10 +322,6 @@ def file_edit(collection_path, file_id, form_data, git_name, git_mail):
         logger.error("FileNotFoundError: {0}".format(err))
         exit = 1; status = {'error': str(err)}
     
-    dvcs_tasks.gitstatus_update.apply_async(
-        (collection_path,),
-        countdown=2
-    )
     return status,collection_path,file_id
 
 
@@ -394,7 +362,7 @@ class DeleteFileTask(Task):
         collection_path = args[2]
         collection = Collection.from_identifier(Identifier(path=collection_path))
         lockstatus = collection.unlock(task_id)
-        gitstatus.update(settings.MEDIA_BASE, collection_path)
+        dvcs_tasks.gitstatus_request(collection_path)
         gitstatus.unlock(settings.MEDIA_BASE, 'delete_file')
 
 @shared_task(base=DeleteFileTask, name='file-delete')
@@ -419,18 +387,7 @@ def delete_file( git_name, git_mail, collection_path, entity_id, file_basename,
     )
     logger.debug('delete from search index')
     if settings.DOCSTORE_ENABLED:
-        try:
-            DocstoreManager(
-                INDEX_PREFIX, settings.DOCSTORE_HOST, settings
-            ).delete(file_.id)
-        except ConnectionError as err:
-            logger.error("ConnectionError: {0}".format(err))
-        except RequestError as err:
-            logger.error("RequestError: {0}".format(err))
-        except FileNotFoundError as err:
-            # don't crash if file absent from Internet Archive
-            logger.error("FileNotFoundError: {0}".format(err))
-            exit = 1; status = {'error': str(err)}
+        indexqueue.delete(file_.id)
     
     return exit,status,collection_path,file_basename
 
@@ -477,7 +434,7 @@ class FileSignatureTask(Task):
             collection = parent.collection()
         collection_path = collection.identifier.path_abs()
         lockstatus = collection.unlock(task_id)
-        gitstatus.update(settings.MEDIA_BASE, collection_path)
+        dvcs_tasks.gitstatus_request(collection_path)
         gitstatus.unlock(settings.MEDIA_BASE, 'set_signature')
 
 @shared_task(base=FileSignatureTask, name='set-signature')
@@ -494,7 +451,6 @@ def set_signature(parent_id, file_id, git_name, git_mail):
     ))
     parent = Identifier(id=parent_id).object()
     file_ = Identifier(id=file_id).object()
-    collection_path = file_.collection_path
     parent.signature_id = file_id
     gitstatus.lock(settings.MEDIA_BASE, 'set_signature')
     try:
@@ -506,8 +462,4 @@ def set_signature(parent_id, file_id, git_name, git_mail):
         # don't crash if file absent from Internet Archive
         logger.error("FileNotFoundError: {0}".format(err))
         exit = 1; status = {'error': str(err)}
-    dvcs_tasks.gitstatus_update.apply_async(
-        (collection_path,),
-        countdown=2
-    )
     return status,parent_id,file_id
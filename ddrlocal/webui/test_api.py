@@ -103,3 +103,28 @@ class APISearchView(TestCase):
         url = reverse('api-search') + '?fulltext=seattle&genre=photograph'
         response = self.client.get(url)
         self.assertEqual(response.status_code, 200)
+    
+    @pytest.mark.skipif(no_elasticsearch(), reason=NO_ELASTICSEARCH_ERR)
+    def test_search_results_cursor(self):
+        url = reverse('api-search') + '?fulltext=seattle&cursor=*&limit=5'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        token = response.json()['next']
+        if token:
+            response = self.client.get(
+                reverse('api-search'), {'fulltext': 'seattle', 'cursor': token, 'limit': 5}
+            )
+            self.assertEqual(response.status_code, 200)
+    
+    @pytest.mark.skipif(no_elasticsearch(), reason=NO_ELASTICSEARCH_ERR)
+    def test_search_results_cursor_invalid(self):
+        url = reverse('api-search') + '?fulltext=seattle&cursor=bogus'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 400)
+    
+    @pytest.mark.skipif(no_elasticsearch(), reason=NO_ELASTICSEARCH_ERR)
+    def test_search_results_stream(self):
+        url = reverse('api-search') + '?fulltext=seattle&stream=ndjson'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
@@ -0,0 +1,83 @@
+import json
+import subprocess
+
+from webui import catalog
+
+CID = 'ddr-test-123'
+
+
+def git(path, *args):
+    subprocess.run(
+        ['git', '-C', str(path)] + list(args),
+        check=True, capture_output=True
+    )
+
+def commit(path, message):
+    git(path, 'add', '-A')
+    git(path, '-c', 'user.name=test', '-c', 'user.email=test@example.org',
+        'commit', '-q', '-m', message)
+
+def write_entity(collection, eid, title, sort=1, files=0):
+    entity_dir = collection / 'files' / eid
+    (entity_dir / 'files').mkdir(parents=True, exist_ok=True)
+    (entity_dir / 'entity.json').write_text(json.dumps([
+        {'application': 'test'},
+        {'id': eid}, {'title': title}, {'sort': sort}, {'public': 1},
+        {'status': 'completed'}, {'signature_id': ''},
+    ]))
+    for n in range(files):
+        (entity_dir / 'files' / ('%s-master-%s.json' % (eid, n))).write_text('[]')
+
+def make_collection(tmp_path, num):
+    collection = tmp_path / CID
+    collection.mkdir()
+    (tmp_path / 'tmp').mkdir()
+    git(collection, 'init', '-q')
+    (collection / 'collection.json').write_text('[]')
+    for n in range(1, num+1):
+        write_entity(collection, '%s-%s' % (CID, n), 'Entity %s' % n, files=n % 3)
+    commit(collection, 'initial')
+    return collection
+
+def test_update_rebuild(tmp_path):
+    collection = make_collection(tmp_path, 12)
+    assert catalog.update(str(tmp_path), str(collection)) == 'rebuilt 12'
+    assert catalog.update(str(tmp_path), str(collection)) == 'unchanged'
+    entities = catalog.CatalogList(str(tmp_path), CID, CID)
+    assert entities.count() == 12
+    # numeric, not lexical, order
+    assert [e['id'] for e in entities[0:3]] == [
+        'ddr-test-123-1', 'ddr-test-123-2', 'ddr-test-123-3'
+    ]
+    assert entities[9]['id'] == 'ddr-test-123-10'
+    assert entities[1]['file_count'] == 2
+
+def test_update_incremental(tmp_path):
+    collection = make_collection(tmp_path, 5)
+    catalog.update(str(tmp_path), str(collection))
+    write_entity(collection, '%s-2' % CID, 'Changed', files=4)
+    write_entity(collection, '%s-6' % CID, 'New')
+    subprocess.run(['rm', '-r', str(collection / 'files' / ('%s-5' % CID))], check=True)
+    commit(collection, 'changes')
+    assert catalog.update(str(tmp_path), str(collection)) == 'updated 3'
+    entities = catalog.CatalogList(str(tmp_path), CID, CID)
+    ids = [e['id'] for e in entities[0:10]]
+    assert ids == ['ddr-test-123-%s' % n for n in [1,2,3,4,6]]
+    assert entities[1]['title'] == 'Changed'
+    assert entities[1]['file_count'] == 4
+
+def test_built(tmp_path):
+    collection = make_collection(tmp_path, 2)
+    assert not catalog.built(str(tmp_path), CID)
+    catalog.update(str(tmp_path), str(collection))
+    assert catalog.built(str(tmp_path), CID)
+
+def test_update_no_head(tmp_path, monkeypatch):
+    collection = tmp_path / CID
+    write_entity(collection, '%s-1' % CID, 'Entity 1')
+    # no tmp/ dir yet, and not a git repo
+    assert catalog.update(str(tmp_path), str(collection)) == 'rebuilt 1'
+    # not rebuilt on every call
+    assert catalog.update(str(tmp_path), str(collection)) == 'unchanged'
+    monkeypatch.setattr(catalog, 'NO_HEAD_RETRY', 0)
+    assert catalog.update(str(tmp_path), str(collection)) == 'rebuilt 1'
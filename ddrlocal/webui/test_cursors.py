@@ -0,0 +1,27 @@
+from elasticsearch_dsl import Search
+import pytest
+
+from webui import cursors
+
+
+def test_prepare():
+    s = Search(index='ddrentity').query('match', title='seattle')
+    s.aggs.bucket('genre', 'terms', field='genre')
+    prepared = cursors.prepare(s)
+    assert 'aggs' not in prepared.to_dict()
+    assert prepared.to_dict()['sort'] == ['_score', '_shard_doc']
+    # original is unchanged
+    assert 'aggs' in s.to_dict()
+
+def test_prepare_keeps_sort():
+    s = cursors.prepare(Search().sort('sort', 'repo'))
+    assert cursors.prepare(s).to_dict()['sort'] == ['sort', 'repo', '_shard_doc']
+
+def test_token():
+    token = cursors.encode('pit123', ['a', 1], 812)
+    assert cursors.decode(token) == {'pit': 'pit123', 'after': ['a', 1], 'total': 812}
+
+def test_token_altered():
+    token = cursors.encode('pit123', ['a', 1], 812)
+    with pytest.raises(cursors.CursorError):
+        cursors.decode(token[:-2] + 'xx')
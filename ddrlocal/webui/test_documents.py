@@ -0,0 +1,122 @@
+import json
+import os
+
+import pytest
+
+from webui import documents
+from webui import identitymap
+
+
+class FakeRedis():
+    def __init__(self):
+        self.data = {}
+        self.gets = 0
+    def get(self, key):
+        self.gets += 1
+        return self.data.get(key)
+    def incr(self, key):
+        self.data[key] = str(int(self.data.get(key, 0)) + 1)
+        return int(self.data[key])
+
+class BrokenRedis():
+    def get(self, key):
+        raise ConnectionError('unreachable')
+    def incr(self, key):
+        raise ConnectionError('unreachable')
+
+class Document():
+    # number of times a Document was read from disk
+    loads = 0
+
+def from_json(object_class, path_abs, identifier):
+    object_class.loads += 1
+    document = object_class()
+    with open(path_abs, 'r') as f:
+        document.data = json.loads(f.read())
+    return document
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(documents.settings, 'MEDIA_BASE', str(tmp_path), raising=False)
+    monkeypatch.setattr(documents.settings, 'DOCUMENT_CACHE_BYTES', 1024*1024, raising=False)
+    r = FakeRedis()
+    monkeypatch.setattr(documents, 'redis_connection', lambda: r)
+    documents.clear()
+    Document.loads = 0
+    path = tmp_path / 'ddr-test-123' / 'files' / 'ddr-test-123-1' / 'entity.json'
+    path.parent.mkdir(parents=True)
+    path.write_text(json.dumps({'topics': [{'id': 1, 'terms': ['a']}]}))
+    yield str(path), r
+    documents.clear()
+
+def test_load_cached(store):
+    path,r = store
+    documents.load(Document, path, None, from_json)
+    documents.load(Document, path, None, from_json)
+    assert Document.loads == 1
+
+def test_load_copy_is_deep(store):
+    path,r = store
+    first = documents.load(Document, path, None, from_json)
+    first.data['topics'][0]['terms'].append('b')
+    second = documents.load(Document, path, None, from_json)
+    assert second.data['topics'][0]['terms'] == ['a']
+
+def test_invalidate_other_process(store):
+    path,r = store
+    documents.load(Document, path, None, from_json)
+    # another process writes the file and bumps the generation; this
+    # process's cache still has the old entry
+    r.incr(documents.GENERATION_KEY % 'ddr-test-123')
+    documents.load(Document, path, None, from_json)
+    assert Document.loads == 2
+
+def test_invalidate(store):
+    path,r = store
+    documents.load(Document, path, None, from_json)
+    documents.invalidate(path)
+    assert r.get(documents.GENERATION_KEY % 'ddr-test-123') == '1'
+    assert documents.stats()['entries'] == 0
+
+def test_load_redis_unreachable(store, monkeypatch):
+    path,r = store
+    monkeypatch.setattr(documents, 'redis_connection', lambda: BrokenRedis())
+    documents.load(Document, path, None, from_json)
+    documents.load(Document, path, None, from_json)
+    assert Document.loads == 2
+    assert documents.stats()['entries'] == 0
+
+def test_generation_once_per_request(store):
+    path,r = store
+    other = path.replace('entity.json', 'other.json')
+    with open(other, 'w') as f:
+        f.write(json.dumps({}))
+    token = identitymap.start()
+    try:
+        documents.load(Document, path, None, from_json)
+        documents.load(Document, other, None, from_json)
+        assert r.gets == 1
+        # this process's own change is seen in the same request
+        documents.invalidate(path)
+        documents.load(Document, path, None, from_json)
+        assert r.gets == 1
+        assert Document.loads == 3
+    finally:
+        identitymap.stop(token)
+
+def test_invalidate_keeps_siblings(store):
+    path,r = store
+    sibling = os.path.join(os.path.dirname(path), 'files', 'ddr-test-123-1-master-abc.json')
+    os.makedirs(os.path.dirname(sibling))
+    with open(sibling, 'w') as f:
+        f.write(json.dumps({}))
+    other = path.replace('entity.json', 'other.json')
+    with open(other, 'w') as f:
+        f.write(json.dumps({}))
+    for p in [path, sibling, other]:
+        documents.load(Document, p, None, from_json)
+    documents.invalidate(path)
+    assert documents.stats()['entries'] == 2
+    # a directory drops everything below it
+    documents.invalidate(os.path.dirname(path))
+    assert documents.stats()['entries'] == 0
@@ -0,0 +1,148 @@
+from datetime import datetime, timedelta
+import os
+import threading
+
+from django.conf import settings
+import pytest
+
+from webui import gitstatus
+
+
+COLLECTIONS = [
+    'ddr-test-123',
+    'ddr-test-124',
+    'ddr-test-136',
+    'ddr-test-248',
+]
+
+def make_queue(base_dir, collections=COLLECTIONS):
+    epoch = datetime(1969, 12, 31, 16, 0, tzinfo=settings.TZ)
+    gitstatus.queue_write(str(base_dir), {
+        'generated': datetime.now(settings.TZ),
+        'collections': [(epoch,cid) for cid in collections],
+    })
+    return gitstatus.queue_read(str(base_dir))
+
+def later(seconds):
+    """datetime class whose now() is ${seconds} in the future
+    """
+    class Later(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime.now(tz) + timedelta(seconds=seconds)
+    return Later
+
+def test_next_repos_order(tmp_path):
+    queue = make_queue(tmp_path)
+    # earliest timestamp first
+    queue.execute(
+        'UPDATE queue SET timestamp=? WHERE collection_id=?',
+        (-86400, 'ddr-test-248')
+    )
+    paths = gitstatus.next_repos(queue, limit=2)
+    assert len(paths) == 2
+    assert os.path.basename(paths[0]) == 'ddr-test-248'
+    queue.close()
+
+def test_next_repos_concurrent(tmp_path):
+    make_queue(tmp_path).close()
+    workers = 4
+    barrier = threading.Barrier(workers)
+    results = []
+    def claim():
+        queue = gitstatus.queue_read(str(tmp_path))
+        barrier.wait()
+        response = gitstatus.next_repos(queue, limit=2)
+        if isinstance(response, list):
+            results.extend(response)
+        queue.close()
+    threads = [threading.Thread(target=claim) for n in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    claimed = [os.path.basename(path) for path in results]
+    assert sorted(claimed) == sorted(COLLECTIONS)
+
+def test_next_repos_lease(tmp_path, monkeypatch):
+    queue = make_queue(tmp_path, ['ddr-test-123'])
+    paths = gitstatus.next_repos(queue, lease=60)
+    assert os.path.basename(paths[0]) == 'ddr-test-123'
+    # leased to the first worker
+    status,next_available = gitstatus.next_repos(queue, lease=60)
+    assert status == 'notready'
+    assert next_available > datetime.now(settings.TZ)
+    # worker died; lease runs out
+    monkeypatch.setattr(gitstatus, 'datetime', later(61))
+    paths = gitstatus.next_repos(queue, lease=60)
+    assert os.path.basename(paths[0]) == 'ddr-test-123'
+    queue.close()
+
+def test_queue_reschedule_bounds(tmp_path):
+    queue = make_queue(tmp_path, ['ddr-test-123'])
+    floor,ceiling,initial = 60, 3600, 600
+    def interval():
+        return queue.execute(
+            'SELECT interval FROM intervals WHERE collection_id=?', ('ddr-test-123',)
+        ).fetchone()[0]
+    start = datetime.now(settings.TZ)
+    timestamp = gitstatus.queue_reschedule(queue, 'ddr-test-123', False, floor, ceiling, initial)
+    assert interval() == initial
+    assert timestamp >= start + timedelta(seconds=initial)
+    # unchanged repos back off, but no further than ceiling
+    for n in range(10):
+        timestamp = gitstatus.queue_reschedule(queue, 'ddr-test-123', False, floor, ceiling, initial)
+        assert floor <= interval() <= ceiling
+    assert interval() == ceiling
+    assert timestamp <= datetime.now(settings.TZ) + timedelta(seconds=ceiling)
+    # busy repos are checked more often, but no more than floor
+    for n in range(10):
+        gitstatus.queue_reschedule(queue, 'ddr-test-123', True, floor, ceiling, initial)
+        assert floor <= interval() <= ceiling
+    assert interval() == floor
+    queue.close()
+
+def test_manifest(tmp_path):
+    gitstatus.manifest_rebuild(str(tmp_path))
+    timestamp = datetime(2024, 1, 2, 3, 4, 5, tzinfo=settings.TZ)
+    header = gitstatus.header_dumps({
+        'timestamp': timestamp,
+        'elapsed': '0:00:01',
+        'sync_status': {'status': 'ahead', 'timestamp': timestamp},
+        'fingerprint': 'abc',
+    })
+    gitstatus.manifest_update(str(tmp_path), 'ddr-test-123', header)
+    gitstatus.manifest_update(str(tmp_path), 'ddr-test-124', header.replace('ahead', 'synced'))
+    headers = gitstatus.manifest_read(str(tmp_path))
+    assert sorted(headers.keys()) == ['ddr-test-123', 'ddr-test-124']
+    assert headers['ddr-test-123']['fingerprint'] == 'abc'
+    assert headers['ddr-test-123']['timestamp'].strftime('%Y-%m-%d %H:%M:%S') == '2024-01-02 03:04:05'
+    states = gitstatus.sync_states(str(tmp_path), 'ddr-test')
+    assert states['ddr-test-123']['status'] == 'ahead'
+    assert states['ddr-test-124']['status'] == 'synced'
+    # replaced, not added
+    gitstatus.manifest_update(str(tmp_path), 'ddr-test-123', header.replace('ahead', 'behind'))
+    assert gitstatus.sync_summary(str(tmp_path))['total']['behind'] == 1
+    assert len(gitstatus.manifest_read(str(tmp_path))) == 2
+
+def test_manifest_cold(tmp_path, monkeypatch):
+    requested = []
+    monkeypatch.setattr(gitstatus, 'manifest_request_rebuild', requested.append)
+    # web requests don't wait for a rebuild
+    assert gitstatus.sync_states(str(tmp_path)) == {}
+    assert requested == [str(tmp_path)]
+    # tasks do
+    assert gitstatus.manifest_read(str(tmp_path)) == {}
+    assert gitstatus.manifest_built(str(tmp_path))
+
+def test_queue_read_missing(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        gitstatus.queue_read(str(tmp_path))
+
+def test_queue_dumps_not_generated():
+    epoch = datetime(1969, 12, 31, 16, 0, tzinfo=settings.TZ)
+    text = gitstatus.queue_dumps({
+        'generated': None, 'collections': [(epoch, 'ddr-test-123')]
+    })
+    assert text.startswith('generated unknown\n')
+    assert gitstatus.queue_loads(text)['generated'] is None
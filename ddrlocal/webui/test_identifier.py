@@ -0,0 +1,19 @@
+import pytest
+
+from webui.identifier import Identifier, identifier_cache_clear
+
+
+def test_interned():
+    identifier_cache_clear()
+    oi = Identifier('ddr-test-123-1')
+    assert Identifier('ddr-test-123-1') is oi
+    assert Identifier(id='ddr-test-123-1') is Identifier(id='ddr-test-123-1')
+
+def test_interned_frozen():
+    identifier_cache_clear()
+    oi = Identifier('ddr-test-123-1')
+    with pytest.raises(AttributeError):
+        oi.model = 'collection'
+    assert Identifier('ddr-test-123-1').model == 'entity'
+    # memoized lookups still work
+    assert oi.collection_id() == 'ddr-test-123'
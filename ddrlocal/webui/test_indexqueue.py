@@ -0,0 +1,111 @@
+import uuid
+
+import pytest
+
+from webui import indexqueue
+from webui.cache import redis_connection
+
+
+def no_redis():
+    """Returns True if cannot contact Redis; use to skip tests
+    """
+    try:
+        redis_connection().ping()
+    except Exception:
+        return True
+    return False
+
+NO_REDIS_ERR = 'Redis is not available.'
+
+
+class Document():
+    def __init__(self, oid):
+        self.id = oid
+
+@pytest.fixture
+def outbox(monkeypatch):
+    """Outbox under test-only keys, without drain tasks
+    """
+    prefix = 'test:%s' % uuid.uuid4().hex
+    monkeypatch.setattr(indexqueue, 'OUTBOX_KEY', prefix + ':outbox')
+    monkeypatch.setattr(indexqueue, 'PROCESSING_KEY', prefix + ':processing')
+    monkeypatch.setattr(indexqueue, 'DEAD_KEY', prefix + ':dead')
+    monkeypatch.setattr(indexqueue, 'schedule_drain', lambda: None)
+    yield
+    redis_connection().delete(prefix + ':outbox', prefix + ':processing', prefix + ':dead')
+
+@pytest.mark.skipif(no_redis(), reason=NO_REDIS_ERR)
+def test_take_empty(outbox):
+    assert indexqueue.take() == {}
+
+@pytest.mark.skipif(no_redis(), reason=NO_REDIS_ERR)
+def test_coalesce(outbox):
+    indexqueue.post(Document('ddr-test-123-1'))
+    indexqueue.post(Document('ddr-test-123-1'))
+    indexqueue.delete('ddr-test-123-2')
+    assert indexqueue.pending() == 2
+    entries = indexqueue.take()
+    assert entries['ddr-test-123-1']['op'] == 'post'
+    assert entries['ddr-test-123-2']['op'] == 'delete'
+
+@pytest.mark.skipif(no_redis(), reason=NO_REDIS_ERR)
+def test_take_done(outbox):
+    indexqueue.post(Document('ddr-test-123-1'))
+    indexqueue.post(Document('ddr-test-123-2'))
+    entries = indexqueue.take()
+    assert sorted(entries.keys()) == ['ddr-test-123-1', 'ddr-test-123-2']
+    # saves during the drain go in the outbox
+    indexqueue.post(Document('ddr-test-123-3'))
+    indexqueue.done(list(entries.keys()))
+    assert indexqueue.pending() == 1
+    assert list(indexqueue.take().keys()) == ['ddr-test-123-3']
+
+@pytest.mark.skipif(no_redis(), reason=NO_REDIS_ERR)
+def test_take_leftovers(outbox):
+    # previous drain died after take()
+    indexqueue.post(Document('ddr-test-123-1'))
+    indexqueue.take()
+    indexqueue.delete('ddr-test-123-1')
+    indexqueue.post(Document('ddr-test-123-2'))
+    entries = indexqueue.take()
+    assert sorted(entries.keys()) == ['ddr-test-123-1', 'ddr-test-123-2']
+    # newer entry wins
+    assert entries['ddr-test-123-1']['op'] == 'delete'
+
+@pytest.mark.skipif(no_redis(), reason=NO_REDIS_ERR)
+def test_requeue(outbox):
+    indexqueue.post(Document('ddr-test-123-1'))
+    indexqueue.post(Document('ddr-test-123-2'))
+    entries = indexqueue.take()
+    # 123-2 was saved again while the drain was running
+    indexqueue.delete('ddr-test-123-2')
+    for entry in entries.values():
+        entry['attempts'] = 1
+    indexqueue.requeue(entries)
+    entries = indexqueue.take()
+    assert entries['ddr-test-123-1']['op'] == 'post'
+    assert entries['ddr-test-123-1']['attempts'] == 1
+    assert entries['ddr-test-123-2']['op'] == 'delete'
+    assert 'attempts' not in entries['ddr-test-123-2']
+
+@pytest.mark.skipif(no_redis(), reason=NO_REDIS_ERR)
+def test_dead_letters(outbox):
+    indexqueue.post(Document('ddr-test-123-1'))
+    indexqueue.post(Document('ddr-test-123-2'))
+    entries = indexqueue.take()
+    entry = entries['ddr-test-123-1']
+    entry['attempts'] = 3
+    entry['error'] = 'mapper_parsing_exception'
+    indexqueue.bury({'ddr-test-123-1': entry})
+    indexqueue.done(['ddr-test-123-2'])
+    assert indexqueue.pending() == 0
+    dead = indexqueue.dead_letters()
+    assert list(dead.keys()) == ['ddr-test-123-1']
+    assert dead['ddr-test-123-1']['error'] == 'mapper_parsing_exception'
+    # replayed with fresh attempts
+    assert indexqueue.replay(['ddr-test-123-9']) == 0
+    assert indexqueue.replay() == 1
+    assert indexqueue.dead_letters() == {}
+    entries = indexqueue.take()
+    assert entries['ddr-test-123-1']['op'] == 'post'
+    assert 'attempts' not in entries['ddr-test-123-1']
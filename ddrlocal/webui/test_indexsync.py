@@ -0,0 +1,116 @@
+import subprocess
+
+from webui import indexsync
+
+
+def git(path, *args):
+    subprocess.run(
+        ['git', '-C', str(path)] + list(args),
+        check=True, capture_output=True
+    )
+
+def write(path, path_rel, text):
+    target = path / path_rel
+    target.parent.mkdir(parents=True, exist_ok=True)
+    target.write_text(text)
+
+def commit(path, msg):
+    git(path, 'add', '-A')
+    git(path, '-c', 'user.name=test', '-c', 'user.email=test@example.org',
+        'commit', '-m', msg)
+    return indexsync.head(str(path))
+
+def make_repo(tmp_path):
+    repo = tmp_path / 'ddr-test-123'
+    subprocess.run(['git', 'init', '-b', 'master', str(repo)], check=True, capture_output=True)
+    write(repo, 'collection.json', '{}')
+    write(repo, 'files/ddr-test-123-1/entity.json', '{}')
+    write(repo, 'files/ddr-test-123-2/entity.json', '{}')
+    write(repo, 'files/ddr-test-123-2/files/ddr-test-123-2-master-a1b2c3d4e5.json', '{}')
+    write(repo, 'files/ddr-test-123-2/files/ddr-test-123-2-master-a1b2c3d4e5.jpg', 'jpg')
+    return repo, commit(repo, 'initial')
+
+def test_document_id():
+    cpath = '/base/ddr-test-123'
+    assert indexsync.document_id(cpath, 'collection.json') == 'ddr-test-123'
+    assert indexsync.document_id(cpath, 'changelog') is None
+    assert indexsync.document_id(cpath, 'files/ddr-test-123-1/entity.json') == 'ddr-test-123-1'
+    assert indexsync.document_id(
+        cpath, 'files/ddr-test-123-1/files/ddr-test-123-1-2/entity.json'
+    ) == 'ddr-test-123-1-2'
+    assert indexsync.document_id(
+        cpath, 'files/ddr-test-123-1/files/ddr-test-123-1-master-a1b2c3d4e5.json'
+    ) == 'ddr-test-123-1-master-a1b2c3d4e5'
+    assert indexsync.document_id(
+        cpath, 'files/ddr-test-123-1/files/ddr-test-123-1-master-a1b2c3d4e5.jpg'
+    ) is None
+
+def test_changes_none(tmp_path):
+    repo,first = make_repo(tmp_path)
+    assert indexsync.changes(str(repo), first) == ([], [])
+
+def test_changes(tmp_path):
+    repo,first = make_repo(tmp_path)
+    write(repo, 'files/ddr-test-123-1/entity.json', '{"title": "changed"}')
+    write(repo, 'files/ddr-test-123-3/entity.json', '{}')
+    git(repo, 'rm', '-q', 'files/ddr-test-123-2/files/ddr-test-123-2-master-a1b2c3d4e5.json')
+    write(repo, 'files/ddr-test-123-2/files/ddr-test-123-2-master-a1b2c3d4e5.jpg', 'jpg2')
+    commit(repo, 'second')
+    posted,deleted = indexsync.changes(str(repo), first)
+    assert posted == ['ddr-test-123-1', 'ddr-test-123-3']
+    assert deleted == ['ddr-test-123-2-master-a1b2c3d4e5']
+
+def test_changes_rename(tmp_path):
+    repo,first = make_repo(tmp_path)
+    git(repo, 'mv', 'files/ddr-test-123-1', 'files/ddr-test-123-4')
+    commit(repo, 'rename')
+    posted,deleted = indexsync.changes(str(repo), first)
+    assert posted == ['ddr-test-123-4']
+    assert deleted == ['ddr-test-123-1']
+
+def test_changes_unknown_commit(tmp_path):
+    repo,first = make_repo(tmp_path)
+    assert indexsync.changes(str(repo), '0' * 40) is None
+
+class FakeCollection():
+    def __init__(self, path):
+        self.path = str(path)
+        self.id = path.name
+        self.identifier = None
+
+def fake_markers(monkeypatch, markers):
+    monkeypatch.setattr(indexsync, 'fingerprint', lambda ds: 'fp')
+    monkeypatch.setattr(indexsync, 'marker', lambda cid: markers.get(cid))
+    monkeypatch.setattr(
+        indexsync, 'set_marker',
+        lambda cid, commit, fp: markers.update({cid: {'commit': commit, 'fingerprint': fp}})
+    )
+
+def test_reindex_moves_marker(tmp_path, monkeypatch):
+    repo,first = make_repo(tmp_path)
+    markers = {'ddr-test-123': {'commit': first, 'fingerprint': 'fp'}}
+    fake_markers(monkeypatch, markers)
+    monkeypatch.setattr(
+        indexsync, 'bulk',
+        lambda ds, posted, deleted, ic: {'posted': len(posted), 'deleted': 0, 'failed': []}
+    )
+    write(repo, 'files/ddr-test-123-1/entity.json', '{"title": "changed"}')
+    second = commit(repo, 'second')
+    result = indexsync.reindex(FakeCollection(repo), None, lambda: None)
+    assert result['full'] == False
+    assert result['posted'] == 1
+    assert markers['ddr-test-123']['commit'] == second
+
+def test_reindex_bulk_error_keeps_marker(tmp_path, monkeypatch):
+    repo,first = make_repo(tmp_path)
+    markers = {'ddr-test-123': {'commit': first, 'fingerprint': 'fp'}}
+    fake_markers(monkeypatch, markers)
+    monkeypatch.setattr(
+        indexsync, 'bulk',
+        lambda ds, posted, deleted, ic: {'posted': 0, 'deleted': 0, 'failed': list(posted)}
+    )
+    write(repo, 'files/ddr-test-123-1/entity.json', '{"title": "changed"}')
+    commit(repo, 'second')
+    result = indexsync.reindex(FakeCollection(repo), None, lambda: None)
+    assert result['failed'] == ['ddr-test-123-1']
+    assert markers['ddr-test-123']['commit'] == first
@@ -0,0 +1,109 @@
+import time
+import uuid
+
+import pytest
+
+from webui import locks
+from webui.cache import redis_connection
+
+
+def no_redis():
+    """Returns True if cannot contact Redis; use to skip tests
+    """
+    try:
+        redis_connection().ping()
+    except Exception:
+        return True
+    return False
+
+NO_REDIS_ERR = 'Redis is not available.'
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(locks.settings, 'MEDIA_BASE', str(tmp_path), raising=False)
+    monkeypatch.setattr(locks, '_checked', set())
+    return tmp_path
+
+@pytest.fixture
+def task_id():
+    return 'test-%s' % uuid.uuid4().hex
+
+def test_check_store_records_redis(store, monkeypatch):
+    monkeypatch.setattr(locks, 'redis_name', lambda: 'node1:6379/0')
+    locks.check_store(str(store))
+    assert (store / 'tmp' / 'locks-redis').read_text() == 'node1:6379/0'
+    # same Redis
+    monkeypatch.setattr(locks, '_checked', set())
+    locks.check_store(str(store))
+
+def test_check_store_other_redis(store, monkeypatch):
+    monkeypatch.setattr(locks, 'redis_name', lambda: 'node1:6379/0')
+    locks.check_store(str(store))
+    # Store moved to another machine: warn, don't refuse to lock
+    monkeypatch.setattr(locks, 'redis_name', lambda: 'node2:6379/0')
+    monkeypatch.setattr(locks, '_checked', set())
+    assert locks.check_store(str(store)) == 'node1:6379/0'
+    assert (store / 'tmp' / 'locks-redis').read_text() == 'node2:6379/0'
+
+def test_check_store_not_mounted(tmp_path):
+    locks.check_store(str(tmp_path / 'missing'))
+    assert not (tmp_path / 'missing').exists()
+
+@pytest.mark.skipif(no_redis(), reason=NO_REDIS_ERR)
+def test_global(store, task_id):
+    other = task_id + '-other'
+    assert task_id in locks.lock_global(task_id)
+    assert other in locks.lock_global(other)
+    remaining = locks.unlock_global(other)
+    assert task_id in remaining
+    assert other not in remaining
+    assert task_id not in (locks.unlock_global(task_id) or [])
+
+@pytest.mark.skipif(no_redis(), reason=NO_REDIS_ERR)
+def test_global_expires(store, task_id):
+    locks.lock_global(task_id, timeout=1)
+    time.sleep(1.1)
+    assert task_id not in (locks.locked_global() or [])
+
+@pytest.mark.skipif(no_redis(), reason=NO_REDIS_ERR)
+def test_collection(store, task_id):
+    cid = 'ddr-testlocks-%s' % uuid.uuid4().int
+    assert locks.lock_collection(cid, task_id) == 'ok'
+    # same task extends the lock; others are refused
+    assert locks.lock_collection(cid, task_id) == 'ok'
+    assert locks.lock_collection(cid, 'someone-else') == 'locked by %s' % task_id
+    assert locks.collection_locked(cid) == task_id
+    assert cid in locks.locked_collections()
+    assert locks.unlock_collection(cid, 'someone-else') == 'locked by %s' % task_id
+    assert locks.unlock_collection(cid, task_id) == 'ok'
+    assert locks.collection_locked(cid) == False
+    assert cid not in locks.locked_collections()
+    assert locks.unlock_collection(cid, task_id) == 'not locked'
+
+@pytest.mark.skipif(no_redis(), reason=NO_REDIS_ERR)
+def test_entity(store, task_id):
+    eid = 'ddr-testlocks-%s-1' % uuid.uuid4().int
+    assert locks.lock_entity(eid, task_id) == 'ok'
+    assert locks.lock_entity(eid, 'someone-else') == 'locked by %s' % task_id
+    assert locks.entity_locked(eid) == task_id
+    assert locks.unlock_entity(eid, task_id) == 'ok'
+    assert locks.entity_locked(eid) == False
+
+@pytest.mark.skipif(no_redis(), reason=NO_REDIS_ERR)
+def test_extend(store, task_id):
+    cid = 'ddr-testlocks-%s' % uuid.uuid4().int
+    eid = cid + '-1'
+    locks.lock_collection(cid, task_id, timeout=10)
+    locks.lock_entity(eid, task_id, timeout=10)
+    extended = locks.extend(task_id, timeout=100)
+    assert sorted(extended) == sorted([
+        locks.COLLECTION_LOCK_KEY % cid, locks.ENTITY_LOCK_KEY % eid
+    ])
+    assert redis_connection().ttl(locks.COLLECTION_LOCK_KEY % cid) > 10
+    assert locks.locked_collections()[cid] > time.time() + 10
+    # unlocked locks are not extended
+    locks.unlock_entity(eid, task_id)
+    assert locks.extend(task_id) == [locks.COLLECTION_LOCK_KEY % cid]
+    locks.unlock_collection(cid, task_id)
+    assert locks.extend(task_id) == []
@@ -0,0 +1,51 @@
+import uuid
+
+import pytest
+
+from webui import querycache
+from webui.cache import redis_connection
+
+
+def no_redis():
+    """Returns True if cannot contact Redis; use to skip tests
+    """
+    try:
+        redis_connection().ping()
+    except Exception:
+        return True
+    return False
+
+NO_REDIS_ERR = 'Redis is not available.'
+
+BODY = {'query': {'match': {'title': 'seattle'}}, 'size': 25}
+
+
+def test_key():
+    k = querycache.key(['ddrentity', 'ddrcollection'], BODY, ['1', None])
+    assert k.startswith('webui:querycache:')
+    # index order does not matter
+    assert k == querycache.key(['ddrcollection', 'ddrentity'], BODY, ['1', None])
+    # query, indexes, and generations do
+    assert k != querycache.key(['ddrentity', 'ddrcollection'], dict(BODY, size=50), ['1', None])
+    assert k != querycache.key(['ddrentity'], BODY, ['1', None])
+    assert k != querycache.key(['ddrentity', 'ddrcollection'], BODY, ['2', None])
+
+def test_names():
+    assert querycache._names(['ddrfile', 'ddrentity']) == [querycache.ALL, 'ddrentity', 'ddrfile']
+    assert querycache._names(None) == [querycache.ALL]
+
+@pytest.mark.skipif(no_redis(), reason=NO_REDIS_ERR)
+def test_invalidate():
+    r = redis_connection()
+    index = 'test-%s' % uuid.uuid4().hex
+    keys = [querycache.GENERATION_KEY % index, querycache.SETTLE_KEY % index]
+    try:
+        assert r.get(querycache.GENERATION_KEY % index) is None
+        querycache.invalidate([index])
+        assert r.get(querycache.GENERATION_KEY % index) == '1'
+        # responses are not stored until Elasticsearch has refreshed
+        assert r.get(querycache.SETTLE_KEY % index)
+        querycache.invalidate([index])
+        assert r.get(querycache.GENERATION_KEY % index) == '2'
+    finally:
+        r.delete(*keys)
@@ -0,0 +1,103 @@
+import subprocess
+
+from webui import remotes
+
+
+def git(path, *args):
+    subprocess.run(
+        ['git', '-C', str(path)] + list(args),
+        check=True, capture_output=True
+    )
+
+def commit(path, filename, text):
+    (path / filename).write_text(text)
+    git(path, 'add', filename)
+    git(path, '-c', 'user.name=test', '-c', 'user.email=test@example.org',
+        'commit', '-m', filename)
+
+def make_repos(tmp_path):
+    """Bare repo standing in for Gitolite, plus a local clone
+    """
+    server = tmp_path / 'server' / 'ddr-test-123.git'
+    local = tmp_path / 'local' / 'ddr-test-123'
+    other = tmp_path / 'other' / 'ddr-test-123'
+    server.parent.mkdir()
+    subprocess.run(['git', 'init', '--bare', '-b', 'master', str(server)], check=True, capture_output=True)
+    subprocess.run(['git', 'clone', str(server), str(local)], check=True, capture_output=True)
+    git(local, 'checkout', '-b', 'master')
+    commit(local, 'collection.json', '{}')
+    git(local, 'push', 'origin', 'master')
+    subprocess.run(['git', 'clone', str(server), str(other)], check=True, capture_output=True)
+    return server,local,other
+
+def test_check_synced(tmp_path):
+    server,local,other = make_repos(tmp_path)
+    result = remotes.check([str(local)], 'origin')[0]
+    assert result['state'] == 'synced'
+    assert result['error'] is None
+
+def test_check_ahead(tmp_path):
+    server,local,other = make_repos(tmp_path)
+    commit(local, 'changelog', 'local change')
+    assert remotes.check([str(local)], 'origin')[0]['state'] == 'ahead'
+
+def test_check_behind(tmp_path):
+    server,local,other = make_repos(tmp_path)
+    commit(other, 'changelog', 'someone else')
+    git(other, 'push', 'origin', 'master')
+    assert remotes.check([str(local)], 'origin')[0]['state'] == 'behind'
+
+def test_check_diverged(tmp_path):
+    server,local,other = make_repos(tmp_path)
+    commit(other, 'changelog', 'someone else')
+    git(other, 'push', 'origin', 'master')
+    git(local, 'fetch', 'origin')
+    commit(local, 'control', 'local change')
+    assert remotes.check([str(local)], 'origin')[0]['state'] == 'diverged'
+
+def test_check_no_remote(tmp_path):
+    server,local,other = make_repos(tmp_path)
+    result = remotes.check([str(local)], 'nosuchremote')[0]
+    assert result['state'] == 'unknown'
+    assert result['error']
+
+def test_write_read(tmp_path):
+    server,local,other = make_repos(tmp_path)
+    (tmp_path / 'tmp').mkdir()
+    remotes.write(str(tmp_path), remotes.check([str(local)], 'origin'))
+    data = remotes.read(str(tmp_path), 'ddr-test-123')
+    assert data['state'] == 'synced'
+    assert remotes.read(str(tmp_path), 'ddr-test-999') is None
+
+def test_stored_behind_synced_but_stale_row(tmp_path):
+    """Row written before a sync still says behind; local now has the commit
+    """
+    server,local,other = make_repos(tmp_path)
+    (tmp_path / 'tmp').mkdir()
+    commit(other, 'changelog', 'someone else')
+    git(other, 'push', 'origin', 'master')
+    remotes.write(str(tmp_path), remotes.check([str(local)], 'origin'))
+    data = remotes.read(str(tmp_path), 'ddr-test-123')
+    assert data['state'] == 'behind'
+    assert remotes.stored_behind(str(local), data, 60) is True
+    git(local, 'pull', '-q', 'origin', 'master')
+    assert remotes.stored_behind(str(local), data, 60) is False
+
+def test_stored_behind_old_or_missing_row(tmp_path):
+    server,local,other = make_repos(tmp_path)
+    (tmp_path / 'tmp').mkdir()
+    assert remotes.stored_behind(str(local), None, 60) is None
+    remotes.write(str(tmp_path), remotes.check([str(local)], 'origin'))
+    data = remotes.read(str(tmp_path), 'ddr-test-123')
+    assert remotes.stored_behind(str(local), data, 60) is False
+    assert remotes.stored_behind(str(local), data, -1) is None
+
+def test_refresh(tmp_path):
+    server,local,other = make_repos(tmp_path)
+    (tmp_path / 'tmp').mkdir()
+    commit(other, 'changelog', 'someone else')
+    git(other, 'push', 'origin', 'master')
+    remotes.write(str(tmp_path), remotes.check([str(local)], 'origin'))
+    git(local, 'pull', '-q', 'origin', 'master')
+    assert remotes.refresh(str(tmp_path), str(local), 'origin')['state'] == 'synced'
+    assert remotes.read(str(tmp_path), 'ddr-test-123')['state'] == 'synced'
@@ -320,6 +320,24 @@ class TaskView(TestCase):
     # webui-tasks-dismiss
 
 
+class GitstatusView(TestCase):
+
+    def test_gitstatus_summary(self):
+        response = self.client.get(reverse('webui-gitstatus-summary'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('total', response.json())
+
+    def test_modeldefs_report(self):
+        response = self.client.get(reverse('webui-modeldefs-report'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('documents', response.json())
+
+    def test_querycache_stats(self):
+        response = self.client.get(reverse('webui-querycache-stats'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('hit_rate', response.json())
+
+
 # webui-gitstatus-queue
 # webui-gitstatus-toggle
 # webui-restart
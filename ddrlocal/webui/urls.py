@@ -5,8 +5,9 @@ from rest_framework.schemas import get_schema_view
 
 from webui import api
 from webui.views import LoginOffline, login, logout
-from webui.views import task_status, task_dismiss, task_list
-from webui.views import gitstatus_queue, gitstatus_toggle
+from webui.views import task_status, task_events, task_dismiss, task_list
+from webui.views import gitstatus_queue, gitstatus_summary, gitstatus_toggle
+from webui.views import docstore_stats, modeldefs_report, querycache_stats
 from webui.views import repository, organizations, collections, entities, files
 from webui.views import detail, merge, search
 from webui.views import batch
@@ -20,11 +21,16 @@ urlpatterns = [
     # admin
 
     path('task-status/', task_status, name='webui-task-status'),
+    path('task-events/', task_events, name='webui-task-events'),
     path('tasks/<slug:task_id>/dismiss/', task_dismiss, name='webui-tasks-dismiss'),
     path('tasks/', task_list, name='webui-tasks'),
     
     path('gitstatus-queue/', gitstatus_queue, name='webui-gitstatus-queue'),
+    path('gitstatus-summary/', gitstatus_summary, name='webui-gitstatus-summary'),
     path('gitstatus-toggle/', gitstatus_toggle, name='webui-gitstatus-toggle'),
+    path('modeldefs-report/', modeldefs_report, name='webui-modeldefs-report'),
+    path('docstore-stats/', docstore_stats, name='webui-docstore-stats'),
+    path('querycache-stats/', querycache_stats, name='webui-querycache-stats'),
     
     path('restart/', TemplateView.as_view(template_name="webui/restart-park.html"), name='webui-restart'),
     #path('supervisord/procinfo.html', supervisord.procinfo_html, name='webui-supervisord-procinfo-html'),
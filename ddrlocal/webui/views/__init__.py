@@ -2,10 +2,13 @@ import json
 import logging
 logger = logging.getLogger(__name__)
 import os
+import time
+
+from celery import states
 
 from django.conf import settings
 from django.contrib import messages
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect, StreamingHttpResponse
 from django.shortcuts import render
 from django.urls import reverse
 from django.views import View
@@ -15,15 +18,72 @@ from DDR import idservice
 
 from webui import cache
 from webui import WEBUI_MESSAGES
+from webui import docstores
 from webui import gitstatus
 from webui.decorators import ddrview
 from webui import forms
 from webui import identifier
+from webui import modeldefs
+from webui import progress
+from webui import querycache
 from webui.tasks import common as common_tasks
 from webui.views.decorators import login_required
 
 # helpers --------------------------------------------------------------
 
+# task_events connections are closed after this many seconds
+# and the browser reconnects after TASK_EVENTS_RETRY milliseconds,
+# or TASK_EVENTS_IDLE_RETRY if there were no unfinished tasks
+# (e.g. to pick up a task started in another tab).
+TASK_EVENTS_TIMEOUT = 60
+TASK_EVENTS_RETRY = 3000
+TASK_EVENTS_IDLE_RETRY = 30000
+TASK_EVENTS_KEEPALIVE = 15
+
+def _sse(data, event=None):
+    lines = []
+    if event:
+        lines.append('event: %s' % event)
+    lines.append('data: %s' % json.dumps(data))
+    return '\n'.join(lines) + '\n\n'
+
+def _task_events(task_ids):
+    """Yields server-sent events for tasks until one finishes or timeout
+    """
+    if not task_ids:
+        yield 'retry: %s\n\n' % TASK_EVENTS_IDLE_RETRY
+        yield _sse({}, 'idle')
+        return
+    yield 'retry: %s\n\n' % TASK_EVENTS_RETRY
+    pubsub = cache.redis_connection().pubsub(ignore_subscribe_messages=True)
+    # subscribe before reading snapshots so no update falls in between
+    pubsub.subscribe(progress.PROGRESS_CHANNEL)
+    try:
+        for data in progress.snapshots(task_ids).values():
+            if data['state'] in states.READY_STATES:
+                yield _sse(data, 'done')
+                return
+            yield _sse(data)
+        now = time.time()
+        deadline = now + TASK_EVENTS_TIMEOUT
+        keepalive = now + TASK_EVENTS_KEEPALIVE
+        while time.time() < deadline:
+            message = pubsub.get_message(timeout=1.0)
+            if not message:
+                if time.time() > keepalive:
+                    keepalive = time.time() + TASK_EVENTS_KEEPALIVE
+                    yield ': keepalive\n\n'
+                continue
+            data = json.loads(message['data'])
+            if data.get('task_id') not in task_ids:
+                continue
+            if data['state'] in states.READY_STATES:
+                yield _sse(data, 'done')
+                return
+            yield _sse(data)
+    finally:
+        pubsub.close()
+
 
 # views ----------------------------------------------------------------
 
@@ -188,16 +248,47 @@ def logout( request ):
 def gitstatus_queue(request):
     text = None
     try:
-        path = gitstatus.queue_path(settings.MEDIA_BASE)
-        assert os.path.exists(path)
-        with open(path, 'r') as f:
-            text = f.read()
-    except AssertionError:
+        queue = gitstatus.queue_read(settings.MEDIA_BASE)
+        try:
+            text = gitstatus.queue_dumps(gitstatus.queue_dict(queue))
+        finally:
+            queue.close()
+    except FileNotFoundError:
         text = None
     return render(request, 'webui/gitstatus-queue.html', {
         'text': text,
     })
 
+def gitstatus_summary(request):
+    """Store-wide sync-status counts and per-collection states as JSON
+    """
+    summary = gitstatus.sync_summary(settings.MEDIA_BASE)
+    for state in summary['collections'].values():
+        if state['timestamp']:
+            state['timestamp'] = converters.datetime_to_text(state['timestamp'])
+    return HttpResponse(json.dumps(summary), content_type="application/json")
+
+def modeldefs_report(request):
+    """Latest list of documents out of date with model definitions, as JSON
+    """
+    data = modeldefs.read_report(settings.MEDIA_BASE)
+    if data is None:
+        data = {'timestamp': None, 'counts': {}, 'documents': []}
+    return HttpResponse(json.dumps(data), content_type="application/json")
+
+def docstore_stats(request):
+    """Elasticsearch client/connection reuse in this process, as JSON
+    """
+    data = docstores.stats()
+    data['pid'] = os.getpid()
+    return HttpResponse(json.dumps(data), content_type="application/json")
+
+def querycache_stats(request):
+    """Search cache hit rate and Elasticsearch time spent/saved, as JSON
+    """
+    data = querycache.stats()
+    return HttpResponse(json.dumps(data), content_type="application/json")
+
 def task_list( request ):
     """Show pending/successful/failed tasks; UI for dismissing tasks.
     """
@@ -244,6 +335,28 @@ def task_status( request ):
         'dismiss_next': request.GET.get('this', reverse('webui-index'))
     })
 
+def task_events( request ):
+    """Server-sent events with progress of this session's unfinished tasks
+    
+    Sends progress messages published by tasks (see webui.progress) as they
+    arrive, and a 'done' event when a task finishes so the page can reload
+    the task list.  Sends 'idle' if there are no unfinished tasks; the
+    browser checks again after TASK_EVENTS_IDLE_RETRY.
+    """
+    task_ids = list(request.session.get(settings.CELERY_TASKS_SESSION_KEY, {}).keys())
+    unfinished = [
+        task_id
+        for task_id,state in common_tasks.task_states(task_ids).items()
+        if state['status'] not in states.READY_STATES
+    ]
+    response = StreamingHttpResponse(
+        _task_events(unfinished), content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    # don't let nginx buffer the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 @login_required
 def task_dismiss( request, task_id ):
     common_tasks.dismiss_session_task(
@@ -15,14 +15,15 @@ from django.shortcuts import Http404, render
 from django.urls import reverse
 
 from DDR import converters
-from DDR import docstore
 from DDR import dvcs
 
 from elastictools.docstore import TransportError
 from elastictools import search
 from storage.decorators import storage_required
 from webui import WEBUI_MESSAGES
+from webui import catalog
 from webui import csvio
+from webui import docstores
 from webui.decorators import ddrview
 from webui.forms import DDRForm
 from webui.forms.collections import NewCollectionForm, UploadFileForm
@@ -31,6 +32,7 @@ from webui.forms.collections import ReindexConfirmForm
 from webui import gitolite
 from webui.gitstatus import repository, annex_info
 from webui.models import Organization, Collection, INDEX_PREFIX
+from webui.models import repo_models_valid
 from webui.identifier import Identifier, InvalidIdentifierException
 from webui.tasks import collection as collection_tasks
 from webui.views.decorators import login_required
@@ -96,6 +98,7 @@ def detail( request, cid ):
     collection.model_def_fields()
     alert_if_conflicted(request, collection)
     return render(request, 'webui/collections/detail.html', {
+        'models_valid': repo_models_valid(request),
         'organization': organization,
         'collection': collection,
         'collection_unlock_url': collection.unlock_url(),
@@ -107,12 +110,25 @@ def detail( request, cid ):
 def children( request, cid ):
     collection = Collection.from_identifier(Identifier(cid))
     alert_if_conflicted(request, collection)
-    objects = collection.children()
+    # catalog is kept up to date by saves, syncs, and gitstatus
+    # (see webui.catalog); only build it here if there is none yet
+    if not catalog.built(settings.MEDIA_BASE, collection.id):
+        catalog.update(settings.MEDIA_BASE, collection.path_abs)
+    objects = catalog.CatalogList(settings.MEDIA_BASE, collection.id, collection.id)
     # paginate
     thispage = request.GET.get('page', 1)
     paginator = Paginator(objects, settings.RESULTS_PER_PAGE)
     page = paginator.page(thispage)
+    for o in page.object_list:
+        o['absolute_url'] = reverse('webui-entity', args=[o['id']])
+        o['signature_abs'] = None
+        if o['signature_id']:
+            try:
+                o['signature_abs'] = Identifier(o['signature_id']).path_abs('access')
+            except Exception:
+                pass
     return render(request, 'webui/collections/entities.html', {
+        'models_valid': repo_models_valid(request),
         'collection': collection,
         'paginator': paginator,
         'page': page,
@@ -244,7 +260,7 @@ def new_manual( request, oid ):
         messages.error(request, WEBUI_MESSAGES['LOGIN_REQUIRED'])
     
     oidentifier = Identifier(oid).object()
-    idparts = oidentifier.idparts
+    idparts = oidentifier.idparts.copy()
     collection_ids = sorted([
         os.path.basename(cpath)
         for cpath in Collection.collection_paths(
@@ -319,8 +335,7 @@ def edit( request, cid ):
         )
         return HttpResponseRedirect(collection.absolute_url())
     if not settings.OFFLINE:
-        collection.repo_fetch()
-        if collection.repo_behind():
+        if collection.repo_behind() or collection.remote_behind():
             messages.error(
                 request,
                 WEBUI_MESSAGES['VIEWS_COLL_BEHIND'].format(collection.id)
@@ -539,7 +554,7 @@ def check(request, cid):
 def reindex(request, cid):
     # nice UI if Elasticsearch is down
     try:
-        docstore.DocstoreManager(INDEX_PREFIX, settings.DOCSTORE_HOST, settings).status()
+        docstores.manager(INDEX_PREFIX, settings.DOCSTORE_HOST).status()
     except TransportError:
         messages.error(
             request, "<b>TransportError</b>: Cannot connect to search engine."
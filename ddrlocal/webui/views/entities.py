@@ -25,7 +25,9 @@ from webui.forms import ObjectIDForm
 from webui.forms.entities import DeleteEntityForm, RmDuplicatesForm
 from webui.gitstatus import repository, annex_info
 from webui.identifier import Identifier
+from webui import indexqueue
 from webui.models import Stub, Collection, Entity
+from webui.models import repo_models_valid
 from webui.tasks import entity as entity_tasks
 from webui.tasks import dvcs as dvcs_tasks
 from webui.views.decorators import login_required
@@ -192,9 +194,7 @@ def check_parent(collection, check_locks=True, fetch=True):
         )
         return HttpResponseRedirect(collection.absolute_url())
     if not settings.OFFLINE:
-        if fetch:
-            collection.repo_fetch()
-        if collection.repo_behind():
+        if collection.repo_behind() or (fetch and collection.remote_behind()):
             messages.error(
                 request, WEBUI_MESSAGES['VIEWS_COLL_BEHIND'].format(collection.id)
             )
@@ -212,6 +212,7 @@ def detail( request, eid ):
     entity.model_def_fields()
     tasks = request.session.get('celery-tasks', [])
     return render(request, 'webui/entities/detail.html', {
+        'models_valid': repo_models_valid(request),
         'collection': collection,
         'entity': entity,
         'children_urls': entity.children_urls(),
@@ -237,6 +238,7 @@ def children(request, eid):
     )
     page = paginator.page(thispage)
     return render(request, 'webui/entities/children.html', {
+        'models_valid': repo_models_valid(request),
         'collection': collection,
         'entity': entity,
         'children_models': [m for m in CHILDREN['entity'] if m not in NODES],
@@ -259,6 +261,7 @@ def file_role( request, rid ):
     paginator = Paginator(files, settings.RESULTS_PER_PAGE)
     page = paginator.page(thispage)
     return render(request, 'webui/entities/files.html', {
+        'models_valid': repo_models_valid(request),
         'collection': collection,
         'entity': entity,
         'children_urls': entity.children_urls(active=role),
@@ -331,10 +334,7 @@ def _create_entity(request, eidentifier, collection, git_name, git_mail):
         logger.error(status)
         messages.error(request, WEBUI_MESSAGES['ERROR'].format(status))
     else:
-        dvcs_tasks.gitstatus_update.apply_async(
-            (collection.path,),
-            countdown=2
-        )
+        dvcs_tasks.gitstatus_request(collection.path)
     return entity
 
 @ddrview
@@ -632,14 +632,8 @@ def files_dedupe( request, eid ):
                 messages.error(request, WEBUI_MESSAGES['ERROR'].format(status))
             else:
                 # update search index
-                try:
-                    entity.post_json()
-                except ConnectionError:
-                    logger.error('Could not post to Elasticsearch.')
-                dvcs_tasks.gitstatus_update.apply_async(
-                    (collection.path,),
-                    countdown=2
-                )
+                indexqueue.post(entity)
+                dvcs_tasks.gitstatus_request(collection.path)
                 # positive feedback
                 messages.success(request, success_msg)
                 return HttpResponseRedirect(entity.absolute_url())
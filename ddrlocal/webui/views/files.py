@@ -18,6 +18,7 @@ from webui.forms.files import shared_folder_files
 from webui.gitstatus import repository, annex_whereis_file
 from webui.models import Stub, Entity, File
 from webui.models import MODULES
+from webui.models import repo_models_valid
 from webui.identifier import Identifier
 from webui.tasks import files as file_tasks
 from webui.views.decorators import login_required
@@ -83,9 +84,7 @@ def check_parents(entity, collection, request, check_locks=True, fetch=True):
         )
         return HttpResponseRedirect(entity.absolute_url())
     if not settings.OFFLINE:
-        if fetch:
-            collection.repo_fetch()
-        if collection.repo_behind():
+        if collection.repo_behind() or (fetch and collection.remote_behind()):
             messages.error(
                 request,
                 WEBUI_MESSAGES['VIEWS_COLL_BEHIND'].format(collection.id)
@@ -113,6 +112,7 @@ def detail( request, fid ):
     else:
         annex_whereis = {}
     return render(request, 'webui/files/detail.html', {
+        'models_valid': repo_models_valid(request),
         'collection': collection,
         'entity': entity,
         'role': file_.identifier.parts['role'],
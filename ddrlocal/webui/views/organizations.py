@@ -6,7 +6,9 @@ from django.shortcuts import Http404, render
 
 from storage.decorators import storage_required
 from webui import gitolite
+from webui import gitstatus
 from webui.models import Organization
+from webui.models import repo_models_valid
 
 
 @storage_required
@@ -17,9 +19,17 @@ def list(request):
     index = [n for n,o in enumerate(organizations) if o['id'] == 'ddr-densho'][0]
     densho = organizations.pop(index)
     organizations.insert(0, densho)
+    # sync-status counts for all organizations from one read of the aggregate
+    summary = gitstatus.sync_summary(settings.MEDIA_BASE)
     # image link
     for org in organizations:
         org['img'] = f"{settings.MEDIA_URL}ddr/{org['id']}/logo.png"
+        counts = summary['organizations'].get(org['id'], {})
+        org['sync_counts'] = [
+            (status, counts[status], color)
+            for status,color in gitstatus.SYNC_STATUS_BOOTSTRAP_COLOR.items()
+            if counts.get(status)
+        ]
     # make densho first
     return render(request, 'webui/organizations/list.html', {
         'organizations': organizations,
@@ -32,7 +42,14 @@ def detail(request, oid):
     organization = Organization.get(oid, settings.MEDIA_BASE)
     organization['img'] = f"{settings.MEDIA_URL}ddr/{oid}/logo.png"
     collections = Organization.children(org_path)
+    # sync status for all collections from one read of the aggregate
+    states = gitstatus.sync_states(settings.MEDIA_BASE, oid)
+    for collection in collections:
+        collection['sync_status'] = states.get(
+            collection['id'], gitstatus.SYNC_STATE_UNKNOWN
+        )
     return render(request, 'webui/organizations/detail.html', {
+        'models_valid': repo_models_valid(request),
         'organization': organization,
         'num_collections': len(collections),
         'collections': collections,
@@ -18,7 +18,8 @@ from ..forms import search as forms
 from .. import identifier
 from .. import models
 from ..decorators import ui_state
-from ..models import docstore
+from .. import docstores
+from .. import querycache
 
 
 def _mkurl(request, path, query=None):
@@ -102,9 +103,7 @@ def search_ui(request, obj=None):
     
     # nice UI if Elasticsearch is down
     try:
-        ds = docstore.DocstoreManager(
-            models.INDEX_PREFIX, settings.DOCSTORE_HOST, settings
-        )
+        ds = docstores.manager(models.INDEX_PREFIX, settings.DOCSTORE_HOST)
         ds.status()
     except TransportError:
         messages.error(
@@ -128,9 +127,7 @@ def search_ui(request, obj=None):
         # search narrator
         elif obj.model == 'narrator':
             context['template_extends'] = "ui/narrators/base.html"
-    ds = docstore.DocstoreManager(
-        models.INDEX_PREFIX, settings.DOCSTORE_HOST, settings
-    )
+    ds = docstores.manager(models.INDEX_PREFIX, settings.DOCSTORE_HOST)
     searcher = search.Searcher(ds)
     if request.GET.get('fulltext'):
         # Redirect if fulltext is a DDR ID
@@ -175,6 +172,7 @@ def search_ui(request, obj=None):
     
     if searcher.params.get('fulltext'):
         limit,offset = limit_offset(request)
+        querycache.enable(searcher)
         results = searcher.execute(limit, offset)
         paginator = Paginator(
             results.ordered_dict(